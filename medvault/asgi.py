@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Serve with an ASGI server (e.g. ``uvicorn medvault.asgi:application``) to get
+the async search endpoint (/api/search/async), whose concurrent requests share
+micro-batched query embedding (SEARCH_EMBED_BATCH_* settings).
 """
 
 import os
@@ -170,10 +170,50 @@ LOGIN_REDIRECT_URL = 'dashboard_redirect'
 LOGOUT_REDIRECT_URL = 'home' # You can create a home view later
 
 EMBED_MODEL = "pritamdeka/S-BioBERT-MiniLM-L6-v2"
+EMBED_BACKEND = "torch"                     # "torch" | "onnx" | "onnx_int8" (export: manage.py export_embedding_model)
+EMBED_ONNX_DIR = BASE_DIR / "var" / "onnx"
+EMBED_ONNX_QUANT_CONFIG = "avx2"
+EMBED_CACHE_MAX_ENTRIES = 4096              # query-embedding LRU (0 disables)
+EMBED_CACHE_MAX_BYTES = 32 * 1024 * 1024
+EMBED_STORE_ENABLED = True                  # persist document vectors by content hash (FAISS_DIR/embeddings)
 FAISS_DIR = BASE_DIR / "var" / "faiss"
+# Index layout: "flat" (exact), "ivf_flat", "ivf_pq" or "hnsw"; see search/faiss_store.py for knobs.
+# Pick an operating point with: python manage.py faiss_recall_report
+FAISS_INDEX_SPEC = {"type": "flat"}
+FAISS_WAL_MAX_BYTES = 64 * 1024 * 1024     # compact the update journal past this size
+FAISS_SNAPSHOT_INTERVAL = 3600             # ...or when the snapshot is older than this (seconds)
+FAISS_TOMBSTONE_RATIO = 0.2                # ...or once this fraction of snapshot vectors is deleted/replaced
+FAISS_DELTA_MAX = 10_000                   # ...or once this many changed vectors sit beside the snapshot
+FAISS_MMAP = False                         # serve a read-only mmap of the snapshot shared across workers
+FAISS_RELOAD_CHECK_S = 0.0                 # min seconds between index-generation checks (0 = every search)
+FAISS_REBUILD_WORKERS = 2                  # encoder threads used by rebuild_index / build_faiss_index
+FAISS_REBUILD_CHECKPOINT_EVERY = 50_000    # docs between rebuild checkpoints (build_faiss_index --resume)
+SEARCH_INDEX_ASYNC = True                  # doctor saves queue index updates for the background indexer
+SEARCH_INDEX_BATCH_SIZE = 64
+SEARCH_INDEX_DEBOUNCE_MS = 200
+SEARCH_EMBED_BATCH_MAX_ITEMS = 32          # /api/search/async: queries per shared encode() call
+SEARCH_EMBED_BATCH_WAIT_MS = 3             # ...or dispatch this long after the first query arrived
+SEARCH_QUERY_LOG_ENABLED = True            # buffer searches into PatientQueryLog (bulk-written off the request path)
+SEARCH_QUERY_LOG_SAMPLE_RATE = 1.0         # fraction of searches logged
+SEARCH_QUERY_LOG_CAPACITY = 10_000         # ring buffer size; oldest entries dropped when full
+SEARCH_QUERY_LOG_BATCH_SIZE = 500
+SEARCH_QUERY_LOG_FLUSH_S = 2.0
+SEARCH_RESPONSE_CACHE_BACKEND = "local"    # "local" (per process), "django" (CACHES alias below) or "off"
+SEARCH_RESPONSE_CACHE_ALIAS = "default"
+SEARCH_RESPONSE_CACHE_TTL_S = 60
+SEARCH_RESPONSE_CACHE_MAX_ENTRIES = 2048   # "local" only; Django caches bound themselves
+SEARCH_SERVER_TIMING = False               # Server-Timing header with per-stage durations on search responses
+SEARCH_METRICS_ENABLED = True              # /api/metrics: Prometheus text (stage latency histograms, p50/p95/p99)
+SEARCH_METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]  # clients allowed to scrape it (empty = anyone)
+SEARCH_OVERFETCH = 5                       # rerank window = topk * this
+SEARCH_MAX_WIDEN_ROUNDS = 3                # widen the window when filters leave too few candidates
+SEARCH_DOCTOR_STORE_SYNC_S = 2.0           # re-read doctors changed by other processes this often (and on index changes)
 TIME_ZONE = "Asia/Kolkata"
 
 SPECIALTY_ONTOLOGY_PATH = BASE_DIR / "config" / "specialty_ontology.yml"
+PINCODE_CENTROIDS_PATH = BASE_DIR / "config" / "pincode_centroids.yml"
+SEARCH_GEO_RADIUS_KM = 50                  # distance at which geo proximity reaches 0
+SEARCH_LANGUAGE_CODES = "myapp.models.LANGUAGE_CODES"  # codes language filters/scores know (dotted path or list)
 DOCTOR_MODEL = "myapp.Doctor"   # <-- use your actual app label & model
 
 REST_FRAMEWORK = {
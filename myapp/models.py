@@ -98,6 +98,38 @@ class Doctor(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     text_block = models.TextField(blank=True)
 
+    # Fields the search index depends on; save() records how they changed so
+    # the search signals can skip re-embedding when neither did.
+    INDEX_TRACKED_FIELDS = ("text_block", "is_active")
+    # Fields build_text_block() reads
+    TEXT_BLOCK_SOURCES = ("specialties", "about", "treatments", "hospital")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_tracked_fields()
+        return instance
+
+    def _remember_tracked_fields(self):
+        # Deferred fields aren't in __dict__; they count as unknown (always dirty)
+        self._tracked_state = {f: self.__dict__[f] for f in self.INDEX_TRACKED_FIELDS if f in self.__dict__}
+
+    def tracked_changes(self):
+        """
+        {field: (old, new)} for INDEX_TRACKED_FIELDS that differ from the
+        values last loaded from / saved to the DB, or None when this instance
+        wasn't loaded from the DB (nothing to compare against).
+        """
+        state = getattr(self, "_tracked_state", None)
+        if state is None:
+            return None
+        changes = {}
+        for f in self.INDEX_TRACKED_FIELDS:
+            new = getattr(self, f)
+            if f not in state or state[f] != new:
+                changes[f] = (state.get(f), new)
+        return changes
+
     def __str__(self):
         display = self.name.strip() if self.name else f"{self.user.first_name} {self.user.last_name}".strip()
         return f"Dr. {display}".strip() or f"Dr. {self.user.username}"
@@ -131,8 +163,23 @@ class Doctor(models.Model):
             full = f"{self.user.first_name} {self.user.last_name}".strip()
             self.name = full or self.user.get_username()
 
-        self.text_block = self.build_text_block()
+        # Rebuild text_block only when its sources are being written, and then
+        # write it too: the post_save signal indexes it, so it must match the row
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None:
+            self.text_block = self.build_text_block()
+        elif {"text_block", *self.TEXT_BLOCK_SOURCES} & set(update_fields):
+            self.text_block = self.build_text_block()
+            if "text_block" not in update_fields:
+                update_fields = kwargs["update_fields"] = [*update_fields, "text_block"]
+        # Read by the post_save signal; fields left out of update_fields aren't written
+        changes = self.tracked_changes()
+        if changes is not None and update_fields is not None:
+            changes = {f: c for f, c in changes.items() if f in update_fields}
+        self._saved_changes = changes
         super().save(*args, **kwargs)
+        saved = [f for f in self.INDEX_TRACKED_FIELDS if update_fields is None or f in update_fields]
+        self._tracked_state = {**getattr(self, "_tracked_state", {}), **{f: getattr(self, f) for f in saved}}
 
 
 
@@ -1,8 +1,13 @@
 from django.urls import path
-from .api_views import SearchView
+from django.views.decorators.csrf import csrf_exempt
+from .api_views import SearchView, AsyncSearchView, BatchSearchView, NearbyDoctorsView, MetricsView
 from .views import search_test_page
 
 urlpatterns = [
     path("search", SearchView.as_view(), name="api_search"),
+    path("search/async", csrf_exempt(AsyncSearchView.as_view()), name="api_search_async"),
+    path("search/batch", BatchSearchView.as_view(), name="api_search_batch"),
+    path("doctors/nearby", NearbyDoctorsView.as_view(), name="api_doctors_nearby"),
+    path("metrics", MetricsView.as_view(), name="api_metrics"),
     path("search/test", search_test_page, name="search_test_page"),  # simple UI
 ]
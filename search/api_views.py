@@ -1,20 +1,275 @@
 from __future__ import annotations
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import math
 
-from django.apps import apps
+import numpy as np
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from .faiss_store import search_knn
-from .rerank import rerank
+from .batcher import get_batcher
+from .doctor_store import DoctorAttributeStore, get_doctor_store
+from .embedding import encode
+from .faiss_store import index_size, index_spec, search_vectors
+from .geo import pincode_centroid
+from .metrics import render_prometheus, request_timings, server_timing, timed
+from .ontology import get_ontology
+from .query_log import log_search
+from .response_cache import get_response_cache, request_key
+from .singleflight import get_search_flight
+from .rerank import rerank_columns
 
-_DOCTOR_LABEL = getattr(settings, "DOCTOR_MODEL", "doctors.Doctor")
+# Upper bound on queries accepted by /api/search/batch in one request
+_BATCH_MAX_QUERIES = int(getattr(settings, "SEARCH_BATCH_MAX_QUERIES", 500))
+# Rerank window = topk * _OVERFETCH; widened (x4, up to _MAX_WIDEN_ROUNDS times)
+# only when too few retrieved candidates survive the active/attribute checks.
+_OVERFETCH = int(getattr(settings, "SEARCH_OVERFETCH", 5))
+_MAX_WIDEN_ROUNDS = int(getattr(settings, "SEARCH_MAX_WIDEN_ROUNDS", 3))
+# Radius queries: default and maximum radius (km), and result cap
+_NEARBY_DEFAULT_KM = float(getattr(settings, "SEARCH_NEARBY_DEFAULT_KM", 10.0))
+_NEARBY_MAX_KM = float(getattr(settings, "SEARCH_NEARBY_MAX_KM", 200.0))
+_NEARBY_MAX_RESULTS = int(getattr(settings, "SEARCH_NEARBY_MAX_RESULTS", 100))
+# Per-stage timings: a Server-Timing header on search responses (a "debug"
+# block is added when the payload sets "debug": true), and /api/metrics,
+# served only to the listed client addresses (empty = anyone).
+_SERVER_TIMING = bool(getattr(settings, "SEARCH_SERVER_TIMING", False))
+_METRICS_ENABLED = bool(getattr(settings, "SEARCH_METRICS_ENABLED", True))
+_METRICS_ALLOWED_IPS = frozenset(getattr(settings, "SEARCH_METRICS_ALLOWED_IPS", ("127.0.0.1", "::1")))
 
-def _DoctorModel():
-    app_label, model_name = _DOCTOR_LABEL.split(".")
-    return apps.get_model(app_label, model_name)
+# (city, pincode_prefix, languages) hard filters, or None for "active doctors only"
+Filters = Optional[Tuple[str, str, Tuple[str, ...]]]
+
+def _parse_filters(raw: Any) -> Filters:
+    if raw in (None, {}):
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError("filters must be an object")
+    langs = raw.get("languages") or []
+    if not isinstance(langs, list):
+        raise ValueError("filters.languages must be a list")
+    out = (
+        str(raw.get("city", "") or "").strip(),
+        str(raw.get("pincode_prefix", "") or "").strip(),
+        tuple(sorted(str(l) for l in langs)),
+    )
+    return out if any(out) else None
+
+def _parse_location(data: Dict[str, Any], pincode: str) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Patient coordinates from latitude/longitude, else the pincode centroid table.
+    """
+    lat, lon = data.get("latitude"), data.get("longitude")
+    if lat in (None, "") and lon in (None, ""):
+        return pincode_centroid(pincode) or (None, None)
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise ValueError("latitude and longitude must both be numbers")
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        raise ValueError("latitude/longitude out of range")
+    return lat, lon
+
+def _parse_query(data: Dict[str, Any], default_topk: Any = None) -> Tuple[Dict[str, Any], int, Filters]:
+    """
+    Validate one search payload and return (patient, topk, filters).
+    Raises ValueError with a client-facing message on bad input.
+    """
+    symptoms = str(data.get("symptoms", "") or "").strip()
+    history = str(data.get("history", "") or "").strip()
+    city = str(data.get("city", "") or "").strip()
+    pincode = str(data.get("pincode", "") or "").strip()
+    languages = data.get("languages") or []
+    if not isinstance(languages, list):
+        raise ValueError("languages must be a list")
+
+    try:
+        topk = int(data.get("topk", default_topk))
+    except Exception:
+        raise ValueError("topk is required and must be an integer")
+
+    # Clamp topk to reasonable bounds
+    topk = max(1, min(50, topk))
+
+    lat, lon = _parse_location(data, pincode)
+
+    patient = {
+        "symptoms": symptoms,
+        "history": history,
+        "city": city,
+        "pincode": pincode,
+        "languages": languages,
+        "lat": lat,
+        "lon": lon,
+    }
+    return patient, topk, _parse_filters(data.get("filters"))
+
+def _query_text(patient: Dict[str, Any]) -> str:
+    # Build query text for semantic retrieval
+    return f"Symptoms: {patient['symptoms']}\nHistory: {patient['history']}".strip()
+
+def _window(store: DoctorAttributeStore, hits: List[Tuple[int, float]],
+            want: int) -> Tuple[List[Tuple[int, float]], bool]:
+    """
+    The leading hits that hold `want` active doctors, and whether there were
+    that many. Cutting there makes a query's rerank window independent of how
+    far its search was fetched (e.g. for a larger topk in the same batch).
+    """
+    alive = np.flatnonzero(store.active_mask(pk for pk, _ in hits))
+    if alive.size < want:
+        return hits, False
+    return hits[: int(alive[want - 1]) + 1], True
+
+def _retrieve(store: DoctorAttributeStore,
+              parsed: List[Tuple[Dict[str, Any], int, Filters]],
+              Q: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+    """
+    Embed all queries in one encode() call (unless already embedded: Q), then search once per distinct
+    filter set with the filter applied inside FAISS. Each query keeps the hits
+    up to its topk * _OVERFETCH-th live candidate (see _window); queries with
+    fewer are re-searched with a wider window (and nprobe/efSearch) until
+    enough survive or the filtered set is exhausted.
+    """
+    out: List[List[Tuple[int, float]]] = [[] for _ in parsed]
+    n_index = index_size()
+    if not parsed or n_index == 0:
+        return out
+
+    if Q is None:
+        Q = encode([_query_text(p) for p, _, _ in parsed], use_cache=True)
+    spec = index_spec()
+
+    groups: Dict[Filters, List[int]] = {}
+    for i, (_, _, filters) in enumerate(parsed):
+        groups.setdefault(filters, []).append(i)
+
+    for filters, idxs in groups.items():
+        with timed("attributes"):
+            allowed = store.filter_pks(*filters) if filters else None
+            bitmap = store.filter_bitmap(*filters) if filters else None
+        cap = n_index if allowed is None else min(n_index, len(allowed))
+        if cap == 0:
+            continue
+        want = {i: min(parsed[i][1] * _OVERFETCH, cap) for i in idxs}
+        fetch = max(parsed[i][1] for i in idxs) * _OVERFETCH
+        pending, scale = idxs, 1
+        for _ in range(1 + _MAX_WIDEN_ROUNDS):
+            rows = search_vectors(Q[pending], min(fetch, cap), allowed_ids=allowed, allowed_bitmap=bitmap,
+                                  nprobe=spec["nprobe"] * scale, ef_search=spec["ef_search"] * scale)
+            with timed("attributes"):
+                windows = {i: _window(store, hits, want[i]) for i, hits in zip(pending, rows)}
+            for i, (hits, _) in windows.items():
+                out[i] = hits
+            pending = [i for i, (_, full) in windows.items() if not full]
+            if not pending or fetch >= cap:
+                break
+            fetch, scale = fetch * 4, scale * 4
+    return out
+
+def _rank(store: DoctorAttributeStore, patient: Dict[str, Any],
+          hits: List[Tuple[int, float]], topk: int) -> List[Dict[str, Any]]:
+    """
+    Rerank FAISS hits straight from the in-memory attribute store (no ORM)
+    and build the response rows.
+    """
+    with timed("attributes"):
+        rows = store.select(pk for pk, _ in hits)  # active doctors only, FAISS order
+        if not rows.size:
+            return []
+        cols = store.columns(rows, get_ontology())
+    order, scores = rerank_columns(patient, cols, topk)
+    with timed("serialize"):
+        results = store.records(rows[order])
+        for rec, score in zip(results, scores[order].tolist()):
+            rec["score"] = round(float(score), 4)
+    return results
+
+def _cached(store: DoctorAttributeStore, parsed: List[Tuple[Dict[str, Any], int, Filters]]
+            ) -> Tuple[List[str], List[Optional[List[Dict[str, Any]]]]]:
+    """
+    Canonical request keys, and the response-cache lookup per query
+    (results, or None on a miss).
+    """
+    with timed("cache"):
+        keys = [request_key(patient, topk, filters) for patient, topk, filters in parsed]
+        cache = get_response_cache()
+        if not cache.enabled:
+            return keys, [None] * len(parsed)
+        return keys, [cache.get(key, store, filters) for key, (_, _, filters) in zip(keys, parsed)]
+
+def _search(store: DoctorAttributeStore, parsed: List[Tuple[Dict[str, Any], int, Filters]],
+            keys: List[str], Q: Optional[np.ndarray] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Retrieve and rank queries in one pass, storing each result under its cache key.
+    """
+    cache = get_response_cache()
+    out = []
+    for key, (patient, topk, filters), hits in zip(keys, parsed, _retrieve(store, parsed, Q=Q)):
+        results = _rank(store, patient, hits, topk) if hits else []
+        # Candidates, not just results: a change to any of them can reorder the top-k
+        with timed("cache"):
+            cache.put(key, results, store, [pk for pk, _ in hits], filters)
+        out.append(results)
+    return out
+
+def _serve(store: DoctorAttributeStore,
+           parsed: List[Tuple[Dict[str, Any], int, Filters]]) -> List[List[Dict[str, Any]]]:
+    """
+    Cached results where still valid. Misses identical to a search already
+    in flight (in this or another request) wait for and share its result;
+    the rest are searched together, with this request as their leader.
+    """
+    keys, out = _cached(store, parsed)
+    flight = get_search_flight()
+    leading: Dict[str, Tuple[Any, List[int]]] = {}
+    following: Dict[str, Tuple[Any, List[int]]] = {}
+    for i, results in enumerate(out):
+        if results is not None:
+            continue
+        key = keys[i]
+        group = leading.get(key) or following.get(key)
+        if group is not None:
+            group[1].append(i)
+            continue
+        fut, leader = flight.claim(key)
+        (leading if leader else following)[key] = (fut, [i])
+
+    if leading:
+        first = [idxs[0] for _, idxs in leading.values()]
+        try:
+            fresh = _search(store, [parsed[i] for i in first], [keys[i] for i in first])
+        except BaseException as e:
+            for key, (fut, _) in leading.items():
+                flight.finish(key, fut, error=e)
+            raise
+        for (key, (fut, idxs)), results in zip(leading.items(), fresh):
+            flight.finish(key, fut, results)
+            for i in idxs:
+                out[i] = results
+    # Only after finishing our own keys, so two requests can't wait on each other
+    for fut, idxs in following.values():
+        with timed("coalesced"):
+            results = fut.result()
+        for i in idxs:
+            out[i] = results
+    return out
+
+def _respond(make, body: Dict[str, Any], timings: Dict[str, float], debug: Any = False):
+    """
+    Build the response with `make` (Response or JsonResponse), reporting the
+    request's stage timings in a "debug" block and/or Server-Timing header.
+    """
+    if debug is True:
+        body["debug"] = {"timings_ms": {stage: round(ms, 3) for stage, ms in timings.items()}}
+    response = make(body, status=status.HTTP_200_OK)
+    if _SERVER_TIMING:
+        response["Server-Timing"] = server_timing(timings)
+    return response
 
 class SearchView(APIView):
     """
@@ -25,67 +280,178 @@ class SearchView(APIView):
       "city": "Mumbai",
       "pincode": "400001",
       "languages": ["en", "hi"],
-      "topk": 10
+      "latitude": 18.94, "longitude": 72.83,   # optional; else pincode centroid
+      "topk": 10,
+      "filters": {                     # optional hard filters, applied inside FAISS
+        "city": "Mumbai", "pincode_prefix": "400", "languages": ["hi"]
+      },
+      "debug": true                    # optional: add per-stage timings to the response
     }
     """
     def post(self, request, *args, **kwargs):
         data: Dict[str, Any] = request.data or {}
 
-        symptoms = str(data.get("symptoms", "") or "").strip()
-        history = str(data.get("history", "") or "").strip()
-        city = str(data.get("city", "") or "").strip()
-        pincode = str(data.get("pincode", "") or "").strip()
-        languages = data.get("languages") or []
-        if not isinstance(languages, list):
-            return Response({"error": "languages must be a list"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            patient, topk, filters = _parse_query(data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        with request_timings() as timings, timed("total"):
+            store = get_doctor_store()
+            # Over-fetch to give reranker room (topk * _OVERFETCH, widened if filtered out)
+            results = _serve(store, [(patient, topk, filters)])[0]
+        log_search(patient, _query_text(patient), topk, results)
+        return _respond(Response, {"results": results}, timings, data.get("debug"))
 
+def _index_is_empty() -> bool:
+    return index_size() == 0
+
+class AsyncSearchView(View):
+    """
+    POST /api/search/async   (same payload and response as /api/search)
+
+    Async variant for ASGI deployments (medvault/asgi.py). The query text is
+    embedded by the shared micro-batching server (search.batcher), so
+    concurrent requests share one encode() call; FAISS search and rerank then
+    run off the event loop.
+    """
+    async def post(self, request, *args, **kwargs):
         try:
-            topk = int(data.get("topk"))
-        except Exception:
-            return Response({"error": "topk is required and must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+            data = json.loads(request.body or b"{}")
+            if not isinstance(data, dict):
+                raise ValueError("request body must be a JSON object")
+            patient, topk, filters = _parse_query(data)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        text = _query_text(patient)
+        parsed = [(patient, topk, filters)]
+        with request_timings() as timings, timed("total"):
+            store = await sync_to_async(get_doctor_store, thread_sensitive=False)()
+            keys, cached = await sync_to_async(_cached, thread_sensitive=False)(store, parsed)
+            results = cached[0]
+            if results is None:
+                fut, leader = get_search_flight().claim(keys[0])
+                if leader:
+                    try:
+                        results = await self._compute(store, parsed, keys, text)
+                    except BaseException as e:
+                        get_search_flight().finish(keys[0], fut, error=e)
+                        raise
+                    get_search_flight().finish(keys[0], fut, results)
+                else:
+                    with timed("coalesced"):
+                        results = await asyncio.wrap_future(fut)
+        log_search(patient, text, topk, results)
+        return _respond(JsonResponse, {"results": results}, timings, data.get("debug"))
+
+    @staticmethod
+    async def _compute(store, parsed, keys, text) -> List[Dict[str, Any]]:
+        if await sync_to_async(_index_is_empty, thread_sensitive=False)():
+            return []
+        with timed("embed_wait"):  # queueing for, and sharing, a batched encode()
+            q = await get_batcher().embed(text)
+        return (await sync_to_async(_search, thread_sensitive=False)(store, parsed, keys, q[None, :]))[0]
 
-        # Clamp topk to reasonable bounds
-        topk = max(1, min(50, topk))
+class BatchSearchView(APIView):
+    """
+    POST /api/search/batch
+    {
+      "topk": 10,                      # optional default for queries without one
+      "queries": [
+        {"symptoms": "chest pain", "history": "diabetes", "city": "Mumbai", ...},
+        {"symptoms": "fever, cough", "topk": 5, ...}
+      ]
+    }
+    -> {"results": [[...], [...]]}    # one result list per query, in order
 
-        # Build query text for semantic retrieval
-        query_text = f"Symptoms: {symptoms}\nHistory: {history}".strip()
+    Queries not answered by the response cache are embedded with one encode()
+    call and searched with one FAISS call per distinct filter set; candidates
+    are ranked from the in-memory doctor attribute store.
+    """
+    def post(self, request, *args, **kwargs):
+        data: Dict[str, Any] = request.data or {}
 
-        # Over-fetch to give reranker room (x5 is a decent default)
-        initial = search_knn(query_text, topk=topk * 5)
-        if not initial:
+        queries = data.get("queries")
+        if not isinstance(queries, list):
+            return Response({"error": "queries must be a list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(queries) > _BATCH_MAX_QUERIES:
+            return Response(
+                {"error": f"at most {_BATCH_MAX_QUERIES} queries per batch"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not queries:
             return Response({"results": []}, status=status.HTTP_200_OK)
 
-        id_to_sim = {pk: sim for pk, sim in initial}
-        ids = [pk for pk, _ in initial]
-
-        Doctor = _DoctorModel()
-        docs = list(Doctor.objects.filter(pk__in=ids, is_active=True))
-
-        patient = {
-            "symptoms": symptoms,
-            "history": history,
-            "city": city,
-            "pincode": pincode,
-            "languages": languages,
-        }
-
-        ranked = rerank(patient, docs, id_to_sim)[:topk]
-
-        results = []
-        for r in ranked:
-            d = r["doctor"]
-            results.append({
-                "doctor_id": d.pk,
-                "name": getattr(d, "name", ""),
-                "specialties": getattr(d, "specialties", []),
-                "yoe": getattr(d, "years_of_experience", 0),
-                "hospital": getattr(d, "hospital", ""),
-                "city": getattr(d, "city", ""),
-                "pincode": getattr(d, "pincode", ""),
-                "languages": getattr(d, "languages", []),
-                "phone": getattr(d, "phone", ""),
-                "email": getattr(d, "email", ""),
-                "score": round(float(r["score"]), 4),
-            })
+        parsed: List[Tuple[Dict[str, Any], int, Filters]] = []
+        for i, q in enumerate(queries):
+            if not isinstance(q, dict):
+                return Response({"error": "each query must be an object", "index": i},
+                                status=status.HTTP_400_BAD_REQUEST)
+            try:
+                parsed.append(_parse_query(q, default_topk=data.get("topk")))
+            except ValueError as e:
+                return Response({"error": str(e), "index": i}, status=status.HTTP_400_BAD_REQUEST)
+
+        with request_timings() as timings, timed("total"):
+            store = get_doctor_store()
+            results = _serve(store, parsed)
+        for (patient, topk, _), rows in zip(parsed, results):
+            log_search(patient, _query_text(patient), topk, rows)
 
+        return _respond(Response, {"results": results}, timings, data.get("debug"))
+
+class NearbyDoctorsView(APIView):
+    """
+    GET|POST /api/doctors/nearby
+    {"latitude": 18.94, "longitude": 72.83, "radius_km": 10, "limit": 20}
+    or {"pincode": "400001", ...} to use the pincode centroid.
+    -> {"results": [{..., "distance_km": 1.2}, ...]}   # nearest first
+
+    Answered from the spatial grid over active doctors; no table scan.
+    """
+    def get(self, request, *args, **kwargs):
+        return self._search(request.query_params)
+
+    def post(self, request, *args, **kwargs):
+        return self._search(request.data or {})
+
+    def _search(self, data) -> Response:
+        pincode = str(data.get("pincode", "") or "").strip()
+        try:
+            lat, lon = _parse_location(data, pincode)
+            radius, limit = data.get("radius_km"), data.get("limit")
+            radius = _NEARBY_DEFAULT_KM if radius in (None, "") else float(radius)
+            limit = _NEARBY_MAX_RESULTS if limit in (None, "") else int(limit)
+            if not (math.isfinite(radius) and radius >= 0.0):
+                raise ValueError("radius_km must be a non-negative number")
+        except (TypeError, ValueError) as e:
+            return Response({"error": str(e) or "invalid radius_km/limit"}, status=status.HTTP_400_BAD_REQUEST)
+        if lat is None:
+            return Response({"error": "latitude/longitude or a known pincode is required"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        radius = min(_NEARBY_MAX_KM, radius)
+        limit = max(1, min(_NEARBY_MAX_RESULTS, limit))
+
+        store = get_doctor_store()
+        rows, dist = store.within(lat, lon, radius, limit=limit)
+        results = store.records(rows)
+        for rec, d in zip(results, dist.tolist()):
+            rec["distance_km"] = round(float(d), 3)
         return Response({"results": results}, status=status.HTTP_200_OK)
+
+class MetricsView(View):
+    """
+    GET /api/metrics   (Prometheus text format, for a local scraper)
+
+    Per-stage search latency histograms (encode, faiss, attributes, rerank,
+    serialize, cache, ..., total) with their p50/p95/p99, plus the counters
+    of the index, caches, batcher, indexing queue and query log. Figures are
+    per process; scrape each worker. Served only to SEARCH_METRICS_ALLOWED_IPS.
+    """
+    def get(self, request, *args, **kwargs):
+        if not _METRICS_ENABLED:
+            raise Http404
+        if _METRICS_ALLOWED_IPS and request.META.get("REMOTE_ADDR") not in _METRICS_ALLOWED_IPS:
+            return HttpResponse("forbidden\n", status=status.HTTP_403_FORBIDDEN, content_type="text/plain")
+        return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
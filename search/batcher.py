@@ -0,0 +1,116 @@
+# search/batcher.py
+from __future__ import annotations
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .embedding import encode
+
+log = logging.getLogger(__name__)
+
+# A batch is dispatched once it holds _MAX_ITEMS queries or _MAX_WAIT_S after
+# its first query arrived, whichever comes first. Queries that arrive while
+# the model is busy are already waiting, so under load batches fill up
+# without paying the wait; a lone query pays at most _MAX_WAIT_S.
+_MAX_ITEMS = int(getattr(settings, "SEARCH_EMBED_BATCH_MAX_ITEMS", 32))
+_MAX_WAIT_S = float(getattr(settings, "SEARCH_EMBED_BATCH_WAIT_MS", 3)) / 1000.0
+
+
+class EmbeddingBatcher:
+    """
+    Shared in-process query-embedding server. Callers submit one text and get
+    a Future for its vector; a daemon thread groups pending texts into one
+    encode() call and resolves every caller's future from the result.
+    """
+    def __init__(self, max_items: int = _MAX_ITEMS, max_wait_s: float = _MAX_WAIT_S):
+        self.max_items = max(1, int(max_items))
+        self.max_wait_s = max(0.0, float(max_wait_s))
+        self._pending: List[Tuple[str, Future, float]] = []
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+
+        self.submitted = 0
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.max_batch = 0
+        self.total_wait_s = 0.0
+
+    def submit(self, text: str) -> Future:
+        fut: Future = Future()
+        with self._cond:
+            self._pending.append((text, fut, time.monotonic()))
+            self.submitted += 1
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="search-embed-batcher", daemon=True)
+                self._worker.start()
+            self._cond.notify()
+        return fut
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Await the (d,) vector for one query text."""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = self._pending[0][2] + self.max_wait_s
+                while len(self._pending) < self.max_items:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+                batch = self._pending[:self.max_items]
+                del self._pending[:self.max_items]
+            self._encode(batch)
+
+    def _encode(self, batch: List[Tuple[str, Future, float]]) -> None:
+        started = time.monotonic()
+        live = [(text, fut) for text, fut, _ in batch if fut.set_running_or_notify_cancel()]
+        try:
+            X = encode([text for text, _ in live], use_cache=True) if live else None
+        except Exception as e:
+            log.exception("embedding batcher: encode failed for %d queries", len(live))
+            for _, fut in live:
+                fut.set_exception(e)
+            with self._cond:
+                self.errors += 1
+            return
+        for i, (_, fut) in enumerate(live):
+            fut.set_result(X[i])
+        with self._cond:
+            self.batches += 1
+            self.items += len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+            self.total_wait_s += sum(started - t for _, _, t in batch)
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "depth": len(self._pending),
+                "submitted": self.submitted,
+                "batches": self.batches,
+                "errors": self.errors,
+                "avg_batch": self.items / self.batches if self.batches else 0.0,
+                "max_batch": self.max_batch,
+                "avg_wait_ms": 1000.0 * self.total_wait_s / self.items if self.items else 0.0,
+            }
+
+
+_BATCHER = EmbeddingBatcher()
+
+
+def get_batcher() -> EmbeddingBatcher:
+    return _BATCHER
+
+
+def embedding_batcher_stats() -> Dict[str, float]:
+    return _BATCHER.stats()
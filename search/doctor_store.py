@@ -0,0 +1,443 @@
+# search/doctor_store.py
+from __future__ import annotations
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import logging
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from .faiss_store import _DoctorModel, _id_bitmap, _read_generation
+from .geo import GeoGrid, haversine_km
+from .ontology import SpecialtyOntology
+from .rerank import _NO_CITY, language_mask
+
+# Doctor fields mirrored in memory (everything search needs to rank and respond)
+_FIELDS = (
+    "pk", "name", "specialties", "years_of_experience", "hospital", "city", "pincode",
+    "languages", "phone", "email", "is_active", "latitude", "longitude",
+)
+_OBJECT_COLUMNS = ("name", "hospital", "city", "city_key", "pincode", "phone", "email",
+                   "specialties", "languages")
+# Doctor field bumped on every save; rows changed since the newest one seen are re-read
+_UPDATED_FIELD = "updated_at"
+
+# Seconds between checks of the DB for doctors changed by other processes; an
+# index generation change (another process indexed a save) triggers one at once
+_SYNC_S = float(getattr(settings, "SEARCH_DOCTOR_STORE_SYNC_S", 2.0))
+# Rows updated this long before the newest one seen are re-read too, covering
+# commit delay and clock skew between writers (unchanged rows are skipped)
+_SYNC_OVERLAP = timedelta(seconds=30)
+
+log = logging.getLogger(__name__)
+
+
+def _fingerprint(rec: Dict[str, Any]) -> int:
+    return zlib.crc32(repr([rec.get(f) for f in _FIELDS]).encode("utf-8"))
+
+
+def _value_fields(Doctor) -> Tuple[str, ...]:
+    names = {f.name for f in Doctor._meta.get_fields()}
+    return _FIELDS + ((_UPDATED_FIELD,) if _UPDATED_FIELD in names else ())
+
+
+class DoctorAttributeStore:
+    """
+    Array-backed snapshot of doctor attributes keyed by PK, so search can rank
+    and serialize FAISS hits without touching the ORM. Loaded once from the DB,
+    then kept current by the same save/delete signals that update vectors, and
+    by sync() for changes made in other processes (signals fire only in the
+    process that saved). Freed rows are recycled; numeric columns are NumPy
+    arrays, strings and label lists live in object arrays.
+    """
+    def __init__(self, capacity: int = 1024):
+        self._lock = threading.RLock()
+        self._loaded = False
+        # Newest updated_at mirrored so far, and when / at which index generation sync() last ran
+        self._watermark = None
+        self._sync_lock = threading.Lock()
+        self._synced_at = 0.0
+        self._synced_gen = 0
+        # PKs fetched but not in the DB (e.g. a stale index hit), so they aren't
+        # queried on every search; cleared after each sync()
+        self._absent: Set[int] = set()
+        self._row_of: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._size = 0
+        self._alloc(max(1, capacity))
+        # Interned specialty IDs per row, valid for one ontology version
+        self._spec_ids: List[Optional[np.ndarray]] = [None] * self._cap
+        self._spec_version: Optional[str] = None
+        # Bumped on every write; keys the cached filter results below
+        self._version = 0
+        # filter key -> [pks, bitmap of pks or None until asked for]
+        self._filter_cache: Dict[Tuple[str, str, bool, int], List[Optional[np.ndarray]]] = {}
+        self._filter_cache_version = 0
+        # Spatial index over rows of active doctors with coordinates
+        self._geo = GeoGrid()
+
+    def _alloc(self, cap: int) -> None:
+        self._cap = cap
+        self.pk = np.full(cap, -1, dtype=np.int64)
+        self.yoe = np.zeros(cap, dtype=np.int64)
+        self.lang_mask = np.zeros(cap, dtype=np.int64)
+        self.lat = np.full(cap, np.nan, dtype=np.float64)
+        self.lon = np.full(cap, np.nan, dtype=np.float64)
+        self.active = np.zeros(cap, dtype=bool)
+        # CRC32 of each row's field values: equal across processes for equal data
+        self.fingerprint = np.zeros(cap, dtype=np.int64)
+        for name in _OBJECT_COLUMNS:
+            setattr(self, name, np.empty(cap, dtype=object))
+
+    def _grow(self) -> None:
+        old = {name: getattr(self, name) for name in
+               ("pk", "yoe", "lang_mask", "lat", "lon", "active", "fingerprint", *_OBJECT_COLUMNS)}
+        n = self._cap
+        self._alloc(n * 2)
+        for name, arr in old.items():
+            getattr(self, name)[:n] = arr
+        self._spec_ids.extend([None] * n)
+
+    # -- writes --
+    def _put(self, rec: Dict[str, Any]) -> None:
+        pk = int(rec["pk"])
+        i = self._row_of.get(pk)
+        if i is None:
+            if self._free:
+                i = self._free.pop()
+            else:
+                if self._size == self._cap:
+                    self._grow()
+                i = self._size
+                self._size += 1
+            self._row_of[pk] = i
+        self._absent.discard(pk)
+
+        city = rec.get("city") or ""
+        self.pk[i] = pk
+        self.name[i] = rec.get("name") or ""
+        self.specialties[i] = list(rec.get("specialties") or [])
+        self.yoe[i] = rec.get("years_of_experience") or 0
+        self.hospital[i] = rec.get("hospital") or ""
+        self.city[i] = city
+        self.city_key[i] = city.strip().lower() if city else _NO_CITY
+        self.pincode[i] = rec.get("pincode") or ""
+        self.languages[i] = list(rec.get("languages") or [])
+        self.lang_mask[i] = language_mask(rec.get("languages"))
+        self.phone[i] = rec.get("phone") or ""
+        self.email[i] = rec.get("email") or ""
+        self.active[i] = bool(rec.get("is_active", True))
+        lat, lon = rec.get("latitude"), rec.get("longitude")
+        self.lat[i] = np.nan if lat is None else float(lat)
+        self.lon[i] = np.nan if lon is None else float(lon)
+        if self.active[i]:
+            self._geo.put(i, self.lat[i], self.lon[i])
+        else:
+            self._geo.remove(i)
+        self.fingerprint[i] = _fingerprint(rec)
+        self._spec_ids[i] = None
+        self._version += 1
+        ts = rec.get(_UPDATED_FIELD)
+        if ts is not None and (self._watermark is None or ts > self._watermark):
+            self._watermark = ts
+
+    def upsert(self, rec: Dict[str, Any]) -> None:
+        with self._lock:
+            self._put(rec)
+
+    def upsert_instance(self, doctor: Any) -> None:
+        """Mirror a saved Doctor instance; no-op until the store has been loaded."""
+        if not self._loaded:
+            return
+        self.upsert({f: getattr(doctor, f, None) for f in _FIELDS})
+
+    def remove(self, pk: int) -> None:
+        with self._lock:
+            i = self._row_of.pop(int(pk), None)
+            if i is None:
+                return
+            self.pk[i] = -1
+            self.active[i] = False
+            self.fingerprint[i] = 0
+            self._geo.remove(i)
+            for name in _OBJECT_COLUMNS:
+                getattr(self, name)[i] = None
+            self._spec_ids[i] = None
+            self._free.append(i)
+            self._version += 1
+
+    def _put_changed(self, rec: Dict[str, Any]) -> bool:
+        i = self._row_of.get(int(rec["pk"]))
+        if i is not None and self.fingerprint[i] == _fingerprint(rec):
+            return False
+        self._put(rec)
+        return True
+
+    def load(self, batch_size: int = 2000) -> None:
+        """(Re)load every doctor from the DB in one streamed query."""
+        Doctor = _DoctorModel()
+        gen = _read_generation()[0]
+        fresh = DoctorAttributeStore(capacity=max(1024, Doctor.objects.count()))
+        for rec in Doctor.objects.values(*_value_fields(Doctor)).iterator(chunk_size=batch_size):
+            fresh._put(rec)
+        with self._lock:
+            self.__dict__.update({k: v for k, v in fresh.__dict__.items() if k not in ("_lock", "_sync_lock")})
+            self._synced_at, self._synced_gen = time.monotonic(), gen
+            self._loaded = True
+
+    def fetch(self, pks: Iterable[int]) -> int:
+        """
+        Mirror the given doctors from the DB in one query (run without holding
+        the store lock); returns how many were found. The rest are remembered
+        as absent until the next sync().
+        """
+        pks = [int(pk) for pk in pks]
+        Doctor = _DoctorModel()
+        recs = list(Doctor.objects.filter(pk__in=pks).values(*_value_fields(Doctor)))
+        with self._lock:
+            for rec in recs:
+                self._put_changed(rec)
+            self._absent.update(set(pks) - {int(rec["pk"]) for rec in recs})
+        return len(recs)
+
+    def sync(self) -> None:
+        """
+        Catch up with doctors saved or deleted by other processes: re-read rows
+        updated since the newest one mirrored (less _SYNC_OVERLAP), and when the
+        row count then disagrees, reconcile the PK set (deletes leave no row).
+        """
+        Doctor = _DoctorModel()
+        fields = _value_fields(Doctor)
+        qs = Doctor.objects.all()
+        if _UPDATED_FIELD in fields and self._watermark is not None:
+            qs = qs.filter(**{f"{_UPDATED_FIELD}__gte": self._watermark - _SYNC_OVERLAP})
+        recs = list(qs.values(*fields)) if _UPDATED_FIELD in fields else []
+        count = Doctor.objects.count()
+        with self._lock:
+            changed = sum(self._put_changed(rec) for rec in recs)
+            mismatch = count != len(self._row_of)
+        removed = added = 0
+        if mismatch:
+            live = set(Doctor.objects.values_list("pk", flat=True))
+            with self._lock:
+                gone = [pk for pk in self._row_of if pk not in live]
+                missing = [pk for pk in live if pk not in self._row_of]
+            for pk in gone:
+                self.remove(pk)
+            removed = len(gone)
+            if missing:
+                added = self.fetch(missing)
+        with self._lock:
+            self._absent.clear()
+        if changed or removed or added:
+            log.info("doctor store synced: %d changed, %d added, %d removed", changed, added, removed)
+
+    def maybe_sync(self) -> "DoctorAttributeStore":
+        """
+        Start a background sync() when the index generation moved or _SYNC_S
+        has passed. Requests never wait for it; one runs at a time.
+        """
+        gen = _read_generation()[0]
+        if gen == self._synced_gen and time.monotonic() - self._synced_at < _SYNC_S:
+            return self
+        if not self._sync_lock.acquire(blocking=False):
+            return self
+        self._synced_at, self._synced_gen = time.monotonic(), gen
+        try:
+            threading.Thread(target=self._sync_in_background, name="doctor-store-sync", daemon=True).start()
+        except Exception:
+            self._sync_lock.release()
+            raise
+        return self
+
+    def _sync_in_background(self) -> None:
+        try:
+            close_old_connections()
+            self.sync()
+        except Exception:
+            log.exception("doctor store sync failed; serving the data already loaded")
+        finally:
+            connections.close_all()  # this thread's connections; it exits next
+            self._sync_lock.release()
+
+    def ensure_loaded(self) -> "DoctorAttributeStore":
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+        return self
+
+    # -- reads --
+    def select(self, pks: Iterable[int], active_only: bool = True) -> np.ndarray:
+        """
+        Row indices for the given PKs, in input order; inactive PKs dropped.
+        PKs not mirrored yet (e.g. indexed by another process) are fetched in
+        one query first; those not in the DB either are dropped.
+        """
+        pks = self._fetch_unknown(pks)
+        with self._lock:
+            rows = self._rows(pks)
+            rows = rows[rows >= 0]
+            if active_only and rows.size:
+                rows = rows[self.active[rows]]
+            return rows
+
+    def active_mask(self, pks: Iterable[int]) -> np.ndarray:
+        """Per-PK flags, in input order: True for active doctors (unknown PKs fetched as in select())."""
+        pks = self._fetch_unknown(pks)
+        with self._lock:
+            rows = self._rows(pks)
+            known = rows >= 0
+            out = np.zeros(rows.size, dtype=bool)
+            out[known] = self.active[rows[known]]
+            return out
+
+    def _fetch_unknown(self, pks: Iterable[int]) -> List[int]:
+        """The PKs as ints, after fetching those neither mirrored nor known absent."""
+        pks = [int(pk) for pk in pks]
+        if self._loaded:
+            with self._lock:
+                missing = [pk for pk in pks if pk not in self._row_of and pk not in self._absent]
+            if missing:
+                self.fetch(missing)
+        return pks
+
+    def _rows(self, pks: List[int]) -> np.ndarray:
+        """Row per PK, -1 if unknown; caller holds the lock."""
+        return np.array([self._row_of.get(pk, -1) for pk in pks], dtype=np.int64)
+
+    def fingerprints(self, pks: Iterable[int]) -> np.ndarray:
+        """Per-PK data fingerprints (0 for unknown PKs); any change to a doctor changes its value."""
+        with self._lock:
+            rows = np.array([self._row_of.get(int(pk), -1) for pk in pks], dtype=np.int64)
+            out = np.zeros(rows.size, dtype=np.int64)
+            known = rows >= 0
+            out[known] = self.fingerprint[rows[known]]
+            return out
+
+    def filter_pks(self, city: str = "", pincode_prefix: str = "",
+                   languages: Iterable[str] = ()) -> np.ndarray:
+        """
+        PKs of active doctors matching every given filter: exact city
+        (case/space-insensitive), pincode prefix, and any-of languages.
+        Results are cached per filter until the store next changes.
+        """
+        return self._filter_entry(city, pincode_prefix, languages, False)[0]
+
+    def filter_bitmap(self, city: str = "", pincode_prefix: str = "",
+                      languages: Iterable[str] = ()) -> np.ndarray:
+        """
+        filter_pks() in faiss.IDSelectorBitmap's layout (faiss_store._id_bitmap),
+        cached with it, so filtered searches don't rebuild an ID set per query.
+        """
+        return self._filter_entry(city, pincode_prefix, languages, True)[1]
+
+    def _filter_entry(self, city: str, pincode_prefix: str, languages: Iterable[str],
+                      bitmap: bool) -> List[Optional[np.ndarray]]:
+        city_key = (city or "").strip().lower()
+        prefix = (pincode_prefix or "").strip()
+        languages = list(languages or [])
+        lang = language_mask(languages)
+        # Only unsupported codes give lang == 0, which must not share "no language filter"'s key
+        key = (city_key, prefix, bool(languages), lang)
+        with self._lock:
+            if self._filter_cache_version != self._version or len(self._filter_cache) > 256:
+                self._filter_cache = {}
+                self._filter_cache_version = self._version
+            hit = self._filter_cache.get(key)
+            if hit is not None:
+                if bitmap and hit[1] is None:
+                    hit[1] = _id_bitmap(hit[0])
+                return hit
+
+            n = self._size
+            mask = self.active[:n].copy()
+            if city_key:
+                mask &= self.city_key[:n] == city_key
+            if prefix:
+                pins = self.pincode[:n]
+                mask &= np.fromiter((isinstance(p, str) and p.startswith(prefix) for p in pins),
+                                    dtype=bool, count=n)
+            if languages:
+                mask &= (self.lang_mask[:n] & lang) != 0
+            pks = self.pk[:n][mask]
+            entry = self._filter_cache[key] = [pks, _id_bitmap(pks) if bitmap else None]
+            return entry
+
+    def within(self, lat: float, lon: float, radius_km: float,
+               limit: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Active doctors within radius_km of (lat, lon), nearest first.
+        Returns (rows, distances_km); only grid cells near the point are scanned.
+        """
+        with self._lock:
+            rows = self._geo.candidates(lat, lon, radius_km)
+            if not rows.size:
+                return rows, np.zeros(0)
+            dist = haversine_km(lat, lon, self.lat[rows], self.lon[rows])
+            keep = dist <= radius_km
+            rows, dist = rows[keep], dist[keep]
+            order = np.argsort(dist, kind="stable")[:limit]
+            return rows[order], dist[order]
+
+    def _intern_specialties(self, rows: np.ndarray, onto: SpecialtyOntology) -> List[np.ndarray]:
+        if self._spec_version != onto.version:
+            self._spec_ids = [None] * self._cap
+            self._spec_version = onto.version
+        out = []
+        for i in rows.tolist():
+            ids = self._spec_ids[i]
+            if ids is None:
+                ids = self._spec_ids[i] = onto.intern(self.specialties[i] or [])
+            out.append(ids)
+        return out
+
+    def columns(self, rows: np.ndarray, onto: SpecialtyOntology) -> Dict[str, Any]:
+        """Rerank columns (see search.rerank.candidate_columns) for the given rows."""
+        with self._lock:
+            spec = self._intern_specialties(rows, onto)
+            offsets = np.zeros(len(spec) + 1, dtype=np.int64)
+            np.cumsum([s.size for s in spec], out=offsets[1:])
+            return {
+                "spec_flat": (np.concatenate(spec) if spec else np.zeros(0)).astype(np.int32),
+                "spec_offsets": offsets,
+                "yoe": self.yoe[rows],
+                "pincode": self.pincode[rows],
+                "city_key": self.city_key[rows],
+                "lang_mask": self.lang_mask[rows],
+                "lat": self.lat[rows],
+                "lon": self.lon[rows],
+            }
+
+    def records(self, rows: np.ndarray) -> List[Dict[str, Any]]:
+        """Response fields for the given rows."""
+        with self._lock:
+            return [
+                {
+                    "doctor_id": int(self.pk[i]),
+                    "name": self.name[i],
+                    "specialties": list(self.specialties[i]),
+                    "yoe": int(self.yoe[i]),
+                    "hospital": self.hospital[i],
+                    "city": self.city[i],
+                    "pincode": self.pincode[i],
+                    "languages": list(self.languages[i]),
+                    "phone": self.phone[i],
+                    "email": self.email[i],
+                }
+                for i in rows.tolist()
+            ]
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+
+_STORE = DoctorAttributeStore()
+
+
+def get_doctor_store() -> DoctorAttributeStore:
+    return _STORE.ensure_loaded().maybe_sync()
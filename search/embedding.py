@@ -1,34 +1,109 @@
 # search/embedding.py
 from __future__ import annotations
-from typing import List
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import logging
+import threading
+import unicodedata
 import numpy as np
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .metrics import timed
 
 _MODEL = None
+_MODEL_NAME: Optional[str] = None
 _DIM = None
 
+log = logging.getLogger(__name__)
+
+# Encoder backend: "torch" (PyTorch SentenceTransformer), "onnx" (ONNX Runtime),
+# or "onnx_int8" (ONNX Runtime, dynamically quantized int8 weights).
+# ONNX variants are exported ahead of time with `manage.py export_embedding_model`
+# and need the optional packages in requirements-onnx.txt.
+BACKENDS = ("torch", "onnx", "onnx_int8")
+_ONNX_DIR = Path(getattr(settings, "EMBED_ONNX_DIR", Path(settings.BASE_DIR) / "var" / "onnx"))
+_QUANT_CONFIG = getattr(settings, "EMBED_ONNX_QUANT_CONFIG", "avx2")  # avx2 | avx512 | avx512_vnni | arm64
+
+def get_backend() -> str:
+    backend = str(getattr(settings, "EMBED_BACKEND", "torch")).lower()
+    if backend not in BACKENDS:
+        raise ImproperlyConfigured(f"EMBED_BACKEND must be one of {BACKENDS}, got {backend!r}")
+    return backend
+
+def onnx_model_dir(model_name: str) -> Path:
+    """Local export directory for a model (HF ids contain '/', so flatten them)."""
+    return _ONNX_DIR / model_name.replace("/", "__")
+
+def onnx_file_name(backend: str) -> str:
+    return "onnx/model.onnx" if backend == "onnx" else f"onnx/model_qint8_{_QUANT_CONFIG}.onnx"
+
+def require_onnx() -> None:
+    """
+    Check the optional ONNX dependencies (requirements-onnx.txt) are
+    installed; requirements.txt only covers the torch backend.
+    """
+    try:
+        import onnxruntime  # noqa: F401
+        import optimum.onnxruntime  # noqa: F401
+        from sentence_transformers import export_dynamic_quantized_onnx_model  # noqa: F401 (>= 3.2)
+    except ImportError as e:
+        raise ImportError(
+            "the onnx / onnx_int8 embedding backends need the optional ONNX dependencies: "
+            f"pip install -r requirements-onnx.txt ({e})"
+        ) from e
+
+def load_backend(model_name: str, backend: str):
+    """
+    Construct a SentenceTransformer for one backend. ONNX variants load the
+    locally exported files; they are never exported implicitly at request time.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name, device="cpu")
+    require_onnx()
+    path = onnx_model_dir(model_name)
+    file_name = onnx_file_name(backend)
+    if not (path / file_name).exists():
+        raise FileNotFoundError(
+            f"{path / file_name} not found; run `python manage.py export_embedding_model`"
+        )
+    return SentenceTransformer(str(path), device="cpu", backend="onnx",
+                               model_kwargs={"file_name": file_name})
+
 def _load_model():
     """
     Lazy-load a lightweight biomedical sentence-transformer on CPU.
-    Falls back to a general MiniLM if the primary model is unavailable.
+    Falls back to a general MiniLM if the primary model is unavailable, and
+    to the torch backend if the configured ONNX export can't be loaded.
     """
-    global _MODEL, _DIM
+    global _MODEL, _MODEL_NAME, _DIM
     if _MODEL is not None:
         return _MODEL
 
-    from sentence_transformers import SentenceTransformer
-
     primary = getattr(settings, "EMBED_MODEL", "pritamdeka/S-BioBERT-MiniLM-L6-v2")
     fallback = getattr(settings, "EMBED_FALLBACK", "sentence-transformers/all-MiniLM-L6-v2")
+    backend = get_backend()
 
-    try:
-        _MODEL = SentenceTransformer(primary, device="cpu")
-    except Exception:
-        _MODEL = SentenceTransformer(fallback, device="cpu")
+    attempts = [(primary, backend), (fallback, backend)]
+    if backend != "torch":
+        attempts += [(primary, "torch"), (fallback, "torch")]
+    for i, (name, be) in enumerate(attempts):
+        try:
+            _MODEL = load_backend(name, be)
+        except Exception:
+            if i == len(attempts) - 1:
+                raise
+            log.warning("embedding: could not load %s with %s backend", name, be, exc_info=True)
+            continue
+        # Backend is part of the name: cached vectors from different backends must not mix
+        _MODEL_NAME = name if be == "torch" else f"{name}@{be}"
+        break
 
     # probe once to cache dimensionality
     vec = _MODEL.encode(["probe"], normalize_embeddings=True, convert_to_numpy=True)
-    global _DIM
     _DIM = int(vec.shape[1])
     return _MODEL
 
@@ -37,11 +112,96 @@ def get_dim() -> int:
         _load_model()
     return _DIM
 
-def encode(texts: List[str], batch_size: int = 256) -> np.ndarray:
+def get_model_name() -> str:
+    if _MODEL_NAME is None:
+        _load_model()
+    return _MODEL_NAME
+
+
+# -----------------------------
+# Query-embedding cache
+# -----------------------------
+def _normalize_text(text: str) -> str:
     """
-    Returns L2-normalized float32 vectors (shape: [n, d]).
-    Cosine similarity == dot product thanks to normalization.
+    Canonical cache key text: NFC + collapsed whitespace.
+    Case is preserved because the configured model may be cased.
     """
+    t = unicodedata.normalize("NFC", str(text or ""))
+    return " ".join(t.split())
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU of normalized text -> unit vector.
+    Bounded by entry count and total vector bytes; tracks hit/miss/eviction counters.
+    Keys include the model name and dimension so a model switch never serves stale vectors.
+    """
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_bytes)
+        self._data: "OrderedDict[Tuple[str, int, str], np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key: Tuple[str, int, str]) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._data.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, key: Tuple[str, int, str], vec: np.ndarray) -> None:
+        vec = np.array(vec, dtype="float32", copy=True)
+        vec.setflags(write=False)
+        if vec.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._data[key] = vec
+            self._bytes += vec.nbytes
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+_CACHE = EmbeddingCache(
+    max_entries=getattr(settings, "EMBED_CACHE_MAX_ENTRIES", 4096),
+    max_bytes=getattr(settings, "EMBED_CACHE_MAX_BYTES", 32 * 1024 * 1024),
+)
+
+def embedding_cache_stats() -> Dict[str, float]:
+    return _CACHE.stats()
+
+
+def _encode_model(texts: List[str], batch_size: int) -> np.ndarray:
     model = _load_model()
     # Replace None/empty with whitespace to avoid model edge cases
     safe_texts = [(t if (t is not None and str(t).strip()) else " ") for t in texts]
@@ -57,3 +217,41 @@ def encode(texts: List[str], batch_size: int = 256) -> np.ndarray:
     norms = np.linalg.norm(emb, axis=1, keepdims=True) + 1e-12
     emb = emb / norms
     return emb
+
+def encode(texts: List[str], batch_size: int = 256, use_cache: bool = False) -> np.ndarray:
+    """
+    Returns L2-normalized float32 vectors (shape: [n, d]).
+    Cosine similarity == dot product thanks to normalization.
+
+    use_cache=True serves repeated texts from the query-embedding LRU and only
+    sends misses through the model. Leave it off for bulk document encoding so
+    index rebuilds don't flush hot queries out of the cache.
+    Timed as stage "encode" (queries, use_cache=True) or "encode_docs".
+    """
+    with timed("encode" if use_cache else "encode_docs"):
+        return _encode(texts, batch_size, use_cache)
+
+def _encode(texts: List[str], batch_size: int, use_cache: bool) -> np.ndarray:
+    if not use_cache or not _CACHE.enabled:
+        return _encode_model(texts, batch_size)
+
+    name, dim = get_model_name(), get_dim()
+    keys = [(name, dim, _normalize_text(t)) for t in texts]
+    out = np.empty((len(texts), dim), dtype="float32")
+
+    # Collect misses, de-duplicated so one batch never encodes the same text twice
+    pending: Dict[Tuple[str, int, str], List[int]] = {}
+    for i, key in enumerate(keys):
+        vec = _CACHE.get(key)
+        if vec is None:
+            pending.setdefault(key, []).append(i)
+        else:
+            out[i] = vec
+
+    if pending:
+        miss_keys = list(pending)
+        emb = _encode_model([texts[pending[k][0]] for k in miss_keys], batch_size)
+        for key, vec in zip(miss_keys, emb):
+            _CACHE.put(key, vec)
+            out[pending[key]] = vec
+    return out
@@ -0,0 +1,194 @@
+# search/embedding_store.py
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .embedding import _normalize_text, encode, get_dim, get_model_name
+from .filelock import file_lock
+
+# Document embeddings persisted across rebuilds, keyed by content. Lives next
+# to the FAISS files by default; one pair of files per model.
+_STORE_DIR = Path(getattr(
+    settings, "EMBED_STORE_DIR",
+    Path(getattr(settings, "FAISS_DIR", Path(settings.BASE_DIR) / "var" / "faiss")) / "embeddings",
+))
+_ENABLED = bool(getattr(settings, "EMBED_STORE_ENABLED", True))
+
+_KEY_SIZE = 16
+
+
+class EmbeddingStore:
+    """
+    Append-only, content-addressed store of document vectors for one model.
+
+    <slug>.f32 holds float32 rows and is read through np.memmap; <slug>.keys
+    holds one 16-byte digest of (model name, normalized text) per row, and is
+    loaded into a digest -> row dict. Vectors are appended before their keys,
+    so a crash can only leave unreferenced trailing rows, which the next
+    append truncates. Other processes' appends are picked up on a miss.
+    """
+    def __init__(self, directory: Path, model_name: str, dim: int):
+        directory.mkdir(parents=True, exist_ok=True)
+        slug = hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:16]
+        self.model_name = model_name
+        self.dim = int(dim)
+        self._vec_path = directory / f"{slug}.f32"
+        self._key_path = directory / f"{slug}.keys"
+        self._lock_path = directory / f"{slug}.lock"
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        self._n = 0
+        self._mm: Optional[np.memmap] = None
+        self.hits = 0
+        self.misses = 0
+        self.appended = 0
+        with self._lock:
+            self._refresh()
+
+    def key(self, text: str) -> bytes:
+        h = hashlib.blake2b(digest_size=_KEY_SIZE)
+        h.update(self.model_name.encode("utf-8"))
+        h.update(b"\0")
+        h.update(_normalize_text(text).encode("utf-8"))
+        return h.digest()
+
+    # -- internals (caller holds self._lock) --
+    def _committed_rows(self) -> int:
+        try:
+            n_keys = self._key_path.stat().st_size // _KEY_SIZE
+            n_vecs = self._vec_path.stat().st_size // (4 * self.dim)
+        except FileNotFoundError:
+            return 0
+        return min(n_keys, n_vecs)
+
+    def _refresh(self) -> None:
+        """Index keys appended since we last looked (by us or another process)."""
+        n = self._committed_rows()
+        if n <= self._n:
+            return
+        with open(self._key_path, "rb") as fh:
+            fh.seek(self._n * _KEY_SIZE)
+            raw = fh.read((n - self._n) * _KEY_SIZE)
+        for i in range(n - self._n):
+            self._rows.setdefault(raw[i * _KEY_SIZE:(i + 1) * _KEY_SIZE], self._n + i)
+        self._n = n
+        self._mm = None
+
+    def _matrix(self) -> np.memmap:
+        if self._mm is None:
+            self._mm = np.memmap(self._vec_path, dtype="float32", mode="r", shape=(self._n, self.dim))
+        return self._mm
+
+    # -- API --
+    def get_many(self, keys: List[bytes]) -> Tuple[np.ndarray, List[int]]:
+        """
+        Returns (vectors, missing): rows for found keys are filled in, and
+        `missing` lists the input positions that still need encoding.
+        """
+        out = np.zeros((len(keys), self.dim), dtype="float32")
+        with self._lock:
+            rows = [self._rows.get(k, -1) for k in keys]
+            if -1 in rows:
+                self._refresh()
+                rows = [self._rows.get(k, -1) if r < 0 else r for k, r in zip(keys, rows)]
+            found = [i for i, r in enumerate(rows) if r >= 0]
+            if found:
+                out[found] = self._matrix()[[rows[i] for i in found]]
+            missing = [i for i, r in enumerate(rows) if r < 0]
+            self.hits += len(found)
+            self.misses += len(missing)
+        return out, missing
+
+    def put_many(self, keys: List[bytes], X: np.ndarray) -> None:
+        X = np.ascontiguousarray(X, dtype="float32")
+        with self._lock, file_lock(self._lock_path):
+            self._refresh()
+            new: Dict[bytes, int] = {}
+            for i, k in enumerate(keys):
+                if k not in self._rows:
+                    new.setdefault(k, i)
+            if not new:
+                return
+            with open(self._vec_path, "ab") as fh:
+                # Drop rows a crashed writer left without keys
+                fh.truncate(self._n * 4 * self.dim)
+                fh.write(X[list(new.values())].tobytes())
+                fh.flush()
+                os.fsync(fh.fileno())
+            with open(self._key_path, "ab") as fh:
+                fh.truncate(self._n * _KEY_SIZE)
+                fh.write(b"".join(new))
+                fh.flush()
+            for j, k in enumerate(new):
+                self._rows[k] = self._n + j
+            self._n += len(new)
+            self._mm = None
+            self.appended += len(new)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "rows": self._n,
+                "bytes": self._n * 4 * self.dim,
+                "hits": self.hits,
+                "misses": self.misses,
+                "appended": self.appended,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return self._n
+
+
+_STORES: Dict[Tuple[str, int], EmbeddingStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    """The store for the active model, or None when EMBED_STORE_ENABLED is off."""
+    if not _ENABLED:
+        return None
+    key = (get_model_name(), get_dim())
+    store = _STORES.get(key)
+    if store is None:
+        with _STORES_LOCK:
+            store = _STORES.get(key)
+            if store is None:
+                store = _STORES[key] = EmbeddingStore(_STORE_DIR, *key)
+    return store
+
+
+def encode_documents(texts: List[str], batch_size: int = 256) -> np.ndarray:
+    """
+    encode() for document text: vectors already in the store are read back
+    instead of re-encoded, and only distinct unseen texts reach the model.
+    """
+    store = get_embedding_store()
+    if store is None or not texts:
+        return encode(texts, batch_size=batch_size)
+    keys = [store.key(t) for t in texts]
+    out, missing = store.get_many(keys)
+    if missing:
+        # One model call per distinct missing text
+        first: Dict[bytes, int] = {}
+        for i in missing:
+            first.setdefault(keys[i], i)
+        uniq = list(first)
+        X = encode([texts[first[k]] for k in uniq], batch_size=batch_size)
+        store.put_many(uniq, X)
+        row_of = {k: j for j, k in enumerate(uniq)}
+        out[missing] = X[[row_of[keys[i]] for i in missing]]
+    return out
+
+
+def embedding_store_stats() -> Dict[str, float]:
+    store = get_embedding_store()
+    return store.stats() if store is not None else {"enabled": False}
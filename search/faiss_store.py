@@ -1,16 +1,31 @@
 # search/faiss_store.py
 from __future__ import annotations
 from pathlib import Path
-from typing import Iterable, List, Tuple
+from typing import Any, Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
+import json
+import logging
 import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import faiss
 import numpy as np
 from django.apps import apps
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.db.models import QuerySet
 
-from .embedding import encode, get_dim
+from .embedding import encode, get_dim, get_model_name
+from .embedding_store import encode_documents
+from .filelock import file_lock
+from .metrics import timed
+
+log = logging.getLogger(__name__)
 
 # -----------------------------
 # Paths / settings
@@ -19,12 +34,80 @@ _INDEX_DIR = Path(getattr(settings, "FAISS_DIR", Path(settings.BASE_DIR) / "var"
 _INDEX_DIR.mkdir(parents=True, exist_ok=True)
 _INDEX_PATH = _INDEX_DIR / "doctors.index"
 _TMP_PATH = _INDEX_DIR / "doctors.index.tmp"
+_WAL_PATH = _INDEX_DIR / "doctors.index.wal"
+_LOCK_PATH = _INDEX_DIR / "doctors.index.lock"
+_GEN_PATH = _INDEX_DIR / "doctors.index.gen"
+_GEN_TMP_PATH = _INDEX_DIR / "doctors.index.gen.tmp"
+_WAL_TMP_PATH = _INDEX_DIR / "doctors.index.wal.tmp"
+
+# Journal compaction: fold the WAL into a fresh snapshot once it grows past
+# this many bytes, or when the snapshot is older than the interval (0 = never).
+_WAL_MAX_BYTES = int(getattr(settings, "FAISS_WAL_MAX_BYTES", 64 * 1024 * 1024))
+_SNAPSHOT_INTERVAL = float(getattr(settings, "FAISS_SNAPSHOT_INTERVAL", 3600))
+_WAL_FSYNC = bool(getattr(settings, "FAISS_WAL_FSYNC", False))
+# ...or once this fraction of the snapshot's vectors is tombstoned, or the
+# in-memory delta of changed vectors holds this many. Compaction runs on a
+# background thread; searches and writes carry on meanwhile.
+_TOMBSTONE_RATIO = float(getattr(settings, "FAISS_TOMBSTONE_RATIO", 0.2))
+_DELTA_MAX = int(getattr(settings, "FAISS_DELTA_MAX", 10_000))
+
+# Serving mode: map the snapshot read-only (IO_FLAG_MMAP_IFC) so every worker
+# shares one page-cache copy. Changes are kept beside it until compaction
+# publishes a new snapshot file.
+_MMAP = bool(getattr(settings, "FAISS_MMAP", False))
+# Minimum seconds between checks of the index generation (0 = every load_index())
+_RELOAD_CHECK_S = float(getattr(settings, "FAISS_RELOAD_CHECK_S", 0.0))
 
 # Allow overriding the Doctor model location (e.g., "myapp.Doctor")
 _DOCTOR_LABEL = getattr(settings, "DOCTOR_MODEL", "doctors.Doctor")
 
-# In-process singleton for performance
-_INDEX: faiss.Index | None = None
+# Index layout. "type" is one of: flat (exact), ivf_flat, ivf_pq, hnsw.
+# A bare string (e.g. "hnsw") is accepted as shorthand for {"type": ...}.
+_DEFAULT_SPEC: Dict[str, Any] = {
+    "type": "flat",
+    "nlist": 1024,           # IVF: number of coarse centroids
+    "pq_m": 16,              # IVF-PQ: sub-quantizers (must divide the embedding dim)
+    "pq_nbits": 8,           # IVF-PQ: bits per sub-quantizer code
+    "hnsw_m": 32,            # HNSW: graph degree
+    "ef_construction": 200,  # HNSW: build-time beam width
+    "nprobe": 16,            # IVF: default lists probed per query
+    "ef_search": 64,         # HNSW: default search beam width
+}
+_INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+class IndexSnapshot(NamedTuple):
+    """
+    One immutable version of the serving index, as of (generation, snapshot
+    generation) and journal offset `wal_pos`.
+
+    `index` is the snapshot file's index (the base) and is never modified.
+    Journaled changes live beside it: `delta` is a small exact index holding
+    the current vectors of PKs changed since the base was written, and `dead`
+    is a tombstone bitmap of PKs whose base vector is stale (updated or
+    removed). Searches mask `dead` out of the base with an ID selector and
+    merge in `delta`; compaction folds both into a new base.
+    """
+    index: faiss.Index
+    generation: Tuple[int, int]
+    wal_pos: int
+    delta: Optional[faiss.Index] = None
+    dead: Optional[np.ndarray] = None      # uint8 bitmap, bit (pk & 7) of byte pk >> 3
+    n_dead: int = 0                        # base vectors masked by `dead`
+    base_ids: Optional[np.ndarray] = None  # bitmap of the PKs in `index`
+
+    @property
+    def ntotal(self) -> int:
+        """Live vectors: the base minus its tombstones, plus the delta."""
+        delta = self.delta.ntotal if self.delta is not None else 0
+        return self.index.ntotal - self.n_dead + delta
+
+
+# In-process singleton for performance. Published by plain reference
+# assignment (RCU): readers grab the current snapshot without locking and keep
+# using it for the whole search; writers never mutate a published index, they
+# build the next version on a copy and swap it in.
+_SNAPSHOT: Optional[IndexSnapshot] = None
+_CHECKED_AT = 0.0  # when we last compared the generation file
 
 
 # -----------------------------
@@ -41,160 +124,904 @@ def _DoctorModel():
 # -----------------------------
 # Index helpers
 # -----------------------------
-def _new_index(dim: int) -> faiss.Index:
+def index_spec(spec: Any = None) -> Dict[str, Any]:
+    """
+    Resolve an index spec (defaults to settings.FAISS_INDEX_SPEC) against _DEFAULT_SPEC.
+    """
+    if spec is None:
+        spec = getattr(settings, "FAISS_INDEX_SPEC", None) or {}
+    if isinstance(spec, str):
+        spec = {"type": spec}
+    out = {**_DEFAULT_SPEC, **spec}
+    out["type"] = str(out["type"]).lower()
+    if out["type"] not in _INDEX_TYPES:
+        raise ImproperlyConfigured(
+            f"FAISS_INDEX_SPEC type must be one of {_INDEX_TYPES}, got {out['type']!r}"
+        )
+    return out
+
+
+def _factory_string(spec: Dict[str, Any], dim: int, n_train: int) -> str:
+    """
+    Map a spec to a faiss.index_factory string, shrinking IVF/PQ parameters
+    when there are too few training vectors for the configured sizes.
+    """
+    kind = spec["type"]
+    if kind == "hnsw":
+        return f"IDMap2,HNSW{int(spec['hnsw_m'])}"
+    if kind == "flat" or n_train <= 0:
+        # Nothing to train on yet: start exact; rebuild_index trains the ANN layout.
+        return "IDMap2,Flat"
+
+    # k-means wants ~39 points per centroid; fewer just degrades to noise.
+    nlist = max(1, min(int(spec["nlist"]), n_train // 39))
+    if kind == "ivf_pq":
+        m, nbits = int(spec["pq_m"]), int(spec["pq_nbits"])
+        if dim % m != 0:
+            raise ImproperlyConfigured(f"FAISS_INDEX_SPEC pq_m={m} must divide embedding dim {dim}")
+        if n_train >= 39 * (1 << nbits):
+            return f"IVF{nlist},PQ{m}x{nbits}"
+        log.warning(
+            "FAISS_INDEX_SPEC ivf_pq needs >= %d training vectors for PQ%dx%d, got %d; building IVF%d,Flat instead",
+            39 * (1 << nbits), m, nbits, n_train, nlist,
+        )
+    return f"IVF{nlist},Flat"
+
+
+def _new_index(dim: int, spec: Any = None, n_train: int = 0) -> faiss.Index:
+    """
+    Cosine search (L2-normalized vectors) using inner product, with 64-bit
+    doctor PKs as IDs. Layout follows FAISS_INDEX_SPEC; IVF layouts need
+    n_train vectors for training and fall back to exact IDMap2(Flat) without them.
+    """
+    spec = index_spec(spec)
+    index = faiss.index_factory(dim, _factory_string(spec, dim, n_train), faiss.METRIC_INNER_PRODUCT)
+    if spec["type"] == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efConstruction = int(spec["ef_construction"])
+    return index
+
+
+def index_layout(index: faiss.Index) -> str:
     """
-    Exact cosine search (L2-normalized vectors) using inner product.
-    Store 64-bit IDs with IndexIDMap2.
+    The index_factory string of the layout `index` actually has (which can be
+    smaller than, or fall back from, what FAISS_INDEX_SPEC asked for).
     """
-    base = faiss.IndexFlatIP(dim)
-    return faiss.IndexIDMap2(base)
+    parts = []
+    inner = index  # `index` stays referenced: it owns the wrapped index
+    if hasattr(index, "id_map"):
+        parts.append("IDMap2")
+        inner = faiss.downcast_index(index.index)
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        pq = getattr(faiss.downcast_index(ivf), "pq", None)
+        parts += [f"IVF{ivf.nlist}", f"PQ{pq.M}x{pq.nbits}" if pq is not None else "Flat"]
+    elif isinstance(inner, faiss.IndexHNSW):
+        parts.append(f"HNSW{inner.hnsw.nb_neighbors(1)}")
+    else:
+        parts.append("Flat")
+    return ",".join(parts)
+
+
+def _search_params(index: faiss.Index, nprobe: Optional[int] = None,
+                   ef_search: Optional[int] = None,
+                   sel: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+    """
+    Per-query search knobs; thread-safe, unlike mutating index.nprobe.
+    `sel` restricts the search to matching IDs inside FAISS.
+    """
+    spec = index_spec()
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        n = int(nprobe or spec["nprobe"])
+        return faiss.SearchParametersIVF(nprobe=max(1, min(n, ivf.nlist)), sel=sel)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search or spec["ef_search"]), sel=sel)
+    return faiss.SearchParameters(sel=sel) if sel is not None else None
+
+
+def _remove_ids(index: faiss.Index, ids: np.ndarray) -> faiss.Index:
+    """
+    Remove IDs, returning the (possibly new) index. HNSW graphs don't support
+    removal, so they are rebuilt from their stored vectors minus the removed IDs.
+    """
+    sel = faiss.IDSelectorBatch(ids)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if not isinstance(inner, faiss.IndexHNSW):
+        index.remove_ids(sel)
+        return index
+
+    have = faiss.vector_to_array(index.id_map)
+    keep = ~np.isin(have, ids)
+    if keep.all():
+        return index
+    X = inner.reconstruct_n(0, index.ntotal)[keep]
+    fresh = _new_index(index.d)
+    if len(X):
+        fresh.add_with_ids(X, have[keep])
+    return fresh
+
+
+def _index_ids(index: faiss.Index) -> np.ndarray:
+    """
+    The PKs stored in an index (IDMap2 keeps them in id_map; IVF in its lists).
+    """
+    if hasattr(index, "id_map"):
+        return faiss.vector_to_array(index.id_map).astype("int64", copy=False)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return np.arange(index.ntotal, dtype="int64")
+    lists = ivf.invlists
+    parts = [
+        faiss.rev_swig_ptr(lists.get_ids(l), lists.list_size(l)).copy()
+        for l in range(ivf.nlist) if lists.list_size(l)
+    ]
+    return np.concatenate(parts).astype("int64", copy=False) if parts else np.zeros(0, dtype="int64")
+
 
+def _id_bitmap(ids: np.ndarray, nbytes: int = 0) -> np.ndarray:
+    """
+    Bitmap over PKs in faiss.IDSelectorBitmap's layout: bit (pk & 7) of byte pk >> 3.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    nbytes = max(nbytes, int(ids.max()) // 8 + 1 if len(ids) else 0)
+    bits = np.zeros(8 * nbytes, dtype=bool)
+    bits[ids] = True
+    return np.packbits(bits, bitorder="little")
+
+
+def _has_ids(bitmap: Optional[np.ndarray], ids: np.ndarray) -> np.ndarray:
+    """Per-ID membership test against an _id_bitmap()."""
+    out = np.zeros(len(ids), dtype=bool)
+    if bitmap is None:
+        return out
+    byte = ids >> 3
+    inside = byte < len(bitmap)
+    out[inside] = (bitmap[byte[inside]] >> (ids[inside] & 7).astype("uint8")) & 1
+    return out
 
-def _read_index() -> faiss.Index | None:
+
+def _read_index(mmap: bool = False) -> faiss.Index | None:
     if _INDEX_PATH.exists():
+        if mmap:
+            return faiss.read_index(str(_INDEX_PATH), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
         return faiss.read_index(str(_INDEX_PATH))
     return None
 
 
+def _fsync_path(path: Path) -> None:
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # directories can't be fsync'd on every platform
+    finally:
+        os.close(fd)
+
+
 def _write_index_atomic(index: faiss.Index) -> None:
     """
     Atomic write to avoid partial/corrupt index files on crashes.
+    The temp file is fsync'd before the rename so a crash never exposes a torn snapshot.
     """
     faiss.write_index(index, str(_TMP_PATH))
+    _fsync_path(_TMP_PATH)
     os.replace(_TMP_PATH, _INDEX_PATH)
+    _fsync_path(_INDEX_DIR)
+
+
+# -----------------------------
+# Index generation
+# -----------------------------
+# doctors.index.gen holds (generation, snapshot generation). Every journal
+# append bumps the first; every new snapshot sets both. Workers compare it
+# with what they loaded: an unchanged pair means nothing to do, a new
+# generation on the same snapshot means "apply the journal tail", and a new
+# snapshot generation means "reload".
+_GEN = struct.Struct("<QQ")
+
+
+def _read_generation() -> Tuple[int, int]:
+    try:
+        with open(_GEN_PATH, "rb") as fh:
+            raw = fh.read(_GEN.size)
+    except FileNotFoundError:
+        return 0, 0
+    return _GEN.unpack(raw) if len(raw) == _GEN.size else (0, 0)
+
+
+def _bump_generation(snapshot: bool = False) -> Tuple[int, int]:
+    """
+    Advance the generation; caller holds _index_lock().
+    """
+    gen, snap = _read_generation()
+    gen += 1
+    if snapshot:
+        snap = gen
+    with open(_GEN_TMP_PATH, "wb") as fh:
+        fh.write(_GEN.pack(gen, snap))
+    os.replace(_GEN_TMP_PATH, _GEN_PATH)
+    return gen, snap
+
+
+def _publish_snapshot(index: faiss.Index) -> Tuple[int, int]:
+    """
+    Write a snapshot that supersedes the whole journal; caller holds _index_lock().
+    """
+    _write_index_atomic(index)
+    _wal_truncate()
+    return _bump_generation(snapshot=True)
 
 
 def _ensure_dim_compat(idx: faiss.Index) -> faiss.Index:
     """
     If on-disk index dimension mismatches the current encoder dimension, rebuild.
+    Caller holds _index_lock().
     """
     want = get_dim()
     have = idx.d
     if have != want:
-        # Rebuild a fresh (empty) index with correct dimension.
+        # Rebuild a fresh (empty) index with correct dimension; old journal entries are unusable.
         idx = _new_index(want)
-        _write_index_atomic(idx)
+        _publish_snapshot(idx)
+        idx = _served(idx)
     return idx
 
 
-def load_index() -> faiss.Index:
+def _served(index: faiss.Index) -> faiss.Index:
     """
-    Lazy-load the FAISS index.
-    If missing or dim-mismatched, create an empty one with correct dim.
+    The index to serve for a snapshot just published from `index`: in mmap
+    mode the in-memory copy is dropped in favour of mapping the file.
+    """
+    return _read_index(mmap=True) if _MMAP else index
+
+
+# -----------------------------
+# Write-ahead journal
+# -----------------------------
+# Each record: op (b"U" upsert / b"R" remove), doctor pk, vector length, CRC32,
+# followed by the float32 vector for upserts. Replay is idempotent, so a crash
+# between writing a snapshot and truncating the journal is harmless.
+_WAL_HEADER = struct.Struct("<cqII")
+
+def _index_lock():
+    """
+    Exclusive cross-process lock around journal appends and compaction.
+    """
+    return file_lock(_LOCK_PATH)
+
+
+def _wal_record(op: bytes, pk: int, vec: Optional[np.ndarray] = None) -> bytes:
+    payload = b"" if vec is None else np.ascontiguousarray(vec, dtype="float32").tobytes()
+    n = len(payload) // 4
+    crc = zlib.crc32(payload, zlib.crc32(struct.pack("<cqI", op, pk, n)))
+    return _WAL_HEADER.pack(op, pk, n, crc) + payload
+
+
+def _wal_append(records: List[bytes], start: int) -> int:
+    """
+    Append records at `start`, the end of the valid journal, first dropping
+    whatever follows it (a torn record from a writer that crashed mid-append,
+    which would hide every later record from _wal_read). Returns the
+    journal's new length in bytes; caller holds _index_lock().
+    """
+    with open(_WAL_PATH, "ab") as fh:
+        if fh.tell() > start:
+            log.warning("FAISS journal: dropping %d bytes of torn tail at offset %d", fh.tell() - start, start)
+            fh.truncate(start)
+        fh.write(b"".join(records))
+        fh.flush()
+        if _WAL_FSYNC:
+            os.fsync(fh.fileno())
+        return fh.tell()
+
+
+def _wal_truncate() -> None:
+    with open(_WAL_PATH, "wb") as fh:
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+def _wal_keep_tail(start: int) -> None:
+    """
+    Drop the journal's first `start` bytes (folded into a snapshot), keeping
+    records appended since. Replaced atomically; caller holds _index_lock().
+    """
+    with open(_WAL_PATH, "rb") as fh:
+        fh.seek(start)
+        tail = fh.read()
+    with open(_WAL_TMP_PATH, "wb") as fh:
+        fh.write(tail)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(_WAL_TMP_PATH, _WAL_PATH)
+
+
+def _wal_read(start: int = 0) -> Tuple[Dict[int, Optional[np.ndarray]], int]:
+    """
+    Fold the journal (from byte offset `start`) into {pk: final vector, or None if removed}.
+    Stops at the first torn or corrupt record (an interrupted append) and
+    returns the byte offset where the valid records end.
+    """
+    final: Dict[int, Optional[np.ndarray]] = {}
+    if not _WAL_PATH.exists():
+        return final, 0
+    with open(_WAL_PATH, "rb") as fh:
+        fh.seek(start)
+        buf = fh.read()
+    pos = 0
+    while pos + _WAL_HEADER.size <= len(buf):
+        op, pk, n, crc = _WAL_HEADER.unpack_from(buf, pos)
+        end = pos + _WAL_HEADER.size + 4 * n
+        if end > len(buf):
+            break
+        payload = buf[pos + _WAL_HEADER.size:end]
+        if zlib.crc32(payload, zlib.crc32(struct.pack("<cqI", op, pk, n))) != crc:
+            break
+        if op == b"U":
+            final[pk] = np.frombuffer(payload, dtype="float32")
+        elif op == b"R":
+            final[pk] = None
+        else:
+            break
+        pos = end
+    return final, start + pos
+
+
+def _apply_changes(index: faiss.Index, final: Dict[int, Optional[np.ndarray]]) -> faiss.Index:
+    """
+    Apply a {pk: vector-or-None} change set with one remove pass and one add pass.
+    """
+    if not final:
+        return index
+    touched = np.fromiter(final.keys(), dtype="int64", count=len(final))
+    index = _remove_ids(index, touched)
+    live = [(pk, v) for pk, v in final.items() if v is not None and v.shape[0] == index.d]
+    if live:
+        X = np.vstack([v for _, v in live]).astype("float32")
+        index.add_with_ids(X, np.array([pk for pk, _ in live], dtype="int64"))
+    return index
+
+
+def _replay_wal() -> Tuple[Dict[int, Optional[np.ndarray]], int]:
+    """
+    The whole journal as a change set, and the offset it ends at; caller holds _index_lock().
+    """
+    final, valid = _wal_read()
+    if _WAL_PATH.exists() and valid < _WAL_PATH.stat().st_size:
+        # Drop a torn tail so later appends don't land after garbage
+        with open(_WAL_PATH, "r+b") as fh:
+            fh.truncate(valid)
+    return final, valid
+
+
+def _base_version(index: faiss.Index, generation: Tuple[int, int]) -> IndexSnapshot:
+    """A version serving `index` (a published snapshot) with no changes on top."""
+    return IndexSnapshot(index, generation, 0, base_ids=_id_bitmap(_index_ids(index)))
+
+
+def _next_version(snap: IndexSnapshot, final: Dict[int, Optional[np.ndarray]],
+                  generation: Tuple[int, int], wal_pos: int) -> IndexSnapshot:
+    """
+    Copy-on-write: the version after applying a change set to `snap`, which
+    readers may be searching right now and is left untouched. Only the small
+    delta index is copied; the base is shared, and changed PKs are masked out
+    of it by setting their tombstone bits rather than removing their vectors.
     """
-    global _INDEX
-    if _INDEX is not None:
-        return _INDEX
+    if not final:
+        return snap._replace(generation=generation, wal_pos=wal_pos)
+    touched = np.fromiter(final.keys(), dtype="int64", count=len(final))
 
-    idx = _read_index()
+    if snap.delta is not None and snap.delta.ntotal:
+        delta = faiss.clone_index(snap.delta)
+        delta.remove_ids(faiss.IDSelectorBatch(touched))
+    else:
+        delta = faiss.index_factory(snap.index.d, "IDMap2,Flat", faiss.METRIC_INNER_PRODUCT)
+    live = [(pk, v) for pk, v in final.items() if v is not None and v.shape[0] == snap.index.d]
+    if live:
+        X = np.vstack([v for _, v in live]).astype("float32")
+        delta.add_with_ids(X, np.array([pk for pk, _ in live], dtype="int64"))
+
+    newly_dead = _has_ids(snap.base_ids, touched) & ~_has_ids(snap.dead, touched)
+    prev = snap.dead if snap.dead is not None else np.zeros(0, dtype="uint8")
+    dead = _id_bitmap(touched, len(prev))
+    dead[:len(prev)] |= prev
+    return snap._replace(generation=generation, wal_pos=wal_pos, delta=delta,
+                         dead=dead, n_dead=snap.n_dead + int(newly_dead.sum()))
+
+
+def _install(snap: IndexSnapshot) -> IndexSnapshot:
+    """
+    Make `snap` the serving version. Caller holds _index_lock().
+    """
+    global _SNAPSHOT, _CHECKED_AT
+    _SNAPSHOT = snap
+    _CHECKED_AT = time.monotonic()
+    return snap
+
+
+def _load_locked() -> IndexSnapshot:
+    """
+    Full (re)load of snapshot + journal; caller holds _index_lock().
+    The journal is replayed as tombstones and a delta over the snapshot, so
+    a mapped (read-only) snapshot is served the same way as an in-memory one.
+    """
+    idx = _read_index(mmap=_MMAP)
     if idx is None:
         idx = _new_index(get_dim())
-        _write_index_atomic(idx)
+        _publish_snapshot(idx)
+        idx = _served(idx)
     else:
         idx = _ensure_dim_compat(idx)
+    final, pos = _replay_wal()
+    gen = _read_generation()
+    return _install(_next_version(_base_version(idx, gen), final, gen, pos))
+
+
+def _catch_up_locked() -> IndexSnapshot:
+    """
+    Bring this process's index up to the current generation; caller holds _index_lock().
+    Journal-only changes are applied as a delta from the snapshot's journal
+    offset; a new snapshot triggers a full reload.
+    """
+    snap = _SNAPSHOT
+    gen = _read_generation()
+    if gen == snap.generation:
+        return snap
+    if gen[1] != snap.generation[1]:
+        return _load_locked()
+    final, pos = _wal_read(start=snap.wal_pos)
+    return _install(_next_version(snap, final, gen, pos))
+
+
+def compact_index() -> faiss.Index:
+    """
+    Fold the journal (and with it every tombstone and delta vector) into a
+    fresh snapshot. The expensive part, physically removing stale vectors
+    and re-adding current ones (an HNSW graph is rebuilt), runs without the
+    lock, so writers keep journaling meanwhile; their records are kept as the
+    new journal. If a rebuild or another compaction publishes a snapshot first,
+    this one is discarded. Returns the serving base index.
+    """
+    with _index_lock():
+        snap_gen = _read_generation()[1]
+        idx = _read_index()
+        final, pos = _wal_read()
+    if idx is None or idx.d != get_dim():
+        idx = _new_index(get_dim())
+    started = time.monotonic()
+    idx = _apply_changes(idx, final)
+
+    with _index_lock():
+        if _read_generation()[1] != snap_gen:
+            log.info("FAISS compaction superseded by a newer snapshot; discarded")
+            superseded = True
+        else:
+            superseded = False
+            _write_index_atomic(idx)
+            _wal_keep_tail(pos)
+            gen = _bump_generation(snapshot=True)
+            tail, end = _wal_read()
+            _install(_next_version(_base_version(_served(idx), gen), tail, gen, end))
+            log.info("compacted FAISS index: %d changes folded, %d vectors in %.1fs",
+                     len(final), idx.ntotal, time.monotonic() - started)
+    return load_index() if superseded else _SNAPSHOT.index
+
+
+# One background compaction at a time per process; held by the running thread.
+_COMPACTING = threading.Lock()
+
+
+def _compact_in_background() -> None:
+    if not _COMPACTING.acquire(blocking=False):
+        return
+
+    def run() -> None:
+        try:
+            compact_index()
+        except Exception:
+            log.exception("background FAISS compaction failed")
+        finally:
+            _COMPACTING.release()
+
+    threading.Thread(target=run, name="faiss-compact", daemon=True).start()
 
-    _INDEX = idx
-    return _INDEX
+
+def _needs_compaction(snap: IndexSnapshot) -> bool:
+    if snap.n_dead and snap.n_dead >= _TOMBSTONE_RATIO * max(1, snap.index.ntotal):
+        return True
+    if snap.delta is not None and snap.delta.ntotal >= _DELTA_MAX:
+        return True
+    try:
+        wal_bytes = _WAL_PATH.stat().st_size
+    except FileNotFoundError:
+        return False
+    if wal_bytes == 0:
+        return False
+    too_big = wal_bytes >= _WAL_MAX_BYTES
+    too_old = (
+        _SNAPSHOT_INTERVAL > 0
+        and _INDEX_PATH.exists()
+        and time.time() - _INDEX_PATH.stat().st_mtime >= _SNAPSHOT_INTERVAL
+    )
+    return too_big or too_old
+
+
+def _maybe_compact() -> None:
+    snap = _SNAPSHOT
+    if snap is not None and _needs_compaction(snap):
+        _compact_in_background()
+
+
+def load_index() -> faiss.Index:
+    """
+    Lazy-load the FAISS index (the snapshot's base index; journaled changes
+    sit beside it in current_snapshot()).
+    If missing or dim-mismatched, create an empty one with correct dim.
+    Once loaded, each call costs at most a 16-byte read of the generation
+    file (every FAISS_RELOAD_CHECK_S); changes made by other processes are
+    picked up only when the generation moves.
+    """
+    return current_snapshot().index
+
+
+def current_snapshot() -> IndexSnapshot:
+    """
+    The current index version, caught up with other processes' changes.
+    Lock-free unless the generation moved.
+    """
+    global _CHECKED_AT
+    snap = _SNAPSHOT
+    if snap is not None:
+        now = time.monotonic()
+        if now - _CHECKED_AT < _RELOAD_CHECK_S:
+            return snap
+        _CHECKED_AT = now
+        if _read_generation() == snap.generation:
+            return snap
+        with _index_lock():
+            _catch_up_locked()
+        return _SNAPSHOT
+
+    with _index_lock():
+        _load_locked()
+    return _SNAPSHOT
+
+
+def index_size() -> int:
+    """Number of live vectors searchable right now."""
+    return current_snapshot().ntotal
+
+
+def index_stats() -> Dict[str, float]:
+    snap = current_snapshot()
+    return {
+        "generation": snap.generation[0],
+        "layout": index_layout(snap.index),
+        "vectors": snap.ntotal,
+        "base": snap.index.ntotal,
+        "tombstones": snap.n_dead,
+        "tombstone_ratio": snap.n_dead / snap.index.ntotal if snap.index.ntotal else 0.0,
+        "delta": snap.delta.ntotal if snap.delta is not None else 0,
+        "compacting": _COMPACTING.locked(),
+    }
+
+
+def index_generation() -> int:
+    """
+    Generation of the index this process is serving (see doctors.index.gen);
+    changes whenever any process upserts, removes or rebuilds.
+    """
+    return current_snapshot().generation[0]
 
 
 # -----------------------------
 # Data streaming from Postgres
 # -----------------------------
-def _iter_active_doctors(batch_size: int = 512) -> Iterable[Tuple[int, str]]:
+def _active_doctors(after_pk: Optional[int] = None) -> QuerySet:
+    Doctor = _DoctorModel()
+    qs: QuerySet = Doctor.objects.filter(is_active=True)
+    if after_pk is not None:
+        qs = qs.filter(pk__gt=after_pk)
+    return qs
+
+
+def _iter_active_doctors(batch_size: int = 512, after_pk: Optional[int] = None) -> Iterable[Tuple[int, str]]:
     """
-    Stream (pk, text_block) for active doctors.
+    Stream (pk, text_block) for active doctors, in pk order.
     Uses pk because your model's PK is the OneToOne (not 'id').
+    after_pk resumes the stream past an already-indexed prefix.
     """
-    Doctor = _DoctorModel()
-    qs: QuerySet = (
-        Doctor.objects
-        .filter(is_active=True)
-        .order_by("pk")
-        .values_list("pk", "text_block")
-    )
+    qs = _active_doctors(after_pk).order_by("pk").values_list("pk", "text_block")
     for pk, text in qs.iterator(chunk_size=batch_size):
         yield int(pk), (text or "")
 
 
+def _iter_chunks(batch_size: int, after_pk: Optional[int] = None) -> Iterable[Tuple[np.ndarray, List[str]]]:
+    ids: List[int] = []
+    texts: List[str] = []
+    for pk, text in _iter_active_doctors(batch_size=batch_size, after_pk=after_pk):
+        ids.append(pk)
+        texts.append(text)
+        if len(ids) >= batch_size:
+            yield np.array(ids, dtype="int64"), texts
+            ids, texts = [], []
+    if ids:
+        yield np.array(ids, dtype="int64"), texts
+
+
 # -----------------------------
 # Build / Rebuild
 # -----------------------------
-def rebuild_index(batch_size: int = 512) -> faiss.Index:
+# A rebuild checkpoints its partial index here so `build_faiss_index --resume`
+# can continue after a crash instead of re-embedding everything.
+_CKPT_PATH = _INDEX_DIR / "doctors.index.build"
+_CKPT_TMP_PATH = _INDEX_DIR / "doctors.index.build.tmp"
+_CKPT_META_PATH = _INDEX_DIR / "doctors.index.build.json"
+_REBUILD_WORKERS = int(getattr(settings, "FAISS_REBUILD_WORKERS", 2))
+_CHECKPOINT_EVERY = int(getattr(settings, "FAISS_REBUILD_CHECKPOINT_EVERY", 50_000))
+
+
+def _train_size(index: faiss.Index, total: int) -> int:
     """
-    Rebuild the full index from Postgres (active doctors only).
+    Vectors to buffer for training: k-means samples at most 256 points per
+    centroid (IVF lists, PQ codebook entries), so more would only cost memory.
     """
-    ids: List[int] = []
-    chunks: List[str] = []
-    vecs: List[np.ndarray] = []
+    if index.is_trained:
+        return 0
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return total
+    want = 256 * ivf.nlist
+    pq = getattr(faiss.downcast_index(ivf), "pq", None)
+    if pq is not None:
+        want = max(want, 256 * pq.ksub)
+    return min(total, want)
+
+
+def _checkpoint_meta() -> Dict[str, Any]:
+    return {"model": get_model_name(), "dim": get_dim(), "spec": index_spec()}
 
-    for pk, text in _iter_active_doctors(batch_size=batch_size):
-        ids.append(pk)
-        chunks.append(text)
-        if len(chunks) >= batch_size:
-            vecs.append(encode(chunks))
-            chunks.clear()
 
-    if chunks:
-        vecs.append(encode(chunks))
+def _write_checkpoint(index: faiss.Index, last_pk: int, done: int) -> None:
+    faiss.write_index(index, str(_CKPT_TMP_PATH))
+    os.replace(_CKPT_TMP_PATH, _CKPT_PATH)
+    meta = {**_checkpoint_meta(), "last_pk": last_pk, "done": done}
+    _CKPT_META_PATH.write_text(json.dumps(meta))
 
+
+def _read_checkpoint() -> Optional[Tuple[faiss.Index, int, int]]:
+    """
+    (partial index, last indexed pk, docs done), or None when there is no
+    checkpoint or it was made with a different model or index layout.
+    """
+    try:
+        meta = json.loads(_CKPT_META_PATH.read_text())
+        index = faiss.read_index(str(_CKPT_PATH))
+    except (OSError, ValueError, RuntimeError):
+        return None
+    if {k: meta.get(k) for k in ("model", "dim", "spec")} != _checkpoint_meta():
+        log.warning("rebuild checkpoint was made with a different model or index spec; starting over")
+        return None
+    return index, int(meta["last_pk"]), int(meta["done"])
+
+
+def _clear_checkpoint() -> None:
+    for path in (_CKPT_PATH, _CKPT_TMP_PATH, _CKPT_META_PATH):
+        path.unlink(missing_ok=True)
+
+
+def rebuild_index(batch_size: int = 512, workers: Optional[int] = None, resume: bool = False,
+                  progress: Optional[Callable[[int, int, float], None]] = None) -> faiss.Index:
+    """
+    Rebuild the full index from Postgres (active doctors only).
+
+    Pipelined: the calling thread streams chunks from the DB while up to
+    `workers` chunks are tokenized and encoded on a thread pool (text already
+    in the embedding store is read back, not re-encoded); vectors are
+    added to the index as each chunk completes (in pk order), so memory stays
+    bounded by the in-flight chunks plus the IVF/PQ training sample.
+    Every FAISS_REBUILD_CHECKPOINT_EVERY docs the partial index is checkpointed;
+    resume=True continues from the last checkpoint. progress(done, total, docs_per_s)
+    is called after every chunk.
+    """
+    workers = max(1, int(workers or _REBUILD_WORKERS))
     dim = get_dim()
-    index = _new_index(dim)
+    total = _active_doctors().count()
 
-    if vecs:
-        X = np.vstack(vecs).astype("float32")   # (N, d)
-        I = np.array(ids, dtype="int64")        # doctor PKs
-        index.add_with_ids(X, I)
+    ckpt = _read_checkpoint() if resume else None
+    if ckpt is not None:
+        index, last_pk, done = ckpt
+        log.info("resuming rebuild after pk %d (%d docs already indexed)", last_pk, done)
+    else:
+        _clear_checkpoint()
+        index, last_pk, done = _new_index(dim, n_train=total), None, 0
 
-    _write_index_atomic(index)
+    train_size = _train_size(index, total)
+    train_ids: List[np.ndarray] = []
+    train_vecs: List[np.ndarray] = []
+    started, start_done, last_ckpt = time.monotonic(), done, done
 
-    # refresh singleton
-    global _INDEX
-    _INDEX = index
+    def add(ids: np.ndarray, X: np.ndarray) -> None:
+        nonlocal done, last_pk, last_ckpt
+        if not index.is_trained:
+            # Buffer only until there's enough to train on, then add the sample too
+            train_ids.append(ids)
+            train_vecs.append(X)
+            if sum(len(i) for i in train_ids) < train_size:
+                return
+            ids, X = np.concatenate(train_ids), np.vstack(train_vecs)
+            train_ids.clear()
+            train_vecs.clear()
+            index.train(X)
+        index.add_with_ids(X, ids)
+        done += len(ids)
+        last_pk = int(ids[-1])
+        if done - last_ckpt >= _CHECKPOINT_EVERY:
+            _write_checkpoint(index, last_pk, done)
+            last_ckpt = done
+        if progress is not None:
+            elapsed = time.monotonic() - started
+            progress(done, total, (done - start_done) / elapsed if elapsed > 0 else 0.0)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="faiss-rebuild") as pool:
+        inflight: Deque[Tuple[np.ndarray, Future]] = deque()
+        for ids, texts in _iter_chunks(batch_size, after_pk=last_pk):
+            inflight.append((ids, pool.submit(encode_documents, texts, batch_size)))
+            # Bound read-ahead: keep every worker busy plus one queued chunk each
+            while len(inflight) > 2 * workers:
+                ids, fut = inflight.popleft()
+                add(ids, fut.result())
+        while inflight:
+            ids, fut = inflight.popleft()
+            add(ids, fut.result())
+
+    if train_ids:
+        # Fewer docs than the estimated training sample (rows deactivated mid-build)
+        X = np.vstack(train_vecs)
+        index.train(X)
+        index.add_with_ids(X, np.concatenate(train_ids))
+
+    elapsed = time.monotonic() - started
+    log.info("rebuilt FAISS index: %d vectors in %.1fs (%.0f docs/s)",
+             index.ntotal, elapsed, (done - start_done) / elapsed if elapsed > 0 else 0.0)
+
+    with _index_lock():
+        # the fresh snapshot supersedes every journaled change; refresh singleton
+        gen = _publish_snapshot(index)
+        index = _install(_base_version(_served(index), gen)).index
+    _clear_checkpoint()
     return index
 
 
 # -----------------------------
 # Search / Upsert / Remove
 # -----------------------------
-def search_knn(query_text: str, topk: int = 50) -> List[Tuple[int, float]]:
+def search_knn(query_text: str, topk: int = 50, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> List[Tuple[int, float]]:
     """
     Embed query (normalized) and return [(doctor_pk, similarity), ...].
+    nprobe (IVF) / ef_search (HNSW) override the FAISS_INDEX_SPEC defaults.
+    """
+    return search_knn_batch([query_text], topk=topk, nprobe=nprobe, ef_search=ef_search)[0]
+
+
+def search_knn_batch(query_texts: List[str], topk: int = 50, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None,
+                     allowed_ids: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
     """
-    index = load_index()
-    if index.ntotal == 0:
+    Batched variant of search_knn: one encode() call and one index.search()
+    over the stacked (n, d) query matrix. Returns one hit list per query,
+    in input order.
+    """
+    if not query_texts:
         return []
+    if index_size() == 0:
+        return [[] for _ in query_texts]
+    Q = encode(list(query_texts), use_cache=True)  # (n, d)
+    return search_vectors(Q, topk, nprobe=nprobe, ef_search=ef_search, allowed_ids=allowed_ids)
+
 
-    q = encode([query_text])  # (1, d)
-    D, I = index.search(q, topk)
-    out: List[Tuple[int, float]] = []
-    for pk, sim in zip(I[0].tolist(), D[0].tolist()):
-        if pk != -1:
-            out.append((int(pk), float(sim)))
+def search_vectors(Q: np.ndarray, topk: int = 50, nprobe: Optional[int] = None,
+                   ef_search: Optional[int] = None,
+                   allowed_ids: Optional[np.ndarray] = None,
+                   allowed_bitmap: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+    """
+    Search already-embedded queries. allowed_ids (doctor PKs) filters inside
+    FAISS through an ID selector, so the topk returned all pass the filter.
+    allowed_bitmap is the same set as an _id_bitmap(), for callers that keep
+    one cached (DoctorAttributeStore.filter_bitmap); otherwise it's built here.
+    """
+    snap = current_snapshot()
+    if snap.ntotal == 0 or (allowed_ids is not None and len(allowed_ids) == 0):
+        return [[] for _ in range(len(Q))]
+    with timed("faiss"):
+        D, I = _search_snapshot(snap, np.ascontiguousarray(Q, dtype="float32"), topk,
+                                nprobe, ef_search, allowed_ids, allowed_bitmap)
+    out: List[List[Tuple[int, float]]] = []
+    for row_ids, row_sims in zip(I.tolist(), D.tolist()):
+        out.append([(int(pk), float(sim)) for pk, sim in zip(row_ids, row_sims) if pk != -1])
     return out
 
 
-def upsert_doctor_vector(doctor_pk: int, text_block: str) -> None:
+def _search_snapshot(snap: IndexSnapshot, Q: np.ndarray, topk: int, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None,
+                     allowed_ids: Optional[np.ndarray] = None,
+                     allowed_bitmap: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Incremental update: remove old vector for PK (if any), then add new one.
+    (D, I) over one version: the base with tombstoned PKs masked out by an
+    ID selector, merged with the delta's hits.
     """
-    index = load_index()
+    allowed = None
+    if allowed_bitmap is None and allowed_ids is not None:
+        allowed_bitmap = _id_bitmap(allowed_ids)
+    if allowed_bitmap is not None:
+        allowed = faiss.IDSelectorBitmap(len(allowed_bitmap), faiss.swig_ptr(allowed_bitmap))
+    sel = allowed
+    if snap.n_dead:
+        # The selectors point into snap.dead and allowed_bitmap, which outlive the search
+        tombstones = faiss.IDSelectorBitmap(len(snap.dead), faiss.swig_ptr(snap.dead))
+        not_dead = faiss.IDSelectorNot(tombstones)
+        sel = not_dead if allowed is None else faiss.IDSelectorAnd(allowed, not_dead)
+    D, I = snap.index.search(Q, topk, params=_search_params(snap.index, nprobe, ef_search, sel))
 
-    # Remove existing vector for this PK (no-op if absent)
-    sel = faiss.IDSelectorBatch(np.array([doctor_pk], dtype="int64"))
-    index.remove_ids(sel)
+    if snap.delta is None or snap.delta.ntotal == 0:
+        return D, I
+    dD, dI = snap.delta.search(Q, min(topk, snap.delta.ntotal),
+                               params=_search_params(snap.delta, sel=allowed))
+    D, I = np.hstack([D, dD]), np.hstack([I, dI])
+    D[I == -1] = -np.inf
+    order = np.argsort(-D, axis=1, kind="stable")[:, :topk]
+    return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
 
-    # Add new vector
-    v = encode([text_block]).astype("float32")  # (1, d)
-    index.add_with_ids(v, np.array([doctor_pk], dtype="int64"))
 
-    _write_index_atomic(index)
+def apply_doctor_changes(upserts: Dict[int, str], removes: Iterable[int] = (),
+                         batch_size: int = 256) -> None:
+    """
+    Apply many changes at once: one encode_documents() over all upserted
+    texts (text already in the embedding store is not re-encoded) and one
+    journal append. The index itself is not rewritten: changed PKs are
+    tombstoned in the base and upserted vectors appended to a small delta
+    index (published as a new version; searches in flight keep the one they
+    started with). Compaction folds them in later, in the background.
+    A PK present in both arguments is upserted.
+    """
+    final: Dict[int, Optional[np.ndarray]] = {int(pk): None for pk in removes}
+    if upserts:
+        pks = [int(pk) for pk in upserts]
+        X = encode_documents([upserts[pk] for pk in upserts], batch_size=batch_size)
+        final.update(zip(pks, X))
+    apply_vector_changes(final)
+
+
+def apply_vector_changes(final: Dict[int, Optional[np.ndarray]]) -> None:
+    """
+    Journal and publish a {pk: vector, or None to remove} change set.
+    """
+    if not final:
+        return
+    records = [_wal_record(b"R", pk) if v is None else _wal_record(b"U", pk, v) for pk, v in final.items()]
+    load_index()
+    with _index_lock():
+        # Apply other processes' changes first so ours land on top, in journal order
+        snap = _catch_up_locked()
+        pos = _wal_append(records, snap.wal_pos)
+        _install(_next_version(snap, final, _bump_generation(), pos))
+    _maybe_compact()
+
+
+def upsert_doctor_vector(doctor_pk: int, text_block: str) -> None:
+    """
+    Incremental update: publish a new in-memory version with PK's old vector
+    tombstoned and the new one appended, and journal the change.
+    O(1) disk I/O; the snapshot is rewritten only on compaction.
+    """
+    apply_doctor_changes({int(doctor_pk): text_block})
 
 
 def remove_doctor_vector(doctor_pk: int) -> None:
     """
-    Remove a doctor from the index (deactivated/deleted).
+    Remove a doctor from the index (deactivated/deleted) and journal the change.
     """
-    index = load_index()
-    sel = faiss.IDSelectorBatch(np.array([doctor_pk], dtype="int64"))
-    index.remove_ids(sel)
-    _write_index_atomic(index)
+    apply_doctor_changes({}, [int(doctor_pk)])
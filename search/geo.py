@@ -0,0 +1,112 @@
+# search/geo.py
+from __future__ import annotations
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+import math
+
+import numpy as np
+import yaml
+from django.conf import settings
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Great-circle distance from one point to arrays of points, in km.
+    NaN coordinates propagate as NaN.
+    """
+    p1, l1 = math.radians(lat), math.radians(lon)
+    p2, l2 = np.radians(lats), np.radians(lons)
+    a = np.sin((p2 - p1) / 2.0) ** 2 + math.cos(p1) * np.cos(p2) * np.sin((l2 - l1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class GeoGrid:
+    """
+    Uniform lat/lon grid over row ids: cell -> rows. Radius queries only
+    visit the cells overlapping the query's bounding box.
+    """
+    def __init__(self, cell_deg: float = 0.25):
+        self.cell_deg = float(cell_deg)
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._cell_of: Dict[int, Tuple[int, int]] = {}
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def put(self, row: int, lat: Optional[float], lon: Optional[float]) -> None:
+        self.remove(row)
+        if lat is None or lon is None or math.isnan(lat) or math.isnan(lon):
+            return
+        cell = self._cell(lat, lon)
+        self._cells.setdefault(cell, set()).add(row)
+        self._cell_of[row] = cell
+
+    def remove(self, row: int) -> None:
+        cell = self._cell_of.pop(row, None)
+        if cell is not None:
+            rows = self._cells[cell]
+            rows.discard(row)
+            if not rows:
+                del self._cells[cell]
+
+    def candidates(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Rows in cells overlapping the radius' bounding box (a superset of the answer)."""
+        ang = radius_km / EARTH_RADIUS_KM
+        dlat = math.degrees(ang)
+        lo_i, hi_i = self._cell(lat - dlat, 0.0)[0], self._cell(lat + dlat, 0.0)[0]
+        s = math.sin(min(ang, math.pi / 2)) / max(math.cos(math.radians(lat)), 1e-12)
+        if lat + dlat >= 90.0 or lat - dlat <= -90.0 or s >= 1.0:
+            lons = None  # the circle reaches a pole: every longitude
+        else:
+            # Widest longitude offset on the circle (not at its centre latitude)
+            dlon = math.degrees(math.asin(s))
+            lo, hi = lon - dlon, lon + dlon
+            spans = [(lo, hi)]
+            if lo < -180.0:
+                spans = [(lo + 360.0, 180.0), (-180.0, hi)]
+            elif hi > 180.0:
+                spans = [(lo, 180.0), (-180.0, hi - 360.0)]
+            lons = [(self._cell(0.0, a)[1], self._cell(0.0, b)[1]) for a, b in spans]
+
+        def in_box(cell: Tuple[int, int]) -> bool:
+            return lo_i <= cell[0] <= hi_i and (lons is None or any(a <= cell[1] <= b for a, b in lons))
+
+        n_cols = sum(b - a + 1 for a, b in lons) if lons is not None else float("inf")
+        if (hi_i - lo_i + 1) * n_cols >= len(self._cells):
+            # Box covers more cells than are occupied: scan occupied cells instead
+            rows = [r for cell, rs in self._cells.items() if in_box(cell) for r in rs]
+        else:
+            rows = []
+            for i in range(lo_i, hi_i + 1):
+                for a, b in lons:
+                    for j in range(a, b + 1):
+                        rows.extend(self._cells.get((i, j), ()))
+        return np.array(rows, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self._cell_of)
+
+
+# -----------------------------
+# Pincode centroids
+# -----------------------------
+def _centroids_path() -> Path:
+    path = getattr(settings, "PINCODE_CENTROIDS_PATH", None)
+    if path is None:
+        path = Path(settings.BASE_DIR) / "config" / "pincode_centroids.yml"
+    return Path(path)
+
+@lru_cache(maxsize=1)
+def _centroids() -> Dict[str, Tuple[float, float]]:
+    path = _centroids_path()
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f) or {}
+    return {str(pin).strip(): (float(ll[0]), float(ll[1])) for pin, ll in (data.get("centroids") or {}).items()}
+
+def pincode_centroid(pincode: str) -> Optional[Tuple[float, float]]:
+    return _centroids().get(str(pincode or "").strip())
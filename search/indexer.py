@@ -0,0 +1,254 @@
+# search/indexer.py
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .faiss_store import apply_doctor_changes
+
+log = logging.getLogger(__name__)
+
+# Max doctors embedded per worker pass, and how long the worker waits for
+# more events to coalesce before starting a pass.
+_BATCH_SIZE = int(getattr(settings, "SEARCH_INDEX_BATCH_SIZE", 64))
+_DEBOUNCE_S = float(getattr(settings, "SEARCH_INDEX_DEBOUNCE_MS", 200)) / 1000.0
+# False = apply each change inline (management commands, tests)
+_ASYNC = bool(getattr(settings, "SEARCH_INDEX_ASYNC", True))
+
+_RETRY_DELAY_S = 1.0
+# A change that fails this many passes in a row is dropped (logged), so one
+# bad record can't stall the queue, drain() or the exit-time drain forever
+_MAX_ATTEMPTS = 5
+
+
+class IndexingQueue:
+    """
+    In-process queue of pending index changes, keyed by doctor PK.
+    Re-enqueuing a PK replaces its pending event (last write wins) but keeps
+    the original enqueue time, so lag reflects how stale the index really is.
+    A daemon worker drains it in batches through apply_doctor_changes().
+    A failing batch is retried change by change; a change that keeps
+    failing is dropped after _MAX_ATTEMPTS passes.
+    """
+    def __init__(self, batch_size: int = _BATCH_SIZE, debounce_s: float = _DEBOUNCE_S):
+        self.batch_size = max(1, int(batch_size))
+        self.debounce_s = max(0.0, float(debounce_s))
+        # pk -> (text_block or None for remove, first enqueue time)
+        self._pending: "OrderedDict[int, Tuple[Optional[str], float]]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._busy = False
+        self._worker: Optional[threading.Thread] = None
+        # pk -> consecutive failed passes of its pending change
+        self._failures: Dict[int, int] = {}
+
+        self.enqueued = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.applied_upserts = 0
+        self.applied_removes = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0
+        self.last_batch_size = 0
+        self.last_lag_s = 0.0
+        self.max_lag_s = 0.0
+
+    # -- producers --
+    def upsert(self, pk: int, text_block: str) -> None:
+        self._put(int(pk), text_block or "")
+
+    def remove(self, pk: int) -> None:
+        self._put(int(pk), None)
+
+    def skip(self) -> None:
+        """Count a save that left the indexed fields unchanged (no event queued)."""
+        with self._cond:
+            self.skipped += 1
+
+    def _put(self, pk: int, text: Optional[str]) -> None:
+        with self._cond:
+            prev = self._pending.pop(pk, None)
+            if prev is not None:
+                self.coalesced += 1
+            self._failures.pop(pk, None)  # a new change gets its own attempts
+            self._pending[pk] = (text, prev[1] if prev else time.monotonic())
+            self.enqueued += 1
+            self._ensure_worker()
+            self._cond.notify_all()
+
+    # -- consumer --
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="search-indexer", daemon=True)
+            self._worker.start()
+
+    def _take_batch(self) -> Dict[int, Tuple[Optional[str], float]]:
+        batch = {}
+        while self._pending and len(batch) < self.batch_size:
+            pk, item = self._pending.popitem(last=False)
+            batch[pk] = item
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending or self._busy:
+                    self._cond.wait()
+                if len(self._pending) < self.batch_size and self.debounce_s:
+                    # Let a burst of saves collapse first: every enqueue notifies,
+                    # so keep waiting out the window unless the batch fills up
+                    deadline = time.monotonic() + self.debounce_s
+                    while len(self._pending) < self.batch_size and not self._busy:
+                        left = deadline - time.monotonic()
+                        if left <= 0:
+                            break
+                        self._cond.wait(left)
+                    if self._busy or not self._pending:
+                        continue  # drain() took over while we waited
+                batch = self._take_batch()
+                self._busy = True
+            try:
+                self._apply(batch)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _apply(self, batch: Dict[int, Tuple[Optional[str], float]]) -> None:
+        if not batch:
+            return
+        try:
+            self._apply_batch(batch)
+            return
+        except Exception:
+            log.exception("search indexer: failed to apply %d changes", len(batch))
+        failed = batch
+        if len(batch) > 1:
+            # Apply one by one so the changes that are fine don't wait on a bad one
+            failed = {}
+            for pk, item in batch.items():
+                try:
+                    self._apply_batch({pk: item})
+                except Exception:
+                    log.exception("search indexer: failed to apply the change for doctor %s", pk)
+                    failed[pk] = item
+
+        retry = False
+        with self._cond:
+            self.errors += 1
+            for pk, item in failed.items():
+                if pk in self._pending:
+                    continue  # a newer event for the same PK arrived meanwhile
+                attempts = self._failures.get(pk, 0) + 1
+                if attempts >= _MAX_ATTEMPTS:
+                    self._failures.pop(pk, None)
+                    self.dropped += 1
+                    log.error("search indexer: dropping the change for doctor %s after %d attempts; "
+                              "run drain_index_queue once the cause is fixed", pk, attempts)
+                    continue
+                self._failures[pk] = attempts
+                self._pending[pk] = item
+                self._pending.move_to_end(pk, last=False)
+                retry = True
+        if retry:
+            time.sleep(_RETRY_DELAY_S)
+
+    def _apply_batch(self, batch: Dict[int, Tuple[Optional[str], float]]) -> None:
+        upserts = {pk: text for pk, (text, _) in batch.items() if text is not None}
+        removes = [pk for pk, (text, _) in batch.items() if text is None]
+        apply_doctor_changes(upserts, removes, batch_size=self.batch_size)
+
+        lag = time.monotonic() - min(t for _, t in batch.values())
+        with self._cond:
+            for pk in batch:
+                self._failures.pop(pk, None)
+            self.batches += 1
+            self.applied_upserts += len(upserts)
+            self.applied_removes += len(removes)
+            self.last_batch_size = len(batch)
+            self.last_lag_s = lag
+            self.max_lag_s = max(self.max_lag_s, lag)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Apply everything pending on the calling thread; returns True once the
+        queue is empty and the worker is idle.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while self._busy:
+                    left = None if deadline is None else deadline - time.monotonic()
+                    if left is not None and left <= 0:
+                        return False
+                    self._cond.wait(left)
+                if not self._pending:
+                    return True
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                batch = self._take_batch()
+                self._busy = True
+            try:
+                self._apply(batch)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            now = time.monotonic()
+            oldest = min((t for _, t in self._pending.values()), default=None)
+            return {
+                "depth": len(self._pending),
+                "oldest_pending_s": (now - oldest) if oldest is not None else 0.0,
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "skipped": self.skipped,
+                "applied_upserts": self.applied_upserts,
+                "applied_removes": self.applied_removes,
+                "batches": self.batches,
+                "errors": self.errors,
+                "dropped": self.dropped,
+                "last_batch_size": self.last_batch_size,
+                "last_lag_s": self.last_lag_s,
+                "max_lag_s": self.max_lag_s,
+            }
+
+
+_QUEUE = IndexingQueue()
+
+
+def enqueue_upsert(pk: int, text_block: str) -> None:
+    if _ASYNC:
+        _QUEUE.upsert(pk, text_block)
+    else:
+        apply_doctor_changes({int(pk): text_block})
+
+
+def enqueue_remove(pk: int) -> None:
+    if _ASYNC:
+        _QUEUE.remove(pk)
+    else:
+        apply_doctor_changes({}, [int(pk)])
+
+
+def note_skipped() -> None:
+    _QUEUE.skip()
+
+
+def drain(timeout: Optional[float] = None) -> bool:
+    return _QUEUE.drain(timeout)
+
+
+# Don't lose pending changes when a script or management command exits
+atexit.register(drain, 30.0)
+
+
+def indexing_queue_stats() -> Dict[str, float]:
+    return _QUEUE.stats()
@@ -0,0 +1,120 @@
+# search/management/commands/bench_index_churn.py
+import time
+
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from search.faiss_store import (
+    _DELTA_MAX, _TOMBSTONE_RATIO, _apply_changes, _base_version, _new_index, _next_version,
+    _search_snapshot,
+)
+
+def _unit_rows(rng, n, dim):
+    X = rng.standard_normal((n, dim), dtype=np.float32)
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    return X
+
+def _change_set(rng, n, batch, dim, remove_frac):
+    """One write: `batch` distinct existing PKs, some removed and the rest re-embedded."""
+    pks = rng.choice(n, size=batch, replace=False).astype(np.int64) + 1
+    X = _unit_rows(rng, batch, dim)
+    return {int(pk): (None if rng.random() < remove_frac else X[i]) for i, pk in enumerate(pks)}
+
+def _latency_ms(snap, Q, topk):
+    times = []
+    for q in Q:
+        t0 = time.perf_counter()
+        _search_snapshot(snap, q[None, :], topk)
+        times.append((time.perf_counter() - t0) * 1000)
+    return np.percentile(times, 50), np.percentile(times, 99)
+
+class Command(BaseCommand):
+    help = ("Churn benchmark for the FAISS write path on synthetic in-memory vectors (the served "
+            "index is not touched): tombstone+delta writes versus copy-and-remove_ids, compaction "
+            "time, and search latency as tombstones accumulate.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="100000,1000000")
+        parser.add_argument("--dim", type=int, default=384)
+        parser.add_argument("--type", default="flat", help="FAISS_INDEX_SPEC type of the base index")
+        parser.add_argument("--writes", type=int, default=500)
+        parser.add_argument("--batch", type=int, default=64,
+                            help="doctors changed per write (cf. SEARCH_INDEX_BATCH_SIZE)")
+        parser.add_argument("--remove-frac", type=float, default=0.2)
+        parser.add_argument("--ratios", default="0.01,0.05,0.1,0.2",
+                            help="tombstone ratios at which search latency is sampled")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--topk", type=int, default=50)
+        parser.add_argument("--baseline-ops", type=int, default=5,
+                            help="writes timed on the old copy-and-remove_ids path (0 = skip)")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **opts):
+        dim, batch, topk = opts["dim"], max(1, opts["batch"]), opts["topk"]
+        ratios = sorted(float(x) for x in opts["ratios"].split(",") if x.strip())
+        for n in [int(x) for x in opts["sizes"].split(",") if x.strip()]:
+            rng = np.random.default_rng(opts["seed"])
+            X = _unit_rows(rng, n, dim)
+            t0 = time.perf_counter()
+            base = _new_index(dim, {"type": opts["type"]}, n_train=n)
+            if not base.is_trained:
+                base.train(X[rng.choice(n, size=min(n, 256 * 1024), replace=False)])
+            base.add_with_ids(X, np.arange(1, n + 1, dtype=np.int64))
+            del X
+            Q = _unit_rows(rng, opts["queries"], dim)
+            self.stdout.write(f"n={n:,} dim={dim} type={opts['type']} batch={batch} "
+                              f"built in {time.perf_counter() - t0:.1f}s")
+
+            if opts["baseline_ops"] > 0:
+                t0 = time.perf_counter()
+                for _ in range(opts["baseline_ops"]):
+                    _apply_changes(faiss.clone_index(base), _change_set(rng, n, batch, dim, opts["remove_frac"]))
+                per_op = (time.perf_counter() - t0) / opts["baseline_ops"]
+                self.stdout.write(f"  copy+remove_ids: {1 / per_op:10.1f} writes/s  ({per_op * 1000:8.2f} ms/write)")
+
+            # Mixed churn, compacting when the store would (FAISS_DELTA_MAX / FAISS_TOMBSTONE_RATIO);
+            # compaction runs in the background there, so it's timed separately here.
+            snap, final = _base_version(base, (0, 0)), {}
+            del base
+            t_write, t_compact, compactions = 0.0, 0.0, 0
+            for w in range(opts["writes"]):
+                changes = _change_set(rng, n, batch, dim, opts["remove_frac"])
+                t0 = time.perf_counter()
+                snap = _next_version(snap, changes, (w + 1, 0), 0)
+                t_write += time.perf_counter() - t0
+                final.update(changes)
+                if snap.delta.ntotal >= _DELTA_MAX or snap.n_dead >= _TOMBSTONE_RATIO * snap.index.ntotal:
+                    t0 = time.perf_counter()
+                    snap = _base_version(_apply_changes(faiss.clone_index(snap.index), final), (w + 1, w + 1))
+                    t_compact += time.perf_counter() - t0
+                    final, compactions = {}, compactions + 1
+            if opts["writes"]:
+                self.stdout.write(
+                    f"  tombstone+delta: {opts['writes'] / t_write:10.1f} writes/s  "
+                    f"({t_write / opts['writes'] * 1000:8.2f} ms/write)  "
+                    f"{compactions} compactions, {t_compact / max(1, compactions):.2f}s each"
+                )
+
+            # Tombstoned + delta search must match the same changes compacted
+            t0 = time.perf_counter()
+            compacted = _apply_changes(faiss.clone_index(snap.index), final)
+            t_fold = time.perf_counter() - t0
+            if opts["type"] == "flat" and not np.array_equal(
+                    _search_snapshot(snap, Q, topk)[1],
+                    _search_snapshot(_base_version(compacted, (0, 0)), Q, topk)[1]):
+                raise CommandError(f"tombstoned search diverged from the compacted index at n={n}")
+            checked = "identical=yes" if opts["type"] == "flat" else "(approximate layout, not compared)"
+            self.stdout.write(f"  compaction of {len(final):,} pending changes: {t_fold:.2f}s  {checked}")
+            del compacted
+
+            # Search latency as deactivations pile up (removes only touch the tombstone bitmap)
+            snap = _base_version(snap.index, (0, 0))
+            for ratio in [0.0] + ratios:
+                while snap.n_dead < ratio * n:
+                    snap = _next_version(snap, _change_set(rng, n, batch, dim, 1.0), (1, 0), 0)
+                p50, p99 = _latency_ms(snap, Q, topk)
+                self.stdout.write(
+                    f"  search @ {100 * snap.n_dead / n:4.1f}% tombstoned:  p50={p50:7.2f} ms  p99={p99:7.2f} ms"
+                )
+            del snap
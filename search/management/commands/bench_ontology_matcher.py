@@ -0,0 +1,71 @@
+# search/management/commands/bench_ontology_matcher.py
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from search.ontology import SpecialtyOntology, get_ontology
+
+def _legacy_infer(onto: SpecialtyOntology, text: str) -> set:
+    """The pre-matcher loop: one substring scan per label and per synonym."""
+    found = set()
+    for lc, canon in onto._label_lc.items():
+        if lc and lc in text:
+            found.add(canon)
+    for token, targets in onto.synonyms.items():
+        if token in text:
+            found.update(targets)
+    return found
+
+def _synthetic(n_synonyms: int, seed: int = 0) -> SpecialtyOntology:
+    rng = random.Random(seed)
+    labels = [f"Specialty {i}" for i in range(200)]
+    word = lambda: "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+    synonyms = {}
+    while len(synonyms) < n_synonyms:
+        phrase = " ".join(word() for _ in range(rng.randint(1, 3)))
+        synonyms[phrase] = [rng.choice(labels)]
+    return SpecialtyOntology({"specialties": {"General": labels}, "synonyms": synonyms})
+
+class Command(BaseCommand):
+    help = "Micro-benchmark SpecialtyOntology.infer_from_text against the legacy substring loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--synonyms", type=int, default=5000,
+                            help="Synonym count for the synthetic ontology (0 = configured ontology only).")
+        parser.add_argument("--iterations", type=int, default=2000)
+
+    def _bench(self, label: str, onto: SpecialtyOntology, texts, iterations: int) -> None:
+        t0 = time.perf_counter()
+        for i in range(iterations):
+            _legacy_infer(onto, texts[i % len(texts)])
+        legacy = (time.perf_counter() - t0) / iterations * 1e6
+
+        t0 = time.perf_counter()
+        for i in range(iterations):
+            onto.infer_from_text(texts[i % len(texts)], "")
+        compiled = (time.perf_counter() - t0) / iterations * 1e6
+
+        self.stdout.write(
+            f"{label:28s} needles={len(onto._needles):6d}  legacy={legacy:9.1f} us  "
+            f"matcher={compiled:8.1f} us  speedup={legacy / max(compiled, 1e-9):6.1f}x"
+        )
+
+    def handle(self, *args, **opts):
+        texts = [
+            "chest pain radiating to left arm, shortness of breath on exertion",
+            "persistent cough and fever for two weeks, history of asthma and diabetes",
+            "severe headache with blurred vision; on treatment for thyroid disorder",
+            "pregnant, 32 weeks, elevated blood pressure and swelling in feet",
+        ]
+        self._bench("configured ontology", get_ontology(), [t.lower() for t in texts], opts["iterations"])
+
+        if opts["synonyms"]:
+            onto = _synthetic(opts["synonyms"])
+            rng = random.Random(1)
+            needles = [n for n, _ in onto._needles]
+            # Mix real needles into the texts so both paths do matching work
+            mixed = [f"{t} {rng.choice(needles)} and {rng.choice(needles)}".lower() for t in texts]
+            iters = max(1, opts["iterations"] // 10)
+            self._bench(f"synthetic ({opts['synonyms']} synonyms)", onto, mixed, iters)
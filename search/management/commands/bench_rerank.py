@@ -0,0 +1,93 @@
+# search/management/commands/bench_rerank.py
+import random
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from search.ontology import get_ontology
+from search.rerank import (
+    W_LANG, W_PROX, W_SPEC, W_YOE, _language_score, _norm_yoe, _proximity_score,
+    candidate_columns, rerank, rerank_columns,
+)
+
+def _reference_scores(patient, doctors):
+    """The original per-candidate loop, kept here as the parity baseline."""
+    onto = get_ontology()
+    inferred = onto.infer_from_text(patient.get("symptoms", ""), patient.get("history", ""))
+    y_norm_map = _norm_yoe([d.years_of_experience or 0 for d in doctors])
+    out = []
+    for d in doctors:
+        spec = onto.score(inferred, d.specialties or [])
+        prox = _proximity_score(patient.get("city", ""), patient.get("pincode", ""), d.city, d.pincode)
+        y = y_norm_map.get(d.years_of_experience or 0, 0.0)
+        lang = _language_score(patient.get("languages", []), d.languages or [])
+        out.append({"doctor": d, "score": float(W_SPEC*spec + W_PROX*prox + W_YOE*y + W_LANG*lang)})
+    out.sort(key=lambda x: x["score"], reverse=True)
+    return out
+
+def _synthetic_doctors(n, labels, seed=0):
+    rng = random.Random(seed)
+    cities = ["Mumbai", "Bengaluru", "New Delhi", "Chennai", "Pune", "Kolkata", " mumbai ", ""]
+    langs = ["en", "hi", "bn", "te", "ta", "mr", "gu", "kn", "ml", "pa"]
+    return [
+        SimpleNamespace(
+            pk=i,
+            specialties=rng.sample(labels, rng.randint(0, 3)),
+            years_of_experience=rng.randint(0, 40),
+            city=rng.choice(cities),
+            pincode=rng.choice(["400001", "560001", "110001", "600001", ""]),
+            languages=rng.sample(langs, rng.randint(0, 3)),
+        )
+        for i in range(n)
+    ]
+
+class Command(BaseCommand):
+    help = "Check the columnar reranker against the per-candidate loop and time both."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="250,2500,25000")
+        parser.add_argument("--topk", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **opts):
+        labels = get_ontology().label_names + ["General Practice"]
+        patient = {
+            "symptoms": "chest pain, shortness of breath", "history": "diabetes, thyroid",
+            "city": "Mumbai", "pincode": "400001", "languages": ["en", "hi"],
+        }
+        for n in [int(x) for x in opts["sizes"].split(",") if x.strip()]:
+            doctors = _synthetic_doctors(n, labels)
+
+            ref = _reference_scores(patient, doctors)
+            new = rerank(patient, doctors, {})
+            top = rerank(patient, doctors, {}, topk=opts["topk"])
+            same = [r["doctor"].pk for r in ref] == [r["doctor"].pk for r in new] and \
+                np.array_equal([r["score"] for r in ref], [r["score"] for r in new]) and \
+                [r["doctor"].pk for r in ref[: opts["topk"]]] == [r["doctor"].pk for r in top]
+            if not same:
+                raise CommandError(f"columnar rerank diverged from the reference at n={n}")
+
+            t0 = time.perf_counter()
+            for _ in range(opts["repeat"]):
+                _reference_scores(patient, doctors)[: opts["topk"]]
+            t_ref = (time.perf_counter() - t0) / opts["repeat"] * 1000
+
+            t0 = time.perf_counter()
+            for _ in range(opts["repeat"]):
+                rerank(patient, doctors, {}, topk=opts["topk"])
+            t_new = (time.perf_counter() - t0) / opts["repeat"] * 1000
+
+            # Columns prepared ahead of time (as an attribute store would hold them)
+            cols = candidate_columns(doctors, get_ontology())
+            t0 = time.perf_counter()
+            for _ in range(opts["repeat"]):
+                rerank_columns(patient, cols, topk=opts["topk"])
+            t_cols = (time.perf_counter() - t0) / opts["repeat"] * 1000
+
+            self.stdout.write(
+                f"n={n:6d}  loop={t_ref:9.2f} ms  columnar={t_new:8.2f} ms "
+                f"({t_ref / max(t_new, 1e-9):5.1f}x)  prebuilt columns={t_cols:7.2f} ms "
+                f"({t_ref / max(t_cols, 1e-9):6.1f}x)  identical=yes"
+            )
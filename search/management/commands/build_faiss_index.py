@@ -1,4 +1,6 @@
 # search/management/commands/build_faiss_index.py
+import time
+
 from django.core.management.base import BaseCommand
 from search.faiss_store import rebuild_index, load_index
 from search.embedding import get_dim
@@ -6,9 +8,33 @@ from search.embedding import get_dim
 class Command(BaseCommand):
     help = "Rebuild the FAISS index from active doctors in Postgres."
 
+    def add_arguments(self, parser):
+        parser.add_argument("--resume", action="store_true",
+                            help="Continue from the last checkpoint of an interrupted rebuild.")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Encoder threads (default: FAISS_REBUILD_WORKERS).")
+        parser.add_argument("--batch-size", type=int, default=512,
+                            help="Doctors fetched and encoded per chunk.")
+        parser.add_argument("--progress-every", type=float, default=5.0,
+                            help="Seconds between progress lines.")
+
     def handle(self, *args, **options):
         dim = get_dim()
         self.stdout.write(self.style.NOTICE(f"Embedding dimension: {dim}"))
-        index = rebuild_index()
+
+        last = [0.0]
+
+        def progress(done, total, rate):
+            now = time.monotonic()
+            if now - last[0] >= options["progress_every"] or done >= total:
+                last[0] = now
+                self.stdout.write(f"  {done}/{total} docs  {rate:,.0f} docs/s")
+
+        index = rebuild_index(
+            batch_size=options["batch_size"],
+            workers=options["workers"],
+            resume=options["resume"],
+            progress=progress,
+        )
         n = index.ntotal
         self.stdout.write(self.style.SUCCESS(f"FAISS index rebuilt. Vectors: {n}"))
@@ -0,0 +1,47 @@
+# search/management/commands/drain_index_queue.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from search.faiss_store import _DoctorModel
+from search.indexer import _QUEUE, indexing_queue_stats
+
+class Command(BaseCommand):
+    help = (
+        "Re-queue recently updated doctors and drain the indexing queue in batches. "
+        "Use after a web worker died with pending index updates, or after bulk imports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--minutes", type=int, default=60,
+                            help="Re-queue doctors updated within the last N minutes (default 60).")
+        parser.add_argument("--all", action="store_true", help="Re-queue every doctor.")
+        parser.add_argument("--timeout", type=float, default=None)
+
+    def handle(self, *args, **opts):
+        Doctor = _DoctorModel()
+        qs = Doctor.objects.all()
+        if not opts["all"]:
+            qs = qs.filter(updated_at__gte=timezone.now() - timedelta(minutes=opts["minutes"]))
+
+        n = 0
+        for pk, text, active in qs.values_list("pk", "text_block", "is_active").iterator(chunk_size=512):
+            if active and text:
+                _QUEUE.upsert(pk, text)
+            else:
+                _QUEUE.remove(pk)
+            n += 1
+        self.stdout.write(self.style.NOTICE(f"Queued {n} doctors."))
+
+        done = _QUEUE.drain(timeout=opts["timeout"])
+        stats = indexing_queue_stats()
+        self.stdout.write(
+            f"batches={stats['batches']} upserts={stats['applied_upserts']} "
+            f"removes={stats['applied_removes']} dropped={stats['dropped']} depth={stats['depth']} "
+            f"max_lag_s={stats['max_lag_s']:.2f}"
+        )
+        if done:
+            self.stdout.write(self.style.SUCCESS("Indexing queue drained."))
+        else:
+            self.stdout.write(self.style.WARNING("Timed out with changes still pending."))
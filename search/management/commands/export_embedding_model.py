@@ -0,0 +1,93 @@
+# search/management/commands/export_embedding_model.py
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from search.embedding import _QUANT_CONFIG, load_backend, onnx_model_dir, require_onnx
+
+# Fixed parity corpus: query-style and profile-style texts like the ones we embed
+PARITY_CORPUS = [
+    "Symptoms: chest pain, shortness of breath\nHistory: diabetes",
+    "Symptoms: fever, cough for two weeks\nHistory: asthma",
+    "Symptoms: severe headache, blurred vision\nHistory: hypertension",
+    "Symptoms: abdominal pain after meals, bloating\nHistory: ",
+    "Symptoms: joint pain and morning stiffness in both hands\nHistory: hypothyroidism",
+    "Symptoms: palpitations, dizziness\nHistory: previous stent placement",
+    "Symptoms: frequent urination, excessive thirst\nHistory: family history of diabetes",
+    "Symptoms: swelling in feet, reduced urine output\nHistory: chronic kidney disease",
+    "Symptoms: skin rash with itching\nHistory: none",
+    "Symptoms: 32 weeks pregnant, elevated blood pressure\nHistory: gestational diabetes",
+    "Specialties: Cardiology, Internal Medicine.\nAbout: Cardiologist with focus on ischemic heart disease.\n"
+    "Treatments: ECG, Echocardiography\nHospital: Bombay Heart Institute.",
+    "Specialties: Gastroenterology.\nAbout: Expert in hepatology and inflammatory bowel disease.\n"
+    "Treatments: Endoscopy, Colonoscopy\nHospital: New Delhi Digestive Center.",
+    "Specialties: Pulmonology, Internal Medicine.\nAbout: COPD, asthma, and sleep apnea.\n"
+    "Treatments: Pulmonary function test, Sleep study\nHospital: Chennai Lung & Sleep Clinic.",
+    "Specialties: Nephrology.\nAbout: Dialysis and transplant follow-up.\n"
+    "Treatments: Hemodialysis\nHospital: Pune Kidney & Hypertension Clinic.",
+]
+
+def _encode(model, texts):
+    return model.encode(texts, normalize_embeddings=True, convert_to_numpy=True,
+                        show_progress_bar=False).astype("float32")
+
+class Command(BaseCommand):
+    help = (
+        "Export EMBED_MODEL to ONNX (fp32 and dynamically quantized int8) for the "
+        "onnx / onnx_int8 EMBED_BACKEND settings, then check cosine parity with torch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=getattr(settings, "EMBED_MODEL", "pritamdeka/S-BioBERT-MiniLM-L6-v2"))
+        parser.add_argument("--quant-config", default=_QUANT_CONFIG,
+                            help="avx2 | avx512 | avx512_vnni | arm64 (must match EMBED_ONNX_QUANT_CONFIG).")
+        parser.add_argument("--check-only", action="store_true", help="Skip export; only run the parity check.")
+        parser.add_argument("--min-cosine", type=float, default=0.99,
+                            help="Fail if any corpus text falls below this cosine vs. torch.")
+
+    def handle(self, *args, **opts):
+        name = opts["model"]
+        out_dir = onnx_model_dir(name)
+
+        if not opts["check_only"]:
+            try:
+                require_onnx()
+            except ImportError as e:
+                raise CommandError(str(e))
+            from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+            self.stdout.write(self.style.NOTICE(f"Exporting {name} -> {out_dir}"))
+            try:
+                onnx_model = SentenceTransformer(name, device="cpu", backend="onnx")
+            except Exception as e:
+                raise CommandError(f"ONNX export failed: {e}")
+            onnx_model.save(str(out_dir))
+            export_dynamic_quantized_onnx_model(onnx_model, opts["quant_config"], str(out_dir))
+
+        # Parity + latency on the fixed corpus
+        torch_model = load_backend(name, "torch")
+        ref = _encode(torch_model, PARITY_CORPUS)
+        failed = False
+        for backend in ("torch", "onnx", "onnx_int8"):
+            model = torch_model if backend == "torch" else load_backend(name, backend)
+            vecs = _encode(model, PARITY_CORPUS)
+            cos = np.sum(ref * vecs, axis=1)
+
+            t0 = time.perf_counter()
+            for text in PARITY_CORPUS:
+                _encode(model, [text])
+            ms = (time.perf_counter() - t0) * 1000.0 / len(PARITY_CORPUS)
+
+            ok = float(cos.min()) >= opts["min_cosine"]
+            failed |= not ok
+            style = self.style.SUCCESS if ok else self.style.ERROR
+            self.stdout.write(style(
+                f"{backend:10s} cosine vs torch: mean={cos.mean():.5f} min={cos.min():.5f}  "
+                f"single-query latency={ms:.2f} ms"
+            ))
+
+        if failed:
+            raise CommandError(f"Parity check failed (min cosine < {opts['min_cosine']}).")
+        self.stdout.write(self.style.SUCCESS("Parity check passed."))
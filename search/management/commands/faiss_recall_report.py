@@ -0,0 +1,82 @@
+# search/management/commands/faiss_recall_report.py
+import json
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from search.embedding import encode
+from search.faiss_store import _INDEX_DIR, _iter_active_doctors, _new_index, _search_params, index_layout, index_spec
+
+class Command(BaseCommand):
+    help = (
+        "Measure recall@k vs. per-query latency for each FAISS index type over a sweep "
+        "of nprobe / efSearch values, against exact search as ground truth."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--synthetic", type=int, default=0,
+                            help="Use N random unit vectors instead of embedding active doctors.")
+        parser.add_argument("--dim", type=int, default=384, help="Dimension for --synthetic vectors.")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("-k", type=int, default=10)
+        parser.add_argument("--types", default="ivf_flat,ivf_pq,hnsw")
+        parser.add_argument("--nprobe", default="1,4,16,64")
+        parser.add_argument("--ef-search", default="16,64,256")
+        parser.add_argument("--out", default=str(_INDEX_DIR / "recall_report.json"))
+
+    def _vectors(self, opts) -> np.ndarray:
+        if opts["synthetic"]:
+            rng = np.random.default_rng(0)
+            X = rng.standard_normal((opts["synthetic"], opts["dim"])).astype("float32")
+            faiss.normalize_L2(X)
+            return X
+        texts = [text for _, text in _iter_active_doctors()]
+        return encode(texts) if texts else np.zeros((0, 1), dtype="float32")
+
+    def handle(self, *args, **opts):
+        X = self._vectors(opts)
+        n, dim = X.shape
+        if n == 0:
+            self.stdout.write(self.style.WARNING("No vectors to evaluate."))
+            return
+        k = min(opts["k"], n)
+        ids = np.arange(n, dtype="int64")
+
+        # Queries: perturbed copies of stored vectors, like near-duplicate symptom phrasings
+        rng = np.random.default_rng(1)
+        Q = X[rng.choice(n, size=min(opts["queries"], n), replace=False)]
+        Q = Q + 0.05 * rng.standard_normal(Q.shape).astype("float32")
+        faiss.normalize_L2(Q)
+
+        exact = _new_index(dim, spec="flat")
+        exact.add_with_ids(X, ids)
+        _, truth = exact.search(Q, k)
+
+        rows = []
+        for kind in [t.strip() for t in opts["types"].split(",") if t.strip()]:
+            spec = index_spec({**index_spec(), "type": kind})
+            t0 = time.perf_counter()
+            index = _new_index(dim, spec=spec, n_train=n)
+            if not index.is_trained:
+                index.train(X)
+            index.add_with_ids(X, ids)
+            build_s = time.perf_counter() - t0
+            layout = index_layout(index)  # may differ from `kind` when there's too little training data
+
+            knob, values = ("ef_search", opts["ef_search"]) if kind == "hnsw" else ("nprobe", opts["nprobe"])
+            for v in [int(x) for x in values.split(",") if x.strip()]:
+                params = _search_params(index, **{knob: v})
+                t0 = time.perf_counter()
+                _, got = index.search(Q, k, params=params)
+                ms = (time.perf_counter() - t0) * 1000.0 / len(Q)
+                recall = float(np.mean([len(set(g) & set(t)) / k for g, t in zip(got, truth)]))
+                rows.append({"type": kind, "layout": layout, knob: v, "recall_at_k": round(recall, 4),
+                             "ms_per_query": round(ms, 4), "build_s": round(build_s, 3)})
+                self.stdout.write(f"{kind:9s} {layout:18s} {knob}={v:<5d} recall@{k}={recall:.3f}  {ms:.3f} ms/query")
+
+        report = {"n": n, "dim": dim, "k": k, "queries": len(Q), "rows": rows}
+        Path(opts["out"]).write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Report written to {opts['out']}"))
@@ -0,0 +1,211 @@
+# search/metrics.py
+from __future__ import annotations
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+import logging
+import math
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds (ms), roughly x1.5 apart so interpolated
+# quantiles stay within a few percent; the last bucket is +Inf.
+BUCKETS_MS = (
+    0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1, 1.5, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 75,
+    100, 150, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000,
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram (cumulative since process start, like a
+    Prometheus histogram). Quantiles are interpolated within the bucket that
+    contains them, as histogram_quantile() does.
+    """
+    def __init__(self, buckets_ms=BUCKETS_MS):
+        self.bounds = tuple(float(b) for b in buckets_ms)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        i = bisect_left(self.bounds, ms)
+        with self._lock:
+            self._counts[i] += 1
+            self.count += 1
+            self.sum_ms += ms
+            if ms > self.max_ms:
+                self.max_ms = ms
+
+    def counts(self) -> List[int]:
+        with self._lock:
+            return list(self._counts)
+
+    def quantile(self, q: float, counts: Optional[List[int]] = None) -> float:
+        counts = self.counts() if counts is None else counts
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            if c and seen + c >= rank:
+                lo = self.bounds[i - 1] if i > 0 else 0.0
+                if i == len(self.bounds):
+                    return max(lo, self.max_ms)  # +Inf bucket: the largest observation is the best bound
+                return min(lo + (self.bounds[i] - lo) * (rank - seen) / c, self.max_ms)
+            seen += c
+        return self.max_ms
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            counts, n, total, mx = list(self._counts), self.count, self.sum_ms, self.max_ms
+        out = {"count": n, "mean_ms": total / n if n else 0.0, "max_ms": mx}
+        for q in QUANTILES:
+            out[f"p{int(q * 100)}_ms"] = self.quantile(q, counts)
+        return out
+
+
+_STAGES: Dict[str, LatencyHistogram] = {}
+_STAGES_LOCK = threading.Lock()
+
+# Per-request {stage: ms} collector installed by request_timings(); stages
+# timed while it is set (including in sync_to_async threads, which copy the
+# context) are summed into it as well as recorded in the process histograms.
+_REQUEST: ContextVar[Optional[Dict[str, float]]] = ContextVar("search_request_timings", default=None)
+
+
+def _histogram(stage: str) -> LatencyHistogram:
+    hist = _STAGES.get(stage)
+    if hist is None:
+        with _STAGES_LOCK:
+            hist = _STAGES.setdefault(stage, LatencyHistogram())
+    return hist
+
+
+def observe(stage: str, ms: float) -> None:
+    """Record one duration for `stage`."""
+    _histogram(stage).observe(ms)
+    timings = _REQUEST.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + ms
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Time a block (or, as a decorator, every call) as `stage`. Exceptions are
+    timed too, so slow failures show up in the histograms.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, (time.perf_counter() - started) * 1000.0)
+
+
+@contextmanager
+def request_timings() -> Iterator[Dict[str, float]]:
+    """Collect the stages timed inside the block into a {stage: ms} dict."""
+    timings: Dict[str, float] = {}
+    token = _REQUEST.set(timings)
+    try:
+        yield timings
+    finally:
+        _REQUEST.reset(token)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Format a {stage: ms} dict as a Server-Timing header value."""
+    return ", ".join(f"{stage};dur={ms:.2f}" for stage, ms in timings.items())
+
+
+# -----------------------------
+# Prometheus text exposition
+# -----------------------------
+_PREFIX = "medvault"
+
+
+def _subsystem_stats() -> Dict[str, Dict[str, Any]]:
+    # Imported here: those modules import this one for timing
+    from .batcher import embedding_batcher_stats
+    from .embedding import embedding_cache_stats
+    from .embedding_store import embedding_store_stats
+    from .faiss_store import index_stats
+    from .indexer import indexing_queue_stats
+    from .query_log import query_log_stats
+    from .response_cache import response_cache_stats
+    from .singleflight import search_singleflight_stats
+
+    sources = {
+        "index": index_stats,
+        "embedding_cache": embedding_cache_stats,
+        "embedding_store": embedding_store_stats,
+        "embedding_batcher": embedding_batcher_stats,
+        "indexing_queue": indexing_queue_stats,
+        "query_log": query_log_stats,
+        "response_cache": response_cache_stats,
+        "singleflight": search_singleflight_stats,
+    }
+    out: Dict[str, Dict[str, Any]] = {}
+    for name, fn in sources.items():
+        try:
+            out[name] = fn()
+        except Exception:
+            log.exception("metrics: %s stats unavailable", name)
+    return out
+
+
+def _fmt(v: float) -> str:
+    if isinstance(v, int):
+        return str(v)
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v))
+
+
+def render_prometheus() -> str:
+    """
+    This process's metrics in the Prometheus text format (version 0.0.4):
+    one latency histogram per stage (seconds), its p50/p95/p99 as gauges,
+    and the numeric counters of each search subsystem's stats().
+    """
+    lines: List[str] = []
+    stage_hist = f"{_PREFIX}_search_stage_seconds"
+    stage_q = f"{_PREFIX}_search_stage_quantile_seconds"
+    stages = sorted(_STAGES.items())
+
+    lines.append(f"# HELP {stage_hist} Search latency per stage.")
+    lines.append(f"# TYPE {stage_hist} histogram")
+    for stage, hist in stages:
+        counts = hist.counts()
+        cum = 0
+        for bound, c in zip(hist.bounds + (math.inf,), counts):
+            cum += c
+            lines.append(f'{stage_hist}_bucket{{stage="{stage}",le="{_fmt(bound / 1000.0)}"}} {cum}')
+        lines.append(f'{stage_hist}_sum{{stage="{stage}"}} {_fmt(hist.sum_ms / 1000.0)}')
+        lines.append(f'{stage_hist}_count{{stage="{stage}"}} {hist.count}')
+
+    lines.append(f"# HELP {stage_q} Search latency quantiles per stage, estimated from {stage_hist}.")
+    lines.append(f"# TYPE {stage_q} gauge")
+    for stage, hist in stages:
+        counts = hist.counts()
+        for q in QUANTILES:
+            lines.append(f'{stage_q}{{stage="{stage}",quantile="{q}"}} {_fmt(hist.quantile(q, counts) / 1000.0)}')
+
+    for subsystem, stats in _subsystem_stats().items():
+        for key, value in stats.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            name = f"{_PREFIX}_{subsystem}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
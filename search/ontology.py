@@ -1,19 +1,101 @@
 from __future__ import annotations
+import hashlib
 import re
+import threading
+import time
 from pathlib import Path
-from typing import Dict, List, Set, Tuple
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
 import yaml
 from django.conf import settings
 
 _WORD = re.compile(r"[A-Za-z][A-Za-z\- ]{1,}")
 
+def _trie_pattern(words: List[str]) -> str:
+    """
+    Regex for a set of literal words, factored as a character trie so the
+    engine walks shared prefixes once instead of trying every alternative.
+    Optional tails are greedy, so the longest word at a position wins.
+    """
+    trie: Dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node: Dict) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+# Word and separator runs; needles are compared token by token
+_TOKEN = re.compile(r"\w+|\W+")
+
+def _is_word(token: str) -> bool:
+    return bool(re.match(r"\w", token))
+
+class _TokenMatcher:
+    """
+    Whole-token multi-pattern matcher: one left-to-right regex pass reports
+    every needle that starts at a token boundary and ends at one. The
+    lookahead form lets matches overlap (e.g. "heart" and "heart failure"
+    starting at the same word are both reported via needle closure below).
+    """
+    def __init__(self, table: Dict[str, Tuple[str, ...]]):
+        needles = [n for n in table if n]
+        if not needles:
+            self._rx = None
+            self._targets: Dict[str, Tuple[str, ...]] = {}
+            return
+        self._rx = re.compile(r"(?<!\w)(?=(" + _trie_pattern(needles) + r")(?!\w))")
+
+        # Closure: a multi-word needle also implies every needle found inside it
+        # as a whole token run, so the longest match at a position loses nothing
+        # to shorter ones (self._rx reports only the longest). A whole-token
+        # match is a run of n's tokens from a word token to a word token, so
+        # each such run is looked up among the needles: linear in total tokens
+        # for needles of a few words.
+        by_tokens = {tuple(_TOKEN.findall(n)): n for n in needles}
+        self._targets = {}
+        for n in needles:
+            implied = set(table[n])
+            tokens = _TOKEN.findall(n)
+            words = [i for i, t in enumerate(tokens) if _is_word(t)]
+            for a, i in enumerate(words):
+                for j in words[a:]:
+                    m = by_tokens.get(tuple(tokens[i:j + 1]))
+                    if m is not None and m != n:
+                        implied.update(table[m])
+            self._targets[n] = tuple(sorted(implied))
+
+    def find(self, text: str) -> Set[str]:
+        found: Set[str] = set()
+        if self._rx is None:
+            return found
+        for m in self._rx.finditer(text):
+            found.update(self._targets[m.group(1)])
+        return found
+
+# Relation code -> score (see SpecialtyOntology._build_score_codes)
+_SCORE_VALUES = np.array([0.0, 0.5, 0.7, 1.0], dtype=np.float64)
+
 class SpecialtyOntology:
     """
     Loads a lightweight taxonomy and provides:
       - infer_patient_specialties(symptoms+history)
       - score(patient_labels, doctor_labels) with hierarchy-aware logic
     """
-    def __init__(self, data: Dict):
+    def __init__(self, data: Dict, version: str = ""):
+        # Content hash of the source YAML; lets callers key derived caches by ontology version
+        self.version = version
+
         # Normalize parents -> children
         self.parent_to_children: Dict[str, Set[str]] = {}
         self.child_to_parent: Dict[str, str] = {}
@@ -37,28 +119,66 @@ class SpecialtyOntology:
         # Lowercase map for quick text matching
         self._label_lc = {l.lower(): l for l in self.labels}
 
+        # Precompiled match table: lowercase needle -> labels it implies (labels and synonyms merged)
+        self._needles: Tuple[Tuple[str, Tuple[str, ...]], ...] = tuple(self._build_needles().items())
+        # Built once per ontology version (the registry constructs a new instance on change)
+        self._matcher = _TokenMatcher(dict(self._needles))
+
+        # Interned label IDs (hierarchy labels + synonym targets) and the label x label score table
+        self.label_names: List[str] = sorted(self.labels.union(*self.synonyms.values()))
+        self.label_ids: Dict[str, int] = {l: i for i, l in enumerate(self.label_names)}
+        self._score_codes = self._build_score_codes()
+
+    def _build_score_codes(self) -> np.ndarray:
+        """
+        Dense uint8 table of relation codes (index into _SCORE_VALUES):
+        3 exact, 2 parent<->child, 1 siblings, 0 unrelated. One byte per pair
+        keeps a few thousand labels in a few MB.
+        """
+        n = len(self.label_names)
+        parent = np.full(n, -1, dtype=np.int64)
+        for c, p in self.child_to_parent.items():
+            parent[self.label_ids[c]] = self.label_ids[p]
+        idx = np.arange(n)
+
+        codes = np.zeros((n, n), dtype=np.uint8)
+        has_parent = parent >= 0
+        codes[(parent[:, None] == parent[None, :]) & has_parent[:, None]] = 1
+        codes[(parent[:, None] == idx[None, :]) | (idx[:, None] == parent[None, :])] = 2
+        codes[idx, idx] = 3
+        return codes
+
+    def intern(self, labels: List[str]) -> np.ndarray:
+        """Label strings -> int32 IDs; labels outside the ontology are dropped."""
+        ids = self.label_ids
+        return np.fromiter((ids[l] for l in labels if l in ids), dtype=np.int32)
+
+    def _build_needles(self) -> Dict[str, Tuple[str, ...]]:
+        table: Dict[str, Set[str]] = {}
+        for lc, canon in self._label_lc.items():
+            if lc:
+                table.setdefault(lc, set()).add(canon)
+        for token, targets in self.synonyms.items():
+            if token:
+                table.setdefault(token, set()).update(targets)
+        return {k: tuple(sorted(v)) for k, v in table.items()}
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "SpecialtyOntology":
+        data = yaml.safe_load(raw.decode("utf-8")) or {}
+        return cls(data, version=hashlib.sha1(raw).hexdigest())
+
     @classmethod
     def from_yaml(cls, path: Path) -> "SpecialtyOntology":
-        with open(path, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f) or {}
-        return cls(data)
+        return cls.from_bytes(Path(path).read_bytes())
 
     def infer_from_text(self, symptoms: str, history: str) -> List[str]:
         """
-        Simple lexical inference: match labels & synonyms as whole-word-ish substrings.
+        Lexical inference: match labels & synonyms as whole tokens in a single
+        pass over the text (so "ent" no longer fires inside "treatment").
         """
         text = f"{symptoms or ''} {history or ''}".lower()
-        found: Set[str] = set()
-
-        # Label match
-        for lc, canon in self._label_lc.items():
-            if lc and lc in text:
-                found.add(canon)
-
-        # Synonym match
-        for token, targets in self.synonyms.items():
-            if token in text:
-                found.update(targets)
+        found = self._matcher.find(text)
 
         # Normalize: if child found and parent also present, keep both (doesn't hurt)
         return sorted(found)
@@ -70,39 +190,97 @@ class SpecialtyOntology:
           - parent<->child -> 0.7
           - siblings under the same parent -> 0.5
           - else -> 0.0
+        Max over a gather from the precomputed label x label table.
         """
         if not patient_labels or not doctor_labels:
             return 0.0
 
-        pset = set(patient_labels)
-        dset = set(doctor_labels)
+        pi = self.intern(patient_labels)
+        di = self.intern(doctor_labels)
+        best = float(_SCORE_VALUES[self._score_codes[np.ix_(pi, di)].max()]) if pi.size and di.size else 0.0
 
-        # Exact
-        if pset & dset:
-            return 1.0
+        # Labels unknown to the ontology can still match exactly
+        if best < 1.0 and (pi.size < len(patient_labels) or di.size < len(doctor_labels)):
+            if set(patient_labels) & set(doctor_labels):
+                return 1.0
+        return best
 
-        # Parent-child in either direction
-        for a in pset:
-            for b in dset:
-                if self.child_to_parent.get(a) == b or self.child_to_parent.get(b) == a:
-                    return 0.7
-
-        # Siblings
-        for a in pset:
-            pa = self.child_to_parent.get(a)
-            if not pa:
-                continue
-            for b in dset:
-                if self.child_to_parent.get(b) == pa:
-                    return 0.5
+    def score_csr(self, patient_ids: np.ndarray, flat: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        """
+        Scores for candidates given as interned CSR label rows (see label_csr).
+        Builds the patient's best-code row over all labels once, then takes a
+        segmented max over the candidates' flattened label IDs.
+        """
+        out = np.zeros(len(offsets) - 1, dtype=np.float64)
+        if patient_ids.size and flat.size:
+            row = self._score_codes[patient_ids].max(axis=0)  # (L,) best code per label for this patient
+            nonempty = np.diff(offsets) > 0
+            best = np.maximum.reduceat(row[flat], offsets[:-1][nonempty])
+            out[nonempty] = _SCORE_VALUES[best]
+        return out
 
-        return 0.0
+    def label_csr(self, doctor_labels: List[List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Intern a list of label lists into (flat_ids, offsets) CSR form:
+        row i's IDs are flat_ids[offsets[i]:offsets[i+1]].
+        """
+        rows = [self.intern(labels or []) for labels in doctor_labels]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([r.size for r in rows], out=offsets[1:])
+        flat = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+        return flat.astype(np.int32, copy=False), offsets
 
 
-# Singleton loader
-def get_ontology() -> SpecialtyOntology:
+# Process-wide registry
+def _ontology_path() -> Path:
     # Allow override; default config path
     ypath = getattr(settings, "SPECIALTY_ONTOLOGY_PATH", None)
     if ypath is None:
         ypath = Path(settings.BASE_DIR) / "config" / "specialty_ontology.yml"
-    return SpecialtyOntology.from_yaml(Path(ypath))
+    return Path(ypath)
+
+class _OntologyRegistry:
+    """
+    Parses the ontology once per process. The file is re-stat'ed at most every
+    `check_interval` seconds and only re-parsed when its mtime/size changed
+    *and* the content hash differs, so touching the file is cheap. One thread
+    re-checks (and rebuilds) at a time while the others keep the current
+    version; the new one is swapped in by reference once built.
+    """
+    def __init__(self, check_interval: float):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._onto: Optional[SpecialtyOntology] = None
+        self._path: Optional[Path] = None
+        self._stat: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+
+    def get(self) -> SpecialtyOntology:
+        onto = self._onto
+        if onto is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return onto
+        if onto is None:
+            with self._lock:
+                self._refresh()
+        elif self._lock.acquire(blocking=False):
+            try:
+                self._refresh()
+            finally:
+                self._lock.release()
+        return self._onto
+
+    def _refresh(self) -> None:
+        path = _ontology_path()
+        st = path.stat()
+        key = (st.st_mtime_ns, st.st_size)
+        if self._onto is None or path != self._path or key != self._stat:
+            raw = path.read_bytes()
+            if self._onto is None or hashlib.sha1(raw).hexdigest() != self._onto.version:
+                self._onto = SpecialtyOntology.from_bytes(raw)
+            self._path, self._stat = path, key
+        self._checked_at = time.monotonic()
+
+_REGISTRY = _OntologyRegistry(float(getattr(settings, "ONTOLOGY_RELOAD_CHECK_S", 2.0)))
+
+def get_ontology() -> SpecialtyOntology:
+    return _REGISTRY.get()
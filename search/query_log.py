@@ -0,0 +1,189 @@
+# search/query_log.py
+from __future__ import annotations
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+import atexit
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+log = logging.getLogger(__name__)
+
+_ENABLED = bool(getattr(settings, "SEARCH_QUERY_LOG_ENABLED", True))
+# Fraction of searches recorded (1.0 = all)
+_SAMPLE_RATE = float(getattr(settings, "SEARCH_QUERY_LOG_SAMPLE_RATE", 1.0))
+# Ring buffer size; when the writer falls behind, the oldest entries are dropped
+_CAPACITY = int(getattr(settings, "SEARCH_QUERY_LOG_CAPACITY", 10_000))
+# Flush once this many entries are buffered, or every _FLUSH_S seconds
+_BATCH_SIZE = int(getattr(settings, "SEARCH_QUERY_LOG_BATCH_SIZE", 500))
+_FLUSH_S = float(getattr(settings, "SEARCH_QUERY_LOG_FLUSH_S", 2.0))
+
+
+class QueryLogWriter:
+    """
+    Buffered writer for PatientQueryLog. record() only appends to a bounded
+    in-memory ring and never touches the DB; a daemon thread bulk_creates
+    the buffer by size or time. A full ring drops its oldest entry rather
+    than blocking the request, and every drop is counted.
+    """
+    def __init__(self, capacity: int = _CAPACITY, batch_size: int = _BATCH_SIZE,
+                 flush_s: float = _FLUSH_S, sample_rate: float = _SAMPLE_RATE):
+        self.capacity = max(1, int(capacity))
+        self.batch_size = max(1, int(batch_size))
+        self.flush_s = max(0.01, float(flush_s))
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self._buf: Deque[Dict[str, Any]] = deque()
+        self._cond = threading.Condition()
+        self._flushing = False
+        self._worker: Optional[threading.Thread] = None
+
+        self.recorded = 0
+        self.sampled_out = 0
+        self.dropped_overflow = 0
+        self.dropped_errors = 0
+        self.written = 0
+        self.flushes = 0
+        self.write_errors = 0
+        self.last_flush_s = 0.0
+
+    # -- producers (request path) --
+    def record(self, entry: Dict[str, Any]) -> bool:
+        """Buffer one log row (PatientQueryLog field values); False if sampled out."""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            with self._cond:
+                self.sampled_out += 1
+            return False
+        entry.setdefault("created_at", timezone.now())
+        with self._cond:
+            if len(self._buf) >= self.capacity:
+                self._buf.popleft()
+                self.dropped_overflow += 1
+            self._buf.append(entry)
+            self.recorded += 1
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="search-query-log", daemon=True)
+                self._worker.start()
+            if len(self._buf) >= self.batch_size:
+                self._cond.notify_all()  # backpressure: don't wait out the timer
+        return True
+
+    # -- consumer --
+    def _take(self) -> List[Dict[str, Any]]:
+        n = min(len(self._buf), self.batch_size)
+        return [self._buf.popleft() for _ in range(n)]
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_s
+                while len(self._buf) < self.batch_size or self._flushing:
+                    left = deadline - time.monotonic()
+                    if left <= 0 and not self._flushing:
+                        break
+                    self._cond.wait(left if left > 0 else None)
+                if not self._buf:
+                    continue
+                batch = self._take()
+                self._flushing = True
+            try:
+                self._write(batch)
+            finally:
+                with self._cond:
+                    self._flushing = False
+                    self._cond.notify_all()
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        from .models import PatientQueryLog
+
+        started = time.monotonic()
+        try:
+            close_old_connections()
+            PatientQueryLog.objects.bulk_create([PatientQueryLog(**e) for e in batch],
+                                                batch_size=self.batch_size)
+        except Exception:
+            log.exception("query log: failed to write %d entries; dropping them", len(batch))
+            with self._cond:
+                self.write_errors += 1
+                self.dropped_errors += len(batch)
+            return
+        with self._cond:
+            self.written += len(batch)
+            self.flushes += 1
+            self.last_flush_s = time.monotonic() - started
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Write everything buffered on the calling thread; True once the buffer
+        is empty and no flush is in flight.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while self._flushing:
+                    left = None if deadline is None else deadline - time.monotonic()
+                    if left is not None and left <= 0:
+                        return False
+                    self._cond.wait(left)
+                if not self._buf:
+                    return True
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                batch = self._take()
+                self._flushing = True
+            try:
+                self._write(batch)
+            finally:
+                with self._cond:
+                    self._flushing = False
+                    self._cond.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "buffered": len(self._buf),
+                "capacity": self.capacity,
+                "sample_rate": self.sample_rate,
+                "recorded": self.recorded,
+                "sampled_out": self.sampled_out,
+                "dropped_overflow": self.dropped_overflow,
+                "dropped_errors": self.dropped_errors,
+                "written": self.written,
+                "flushes": self.flushes,
+                "write_errors": self.write_errors,
+                "last_flush_s": self.last_flush_s,
+            }
+
+
+_WRITER = QueryLogWriter()
+
+
+def log_search(patient: Dict[str, Any], query_text: str, topk: int,
+               results: List[Dict[str, Any]]) -> None:
+    """Record one served search (no-op when SEARCH_QUERY_LOG_ENABLED is off)."""
+    if not _ENABLED:
+        return
+    _WRITER.record({
+        "city": (patient.get("city") or "")[:120],
+        "pincode": (patient.get("pincode") or "")[:10],
+        "languages": list(patient.get("languages") or []),
+        "raw_text": query_text,
+        "topk": topk,
+        "results": [{"doctor_id": r["doctor_id"], "score": r["score"]} for r in results],
+    })
+
+
+def flush(timeout: Optional[float] = None) -> bool:
+    return _WRITER.flush(timeout)
+
+
+# Write out buffered searches when the process exits
+atexit.register(flush, 10.0)
+
+
+def query_log_stats() -> Dict[str, float]:
+    return _WRITER.stats()
@@ -1,7 +1,16 @@
 # search/rerank.py
 from __future__ import annotations
-from typing import Dict, List, Any
-from .ontology import get_ontology
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .geo import haversine_km
+from .metrics import timed
+from .ontology import SpecialtyOntology, get_ontology
 
 # Weights (fixed by your policy)
 W_SPEC = 0.55
@@ -9,6 +18,16 @@ W_PROX = 0.25
 W_YOE  = 0.15
 W_LANG = 0.05
 
+# Distance-based proximity falls linearly from 1.0 at 0 km to 0.0 at this radius
+_GEO_RADIUS_KM = float(getattr(settings, "SEARCH_GEO_RADIUS_KM", 50.0))
+
+# Supported language codes: a dotted path to the set Doctor.languages is
+# validated against, or the codes themselves
+_LANGUAGE_CODES = getattr(settings, "SEARCH_LANGUAGE_CODES", "myapp.models.LANGUAGE_CODES")
+
+# -----------------------------
+# Scalar reference scoring (one candidate at a time)
+# -----------------------------
 def _norm_yoe(values: List[int]) -> Dict[int, float]:
     if not values:
         return {}
@@ -19,7 +38,7 @@ def _norm_yoe(values: List[int]) -> Dict[int, float]:
     return {v: (v - mn) / (mx - mn) for v in values}
 
 def _proximity_score(p_city: str, p_pin: str, d_city: str, d_pin: str) -> float:
-    # Simple baseline (no lat/lon yet):
+    # String-only baseline (score_columns adds haversine distance when coordinates exist):
     if p_pin and d_pin and p_pin == d_pin:
         return 1.0
     if p_city and d_city and p_city.strip().lower() == d_city.strip().lower():
@@ -27,40 +46,163 @@ def _proximity_score(p_city: str, p_pin: str, d_city: str, d_pin: str) -> float:
     return 0.0
 
 def _language_score(p_langs: List[str], d_langs: List[str]) -> float:
+    # Only supported codes count, as in language_mask
+    known = _language_bits().keys()
     try:
-        return 1.0 if set(p_langs or []) & set(d_langs or []) else 0.0
+        return 1.0 if set(p_langs or []) & set(d_langs or []) & known else 0.0
     except Exception:
         return 0.0
 
-def rerank(patient: Dict[str, Any], doctors: List[Any], id_to_sim: Dict[int, float]) -> List[Dict[str, Any]]:
+# -----------------------------
+# Columnar scoring
+# -----------------------------
+# Supported language code -> bit, fixed once from SEARCH_LANGUAGE_CODES. Other
+# codes get no bit: patient input is unvalidated and must not grow the table.
+_LANG_BITS: Optional[Dict[str, int]] = None
+_LANG_LOCK = threading.Lock()
+
+# Stands in for a falsy doctor city: strip() output can never equal it, so it
+# never matches, mirroring the `d_city and ...` guard in _proximity_score.
+_NO_CITY = " "
+
+def _language_bits() -> Dict[str, int]:
+    global _LANG_BITS
+    if _LANG_BITS is None:
+        codes = _LANGUAGE_CODES
+        if isinstance(codes, str):
+            try:
+                codes = import_string(codes)
+            except ImportError as e:
+                raise ImproperlyConfigured(f"SEARCH_LANGUAGE_CODES: {e}") from e
+        codes = sorted(codes)
+        if not codes:
+            raise ImproperlyConfigured("SEARCH_LANGUAGE_CODES is empty; language filters would match nothing")
+        if len(codes) > 63:
+            raise ImproperlyConfigured(f"SEARCH_LANGUAGE_CODES has {len(codes)} codes; at most 63 fit a language mask")
+        with _LANG_LOCK:
+            if _LANG_BITS is None:
+                _LANG_BITS = {c: 1 << i for i, c in enumerate(codes)}
+    return _LANG_BITS
+
+def language_mask(langs: Any) -> int:
+    """
+    Bitmask of supported language codes; unknown codes are dropped, and
+    unusable input gives 0 (as _language_score would score it).
+    """
+    bits = _language_bits()
+    try:
+        return sum({bits[c] for c in set(langs or []) if c in bits})
+    except Exception:
+        return 0
+
+def candidate_columns(doctors: List[Any], onto: SpecialtyOntology) -> Dict[str, Any]:
+    """
+    Pull the attributes rerank needs out of Doctor-like objects into arrays.
+    """
+    flat, offsets = onto.label_csr([getattr(d, "specialties", []) or [] for d in doctors])
+    return {
+        "spec_flat": flat,
+        "spec_offsets": offsets,
+        "yoe": np.array([getattr(d, "years_of_experience", 0) or 0 for d in doctors], dtype=np.int64),
+        "pincode": np.array([getattr(d, "pincode", "") or "" for d in doctors], dtype=str),
+        "city_key": np.array(
+            [(c.strip().lower() if c else _NO_CITY) for c in (getattr(d, "city", "") for d in doctors)],
+            dtype=str,
+        ),
+        "lang_mask": np.array([language_mask(getattr(d, "languages", [])) for d in doctors], dtype=np.int64),
+        "lat": np.array([_coord(getattr(d, "latitude", None)) for d in doctors], dtype=np.float64),
+        "lon": np.array([_coord(getattr(d, "longitude", None)) for d in doctors], dtype=np.float64),
+    }
+
+def _coord(v: Any) -> float:
+    return np.nan if v is None else float(v)
+
+def geo_proximity(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """1.0 at the patient's location, falling to 0.0 at _GEO_RADIUS_KM; 0.0 without coordinates."""
+    d = haversine_km(lat, lon, lats, lons)
+    return np.nan_to_num(np.clip(1.0 - d / _GEO_RADIUS_KM, 0.0, 1.0), nan=0.0)
+
+def score_columns(patient: Dict[str, Any], cols: Dict[str, Any], onto: SpecialtyOntology) -> np.ndarray:
+    """
+    Blend W_SPEC/W_PROX/W_YOE/W_LANG as array expressions. Without patient
+    coordinates, term order and arithmetic match the scalar path, so scores
+    are bit-identical; with them, proximity also credits haversine distance.
+    """
+    n = len(cols["yoe"])
+    inferred = onto.infer_from_text(patient.get("symptoms", ""), patient.get("history", ""))
+    spec = onto.score_csr(onto.intern(inferred), cols["spec_flat"], cols["spec_offsets"])
+
+    p_pin = patient.get("pincode", "") or ""
+    p_city = patient.get("city", "") or ""
+    prox = np.zeros(n, dtype=np.float64)
+    if p_city:
+        prox[cols["city_key"] == p_city.strip().lower()] = 0.6
+    if p_pin:
+        prox[cols["pincode"] == p_pin] = 1.0
+    p_lat, p_lon = patient.get("lat"), patient.get("lon")
+    if p_lat is not None and p_lon is not None and "lat" in cols:
+        # Real distance when both sides have coordinates; string matches still count otherwise
+        prox = np.maximum(prox, geo_proximity(float(p_lat), float(p_lon), cols["lat"], cols["lon"]))
+
+    yoe = cols["yoe"]
+    y = np.zeros(n, dtype=np.float64)
+    if n:
+        mn, mx = int(yoe.min()), int(yoe.max())
+        if mx > mn:
+            y = (yoe - mn) / (mx - mn)
+
+    p_mask = language_mask(patient.get("languages", []))
+    lang = ((cols["lang_mask"] & p_mask) != 0).astype(np.float64)
+
+    return W_SPEC*spec + W_PROX*prox + W_YOE*y + W_LANG*lang
+
+def top_order(scores: np.ndarray, topk: Optional[int] = None) -> np.ndarray:
+    """
+    Indices of the best `topk` scores, descending. Ties keep input order, like
+    a stable list.sort(reverse=True); argpartition avoids sorting the tail.
+    """
+    n = scores.shape[0]
+    if topk is None or topk >= n:
+        return np.argsort(-scores, kind="stable")
+    if topk <= 0:
+        return np.zeros(0, dtype=np.int64)
+    part = np.argpartition(-scores, topk - 1)[:topk]
+    thresh = scores[part].min()
+    above = np.flatnonzero(scores > thresh)
+    ties = np.flatnonzero(scores == thresh)[: topk - above.size]
+    sel = np.sort(np.concatenate([above, ties]))
+    return sel[np.argsort(-scores[sel], kind="stable")]
+
+@timed("rerank")
+def rerank_columns(patient: Dict[str, Any], cols: Dict[str, Any],
+                   topk: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Columnar rerank: returns (order, scores) where order indexes the candidate rows.
+    Timed as stage "rerank".
+    """
+    onto = get_ontology()
+    scores = score_columns(patient, cols, onto)
+    return top_order(scores, topk), scores
+
+@timed("rerank")
+def rerank(patient: Dict[str, Any], doctors: List[Any], id_to_sim: Dict[int, float],
+           topk: Optional[int] = None) -> List[Dict[str, Any]]:
     """
-    patient = {"symptoms","history","city","pincode","languages"}
+    patient = {"symptoms","history","city","pincode","languages"[,"lat","lon"]}
     doctors = list of Doctor instances
     id_to_sim = {pk: faiss_similarity}  # kept for debugging; not used in score
+    topk = keep only the best k (None = all)
     returns list of {doctor, score, faiss_sim} sorted desc
     """
+    if not doctors:
+        return []
     onto = get_ontology()
-    inferred = onto.infer_from_text(patient.get("symptoms",""), patient.get("history",""))
-
-    # Precompute YOE normalization over the candidate set
-    y_values = [getattr(d, "years_of_experience", 0) or 0 for d in doctors]
-    y_norm_map = _norm_yoe(y_values)
-
-    out = []
-    for d in doctors:
-        spec = onto.score(inferred, getattr(d, "specialties", []) or [])
-        prox = _proximity_score(patient.get("city",""), patient.get("pincode",""),
-                                getattr(d, "city",""), getattr(d, "pincode",""))
-        yoe_raw = getattr(d, "years_of_experience", 0) or 0
-        y = y_norm_map.get(yoe_raw, 0.0)
-        lang = _language_score(patient.get("languages", []), getattr(d, "languages", []) or [])
-
-        score = W_SPEC*spec + W_PROX*prox + W_YOE*y + W_LANG*lang
-        out.append({
-            "doctor": d,
-            "score": float(score),
-            "faiss_sim": float(id_to_sim.get(d.pk, 0.0)),
-        })
-
-    out.sort(key=lambda x: x["score"], reverse=True)
-    return out
+    scores = score_columns(patient, candidate_columns(doctors, onto), onto)
+    return [
+        {
+            "doctor": doctors[i],
+            "score": float(scores[i]),
+            "faiss_sim": float(id_to_sim.get(doctors[i].pk, 0.0)),
+        }
+        for i in top_order(scores, topk).tolist()
+    ]
@@ -0,0 +1,210 @@
+# search/response_cache.py
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .doctor_store import DoctorAttributeStore
+from .embedding import _normalize_text
+from .faiss_store import index_generation
+from .ontology import get_ontology
+
+# "local" (per-process LRU), "django" (settings.CACHES[SEARCH_RESPONSE_CACHE_ALIAS],
+# shared across workers) or "off".
+BACKENDS = ("local", "django", "off")
+_BACKEND = str(getattr(settings, "SEARCH_RESPONSE_CACHE_BACKEND", "local")).lower()
+_TTL_S = float(getattr(settings, "SEARCH_RESPONSE_CACHE_TTL_S", 60.0))
+_MAX_ENTRIES = int(getattr(settings, "SEARCH_RESPONSE_CACHE_MAX_ENTRIES", 2048))
+_ALIAS = getattr(settings, "SEARCH_RESPONSE_CACHE_ALIAS", "default")
+
+_KEY_PREFIX = "search:resp:"
+
+
+def request_key(patient: Dict[str, Any], topk: int, filters: Any) -> str:
+    """
+    Canonical identity of a parsed search request against the current index
+    generation and ontology: requests with equal keys get identical results.
+    """
+    canon = [
+        _normalize_text(patient.get("symptoms", "")),
+        _normalize_text(patient.get("history", "")),
+        (patient.get("city") or "").strip().lower(),
+        patient.get("pincode") or "",
+        sorted({str(l) for l in patient.get("languages") or []}),
+        patient.get("lat"),
+        patient.get("lon"),
+        int(topk),
+        list(filters) if filters else None,
+        index_generation(),
+        get_ontology().version,
+    ]
+    raw = json.dumps(canon, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class _LocalBackend:
+    """Thread-safe LRU with per-entry expiry."""
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, int(max_entries))
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, value: Any, ttl_s: float) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl_s, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class _DjangoBackend:
+    """Adapter over a Django cache alias; its own MAX_ENTRIES/culling bounds size."""
+    def __init__(self, alias: str):
+        from django.core.cache import caches
+        self._cache = caches[alias]
+        self.evictions = 0
+
+    def get(self, key: str) -> Any:
+        return self._cache.get(_KEY_PREFIX + key)
+
+    def set(self, key: str, value: Any, ttl_s: float) -> None:
+        self._cache.set(_KEY_PREFIX + key, value, timeout=ttl_s)
+
+    def delete(self, key: str) -> None:
+        self._cache.delete(_KEY_PREFIX + key)
+
+    def clear(self) -> None:
+        pass  # shared cache: entries age out via TTL and the generation in their keys
+
+    def __len__(self) -> int:
+        return 0  # not tracked for shared caches
+
+
+class SearchResponseCache:
+    """
+    Ranked search results keyed on the canonicalized request (request_key()).
+
+    The key folds in the index generation and ontology version, so any index
+    change (in any process) makes older entries unreachable. Each entry also
+    records the fingerprints of the doctors it was ranked from (the FAISS
+    candidate window) and, for filtered queries, of the filter's match set;
+    a hit whose doctors have changed since is treated as a miss.
+    """
+    def __init__(self, backend: Any, ttl_s: float = _TTL_S):
+        self.backend = backend
+        self.ttl_s = max(0.0, float(ttl_s))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.stores = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None and self.ttl_s > 0
+
+    @staticmethod
+    def _filter_fp(store: DoctorAttributeStore, filters: Any) -> int:
+        return zlib.crc32(store.filter_pks(*filters).tobytes()) if filters else 0
+
+    def get(self, key: str, store: DoctorAttributeStore, filters: Any = None) -> Optional[List[Dict[str, Any]]]:
+        entry = self.backend.get(key) if self.enabled else None
+        fresh = (
+            entry is not None
+            and np.array_equal(store.fingerprints(entry["pks"]), entry["fps"])
+            and self._filter_fp(store, filters) == entry["filter_fp"]
+        )
+        with self._lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.stale += entry is not None
+        if entry is not None and not fresh:
+            self.backend.delete(key)
+        return entry["results"] if fresh else None
+
+    def put(self, key: str, results: List[Dict[str, Any]], store: DoctorAttributeStore,
+            candidate_pks: List[int], filters: Any = None) -> None:
+        if not self.enabled:
+            return
+        pks = np.asarray(candidate_pks, dtype=np.int64)
+        self.backend.set(key, {
+            "results": results,
+            "pks": pks,
+            "fps": store.fingerprints(pks),
+            "filter_fp": self._filter_fp(store, filters),
+        }, self.ttl_s)
+        with self._lock:
+            self.stores += 1
+
+    def clear(self) -> None:
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": _BACKEND,
+                "entries": len(self.backend) if self.backend is not None else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "stores": self.stores,
+                "evictions": getattr(self.backend, "evictions", 0),
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+def _make_backend() -> Any:
+    if _BACKEND not in BACKENDS:
+        raise ImproperlyConfigured(f"SEARCH_RESPONSE_CACHE_BACKEND must be one of {BACKENDS}, got {_BACKEND!r}")
+    if _BACKEND == "local":
+        return _LocalBackend(_MAX_ENTRIES)
+    if _BACKEND == "django":
+        return _DjangoBackend(_ALIAS)
+    return None
+
+
+_CACHE = SearchResponseCache(_make_backend())
+
+
+def get_response_cache() -> SearchResponseCache:
+    return _CACHE
+
+
+def response_cache_stats() -> Dict[str, float]:
+    return _CACHE.stats()
@@ -3,23 +3,53 @@ from __future__ import annotations
 from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 
-from .faiss_store import upsert_doctor_vector, remove_doctor_vector
+from .doctor_store import _STORE as _doctor_store
+from .indexer import enqueue_upsert, enqueue_remove, note_skipped
 
-def _on_doctor_saved(sender, instance, **kwargs):
+def _indexed(text_block, is_active) -> bool:
+    return bool(is_active and text_block)
+
+def _on_doctor_saved(sender, instance, created=False, **kwargs):
     """
-    After a doctor row is saved, update the FAISS index.
-    We wait for the DB commit to succeed before touching the index.
+    After a doctor row is saved, queue a FAISS index update.
+    We wait for the DB commit to succeed before queueing; the background
+    indexer embeds and applies queued doctors in batches.
+    Saves that leave text_block and is_active as they were (per
+    Doctor.tracked_changes) skip the index entirely; otherwise the doctor
+    is upserted or removed depending on whether it should now be indexed.
     """
+    pk = instance.pk
+    text_block = getattr(instance, "text_block", "")
+    now_in = _indexed(text_block, getattr(instance, "is_active", True))
+
+    action = "upsert" if now_in else "remove"
+    changes = getattr(instance, "_saved_changes", None)
+    if changes is not None and not created:
+        old = {f: getattr(instance, f) for f in ("text_block", "is_active")}
+        old.update({f: prev for f, (prev, _) in changes.items()})
+        was_in = _indexed(old["text_block"], old["is_active"])
+        if now_in == was_in and (not now_in or old["text_block"] == text_block):
+            action = None
+
     def _do():
-        if getattr(instance, "is_active", True) and getattr(instance, "text_block", ""):
-            upsert_doctor_vector(instance.pk, instance.text_block)
+        _doctor_store.upsert_instance(instance)
+        if action == "upsert":
+            enqueue_upsert(pk, text_block)
+        elif action == "remove":
+            enqueue_remove(pk)
         else:
-            remove_doctor_vector(instance.pk)
+            note_skipped()
 
     transaction.on_commit(_do)
 
 def _on_doctor_deleted(sender, instance, **kwargs):
-    transaction.on_commit(lambda: remove_doctor_vector(instance.pk))
+    pk = instance.pk
+
+    def _do():
+        _doctor_store.remove(pk)
+        enqueue_remove(pk)
+
+    transaction.on_commit(_do)
 
 def bind_doctor_signals(DoctorModel):
     """
@@ -0,0 +1,64 @@
+# search/singleflight.py
+from __future__ import annotations
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Tuple
+import threading
+
+
+class SingleFlight:
+    """
+    Request coalescing: while a computation for a key is in flight, callers
+    asking for the same key wait on the leader's Future instead of repeating
+    the work. Keys leave the table as soon as the leader finishes, so
+    nothing is cached here (see search.response_cache for that).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def claim(self, key: str) -> Tuple[Future, bool]:
+        """
+        (future, is_leader). The leader must call finish() exactly once;
+        followers only wait on the future (or asyncio.wrap_future it).
+        """
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self.followers += 1
+                return fut, False
+            fut = self._inflight[key] = Future()
+            self.leaders += 1
+            return fut, True
+
+    def finish(self, key: str, fut: Future, result: Any = None,
+               error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.leaders + self.followers
+            return {
+                "in_flight": len(self._inflight),
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "shared_rate": (self.followers / total) if total else 0.0,
+            }
+
+
+_SEARCHES = SingleFlight()
+
+
+def get_search_flight() -> SingleFlight:
+    return _SEARCHES
+
+
+def search_singleflight_stats() -> Dict[str, float]:
+    return _SEARCHES.stats()
@@ -1,3 +1,722 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from . import faiss_store
+from .api_views import NearbyDoctorsView, _parse_query, _rank, _retrieve, _serve
+from .doctor_store import DoctorAttributeStore
+from .embedding import EmbeddingCache, encode
+from .faiss_store import _DoctorModel
+from .geo import GeoGrid, haversine_km
+from .indexer import IndexingQueue
+from .models import PatientQueryLog
+from .ontology import SpecialtyOntology, _OntologyRegistry
+from .query_log import QueryLogWriter
+from .rerank import _language_bits, _language_score, language_mask
+from .response_cache import SearchResponseCache, _LocalBackend, request_key
+from .singleflight import SingleFlight
+
+
+DIM = 16
+
+
+def unit_rows(rng, n):
+    X = rng.standard_normal((n, DIM)).astype("float32")
+    return X / np.linalg.norm(X, axis=1, keepdims=True)
+
+
+class TempIndexMixin:
+    """Serve the FAISS index from a fresh temp dir, at dimension DIM, without background compaction."""
+
+    def setUp(self):
+        super().setUp()
+        tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp, True)
+        names = [n for n in vars(faiss_store) if n.endswith("_PATH") and isinstance(getattr(faiss_store, n), Path)]
+        patches = [mock.patch.object(faiss_store, n, tmp / getattr(faiss_store, n).name) for n in names]
+        patches += [
+            mock.patch.object(faiss_store, "_INDEX_DIR", tmp),
+            mock.patch.object(faiss_store, "_SNAPSHOT", None),
+            mock.patch.object(faiss_store, "get_dim", return_value=DIM),
+            mock.patch.object(faiss_store, "_maybe_compact"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def vec(self, i):
+        return np.full(DIM, i, dtype="float32")  # DIM * 4 bytes
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = EmbeddingCache(max_entries=2, max_bytes=1 << 20)
+        cache.put("a", self.vec(1))
+        cache.put("b", self.vec(2))
+        cache.get("a")
+        cache.put("c", self.vec(3))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a")[0], cache.get("c")[0]), (1, 3))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_byte_bound(self):
+        cache = EmbeddingCache(max_entries=100, max_bytes=3 * DIM * 4)
+        for i in range(4):
+            cache.put(i, self.vec(i))
+        self.assertEqual((cache.stats()["entries"], cache.stats()["bytes"]), (3, 3 * DIM * 4))
+        self.assertIsNone(cache.get(0))
+        cache.put("big", np.zeros(4 * DIM, dtype="float32"))  # larger than the whole budget: not cached
+        self.assertIsNone(cache.get("big"))
+        self.assertEqual(cache.stats()["entries"], 3)
+
+    def test_encode_keys_on_normalized_text_and_model(self):
+        encoded, model = [], ["model-a"]
+
+        def fake_encode_model(texts, batch_size):
+            encoded.extend(texts)
+            return unit_rows(np.random.default_rng(len(encoded)), len(texts))
+
+        with mock.patch("search.embedding._CACHE", EmbeddingCache(16, 1 << 20)), \
+                mock.patch("search.embedding._encode_model", fake_encode_model), \
+                mock.patch("search.embedding.get_model_name", lambda: model[0]), \
+                mock.patch("search.embedding.get_dim", return_value=DIM):
+            first = encode(["knee pain", "knee  pain ", "back pain"], use_cache=True)
+            self.assertEqual(encoded, ["knee pain", "back pain"])
+            np.testing.assert_array_equal(first[0], first[1])
+            np.testing.assert_array_equal(encode([" knee pain"], use_cache=True)[0], first[0])
+            self.assertEqual(len(encoded), 2)
+
+            model[0] = "model-b"
+            encode(["knee pain"], use_cache=True)
+            self.assertEqual(len(encoded), 3)
+
+
+class OntologyInferenceTests(SimpleTestCase):
+    def setUp(self):
+        self.onto = SpecialtyOntology({
+            "specialties": {"Cardiology": ["Heart Failure"], "ENT": []},
+            "synonyms": {"heart": ["Cardiology"]},
+        })
+
+    def test_overlapping_needles_at_same_position(self):
+        # "heart" starts where "heart failure" starts; both must be reported
+        self.assertEqual(self.onto.infer_from_text("heart failure", ""), ["Cardiology", "Heart Failure"])
+
+    def test_whole_tokens_only(self):
+        self.assertEqual(self.onto.infer_from_text("ongoing treatment", ""), [])
+        self.assertEqual(self.onto.infer_from_text("", "saw an ENT"), ["ENT"])
+
+    def test_closure_over_token_runs(self):
+        onto = SpecialtyOntology({
+            "specialties": {"ENT": [], "Cardiology": []},
+            "synonyms": {"ear-nose-throat": ["ENT"], "nose": ["Rhinology"], "heart": ["Cardiology"],
+                         "ear": ["Otology"], "rt": ["Radiotherapy"]},
+        })
+        targets = onto._matcher._targets
+        self.assertEqual(targets["ear-nose-throat"], ("ENT", "Otology", "Rhinology"))
+        self.assertEqual(targets["heart"], ("Cardiology",))  # "ear" and "rt" aren't whole tokens of it
+        self.assertEqual(onto.infer_from_text("ear-nose-throat clinic", ""), ["ENT", "Otology", "Rhinology"])
+
+
+class OntologyRegistryTests(SimpleTestCase):
+    def test_readers_keep_the_current_version_while_another_thread_reloads(self):
+        registry = _OntologyRegistry(check_interval=0.0)
+        onto = registry.get()
+        with registry._lock:  # a reload in progress elsewhere
+            self.assertIs(registry.get(), onto)
+
+
+class LanguageMaskTests(SimpleTestCase):
+    def test_unknown_codes_get_no_bit(self):
+        before = dict(_language_bits())
+        masks = {language_mask([f"x{i}"]) for i in range(100)}
+        self.assertEqual(masks, {0})
+        self.assertEqual(_language_bits(), before)
+        self.assertEqual(language_mask(["en", "x7"]), language_mask(["en"]))
+
+    def test_mask_agrees_with_scalar_score(self):
+        for p_langs in (["x7"], ["en"], ["hi", "x7"], [], None):
+            for d_langs in (["en"], ["x7"], ["en", "hi"]):
+                overlap = (language_mask(p_langs) & language_mask(d_langs)) != 0
+                self.assertEqual(float(overlap), _language_score(p_langs, d_langs), (p_langs, d_langs))
+
+
+def doctor_record(pk, **fields):
+    return {"pk": pk, "specialties": ["Cardiology"], "years_of_experience": 5, "city": "Pune",
+            "languages": ["en"], "is_active": True, **fields}
+
+
+class FilterPksTests(SimpleTestCase):
+    def setUp(self):
+        self.store = DoctorAttributeStore()
+        self.store.upsert(doctor_record(1))
+        self.store.upsert(doctor_record(2, languages=["hi"]))
+        self.store.upsert(doctor_record(3, city="Delhi"))
+
+    def test_unsupported_languages_filter_is_not_the_no_filter_entry(self):
+        self.assertEqual(self.store.filter_pks("pune", "", ("xx",)).tolist(), [])
+        self.assertEqual(self.store.filter_pks("pune", "", ()).tolist(), [1, 2])
+        self.assertEqual(self.store.filter_pks("pune", "", ("xx",)).tolist(), [])
+
+    def test_language_filter_is_any_of(self):
+        self.assertEqual(self.store.filter_pks("pune", "", ("hi", "xx")).tolist(), [2])
+        self.assertEqual(self.store.filter_pks("", "", ("en", "hi")).tolist(), [1, 2, 3])
+
+    def test_bitmap_is_cached_with_the_filter_until_the_store_changes(self):
+        bitmap = self.store.filter_bitmap("pune")
+        self.assertEqual(faiss_store._has_ids(bitmap, np.arange(5)).tolist(), [False, True, True, False, False])
+        self.assertIs(self.store.filter_bitmap("pune"), bitmap)
+        self.store.upsert(doctor_record(4))
+        self.assertTrue(faiss_store._has_ids(self.store.filter_bitmap("pune"), np.array([4]))[0])
+
+    def test_language_codes_come_from_the_setting(self):
+        with mock.patch("search.rerank._LANG_BITS", None), mock.patch("search.rerank._LANGUAGE_CODES", ["hi"]):
+            store = DoctorAttributeStore()
+            store.upsert(doctor_record(1))
+            store.upsert(doctor_record(2, languages=["hi"]))
+            self.assertEqual(store.filter_pks("", "", ("en",)).tolist(), [])
+            self.assertEqual(store.filter_pks("", "", ("en", "hi")).tolist(), [2])
+
+    def test_missing_language_codes_are_a_configuration_error(self):
+        for codes in ("myapp.models.NO_SUCH_CODES", []):
+            with mock.patch("search.rerank._LANG_BITS", None), mock.patch("search.rerank._LANGUAGE_CODES", codes):
+                with self.assertRaises(ImproperlyConfigured):
+                    DoctorAttributeStore().filter_pks("", "", ("en",))
+
+
+class GeoGridTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.lat, self.lon = rng.uniform(-89.9, 89.9, 3000), rng.uniform(-180, 180, 3000)
+        self.queries = [(rng.uniform(-89.9, 89.9), rng.uniform(-180, 180), rng.uniform(1, 800)) for _ in range(500)]
+        self.queries += [(0.0, 179.9, 50.0), (0.0, -179.9, 50.0), (89.8, 0.0, 50.0), (-89.8, 10.0, 50.0)]
+
+    def test_candidates_cover_every_point_in_the_radius(self):
+        for cell_deg in (0.25, 1.0):
+            grid = GeoGrid(cell_deg)
+            for row, (lat, lon) in enumerate(zip(self.lat, self.lon)):
+                grid.put(row, lat, lon)
+            for lat, lon, radius in self.queries:
+                within = np.flatnonzero(haversine_km(lat, lon, self.lat, self.lon) <= radius)
+                missed = set(within.tolist()) - set(grid.candidates(lat, lon, radius).tolist())
+                self.assertFalse(missed, (cell_deg, lat, lon, radius))
+
+    def test_store_within_matches_a_full_scan(self):
+        store = DoctorAttributeStore()
+        for pk, (lat, lon) in enumerate(zip(self.lat, self.lon), start=1):
+            store.upsert(doctor_record(pk, latitude=lat, longitude=lon, is_active=pk % 7 != 0))
+        active = np.arange(1, len(self.lat) + 1) % 7 != 0
+        for lat, lon, radius in self.queries[:100]:
+            dist = haversine_km(lat, lon, self.lat, self.lon)
+            want = np.flatnonzero((dist <= radius) & active)
+            rows, got = store.within(lat, lon, radius)
+            self.assertEqual(sorted(store.pk[rows].tolist()), sorted((want + 1).tolist()))
+            np.testing.assert_allclose(got, np.sort(dist[want]))
+
+
+class NearbyDoctorsViewTests(SimpleTestCase):
+    def setUp(self):
+        self.store = DoctorAttributeStore()
+        self.store.upsert(doctor_record(1, latitude=18.94, longitude=72.83))
+        self.store.upsert(doctor_record(2, latitude=18.97, longitude=72.83))  # ~3.3 km north
+        patcher = mock.patch("search.api_views.get_doctor_store", return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def nearby(self, **params):
+        request = APIRequestFactory().get("/api/doctors/nearby", {"latitude": 18.94, "longitude": 72.83, **params})
+        return NearbyDoctorsView.as_view()(request)
+
+    def test_radius_defaults_only_when_absent(self):
+        self.assertEqual([r["doctor_id"] for r in self.nearby().data["results"]], [1, 2])
+        self.assertEqual([r["doctor_id"] for r in self.nearby(radius_km=0).data["results"]], [1])
+
+    def test_negative_or_non_finite_radius_is_rejected(self):
+        for radius in ("-1", "nan", "inf", "far"):
+            self.assertEqual(self.nearby(radius_km=radius).status_code, 400, radius)
+
+
+class ResponseCacheTests(SimpleTestCase):
+    patient = {"symptoms": "Chest pain", "city": "Pune", "languages": ["en"]}
+
+    def setUp(self):
+        self.store = DoctorAttributeStore()
+        for pk in (1, 2, 3):
+            self.store.upsert(doctor_record(pk))
+        self.cache = SearchResponseCache(_LocalBackend(16), ttl_s=60)
+        self.results = [{"doctor_id": 1}]
+
+    def key(self, generation=1, ontology_version="v1", **patient):
+        ontology = mock.Mock(version=ontology_version)
+        with mock.patch("search.response_cache.index_generation", return_value=generation), \
+                mock.patch("search.response_cache.get_ontology", return_value=ontology):
+            return request_key({**self.patient, **patient}, 5, None)
+
+    def test_equivalent_requests_share_a_key(self):
+        self.assertEqual(self.key(), self.key(symptoms=" Chest\n pain ", city="pune ", languages=["en", "en"]))
+        self.assertNotEqual(self.key(), self.key(symptoms="chest pain"))
+
+    def test_index_generation_and_ontology_version_change_the_key(self):
+        self.cache.put(self.key(), self.results, self.store, [1, 2])
+        self.assertEqual(self.cache.get(self.key(), self.store), self.results)
+        self.assertIsNone(self.cache.get(self.key(generation=2), self.store))
+        self.assertIsNone(self.cache.get(self.key(ontology_version="v2"), self.store))
+
+    def test_changed_candidate_is_a_stale_miss(self):
+        key = self.key()
+        self.cache.put(key, self.results, self.store, [1, 2])
+        self.store.upsert(doctor_record(2, years_of_experience=20))
+        self.assertIsNone(self.cache.get(key, self.store))
+        self.assertEqual(self.cache.stats()["stale"], 1)
+        self.assertIsNone(self.cache.get(key, self.store))  # dropped, not just skipped
+        self.assertEqual(self.cache.stats()["stale"], 1)
+
+    def test_change_to_the_filter_match_set_is_a_miss(self):
+        key, filters = self.key(), ("pune", "", ())
+        self.cache.put(key, self.results, self.store, [1], filters)
+        self.store.upsert(doctor_record(4))  # outside the candidates, inside the filter
+        self.assertIsNone(self.cache.get(key, self.store, filters))
+
+
+class CoalescingTests(SimpleTestCase):
+    """_serve: identical misses in flight at once are searched once."""
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.calls, self.release, self.error = [], threading.Event(), None
+        for target, fake in (("_cached", self.fake_cached), ("_search", self.fake_search),
+                             ("get_search_flight", lambda: self.flight)):
+            patcher = mock.patch(f"search.api_views.{target}", fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def fake_cached(store, parsed):
+        return [patient["symptoms"] for patient, _, _ in parsed], [None] * len(parsed)
+
+    def fake_search(self, store, parsed, keys):
+        self.calls.append(keys)
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return [[{"doctor_id": key}] for key in keys]
+
+    def serve_in_thread(self, *queries):
+        out = {}
+
+        def run():
+            try:
+                out["results"] = _serve(None, [({"symptoms": q}, 5, None) for q in queries])
+            except Exception as e:
+                out["error"] = e
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, out
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertTrue(condition())
+
+    def test_identical_misses_share_one_search(self):
+        leader, first = self.serve_in_thread("knee", "knee")
+        self.wait_for(lambda: self.calls)
+        follower, second = self.serve_in_thread("knee")
+        self.wait_for(lambda: self.flight.followers == 1)
+        self.release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(self.calls, [["knee"]])
+        self.assertEqual(first["results"], [[{"doctor_id": "knee"}]] * 2)
+        self.assertEqual(second["results"], [[{"doctor_id": "knee"}]])
+        self.assertEqual(self.flight.stats()["in_flight"], 0)
+
+    def test_followers_get_the_leaders_error(self):
+        self.error = RuntimeError("index unavailable")
+        leader, first = self.serve_in_thread("knee")
+        self.wait_for(lambda: self.calls)
+        follower, second = self.serve_in_thread("knee")
+        self.wait_for(lambda: self.flight.followers == 1)
+        self.release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertIs(first["error"], self.error)
+        self.assertIs(second["error"], self.error)
+
+        self.error = None  # the failed key isn't left in flight
+        self.assertEqual(_serve(None, [({"symptoms": "knee"}, 5, None)]), [[{"doctor_id": "knee"}]])
+        self.assertEqual(len(self.calls), 2)
+
+
+class DoctorStoreSyncTests(TestCase):
+    """Changes made without this process's signals (i.e. by another worker)."""
+
+    def make_doctor(self, username, **fields):
+        user = User.objects.create(username=username)
+        return _DoctorModel().objects.create(user=user, license_number=username, **fields)
+
+    def setUp(self):
+        self.first = self.make_doctor("first", city="Pune", languages=["en"])
+        self.store = DoctorAttributeStore()
+        self.store.load()
+
+    def test_select_fetches_unknown_pks(self):
+        other = self.make_doctor("other", city="Delhi")
+        rows = self.store.select([other.pk, self.first.pk, 999999])
+        self.assertEqual([r["doctor_id"] for r in self.store.records(rows)], [other.pk, self.first.pk])
+
+    def test_pks_missing_from_the_db_are_queried_once_per_sync(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.store.select([999999]).size, 0)
+            self.assertEqual(self.store.select([999999, self.first.pk]).size, 1)
+        self.store.sync()
+        with self.assertNumQueries(1):
+            self.store.select([999999])
+
+    def test_sync_runs_off_the_request_thread(self):
+        started, release, calls = threading.Event(), threading.Event(), []
+
+        def slow_sync():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+
+        with mock.patch.object(self.store, "sync", slow_sync), mock.patch("search.doctor_store._SYNC_S", 0):
+            self.store.maybe_sync()
+            self.assertTrue(started.wait(5))
+            self.store.maybe_sync()  # one at a time; doesn't wait for the running one
+            release.set()
+            self.assertTrue(self.store._sync_lock.acquire(timeout=5))
+            self.store._sync_lock.release()
+        self.assertEqual(len(calls), 1)
+
+    def test_sync_picks_up_edits_and_deletes(self):
+        Doctor = _DoctorModel()
+        Doctor.objects.filter(pk=self.first.pk).update(city="Mumbai", languages=["hi"], updated_at=timezone.now())
+        other = self.make_doctor("other", city="Mumbai", is_active=False)
+        self.store.sync()
+        self.assertEqual(self.store.filter_pks(city="mumbai", languages=["hi"]).tolist(), [self.first.pk])
+        self.assertEqual(self.store.select([other.pk]).size, 0)
+
+        Doctor.objects.filter(pk=other.pk).delete()
+        self.store.sync()
+        self.assertEqual(len(self.store), 1)
+
+
+class DoctorSaveSignalTests(TestCase):
+    """What a Doctor save asks the indexer to do, per Doctor.tracked_changes."""
+
+    def setUp(self):
+        self.actions = []
+        for name in ("enqueue_upsert", "enqueue_remove", "note_skipped"):
+            patcher = mock.patch(f"search.signals.{name}", lambda *args, name=name: self.actions.append((name, *args)))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor = _DoctorModel().objects.create(
+                user=User.objects.create(username="doc"), license_number="doc", about="Treats knees."
+            )
+        self.actions.clear()
+
+    def save(self, doctor, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor.save(**kwargs)
+        actions, self.actions = self.actions, []
+        return actions
+
+    def persisted_text(self):
+        return _DoctorModel().objects.values_list("text_block", flat=True).get(pk=self.doctor.pk)
+
+    def test_created(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor = _DoctorModel().objects.create(
+                user=User.objects.create(username="new"), license_number="new", about="Treats hips."
+            )
+        self.assertEqual(self.actions, [("enqueue_upsert", doctor.pk, doctor.text_block)])
+
+    def test_edit_outside_the_text_block_is_skipped(self):
+        self.doctor.phone = "12345"
+        self.assertEqual(self.save(self.doctor), [("note_skipped",)])
+
+    def test_text_edit_is_upserted(self):
+        self.doctor.about = "Treats shoulders."
+        self.assertEqual(self.save(self.doctor), [("enqueue_upsert", self.doctor.pk, self.persisted_text())])
+        self.assertIn("shoulders", self.persisted_text())
+
+    def test_deactivation_and_reactivation(self):
+        self.doctor.is_active = False
+        self.assertEqual(self.save(self.doctor), [("enqueue_remove", self.doctor.pk)])
+        self.doctor.is_active = True
+        self.assertEqual(self.save(self.doctor), [("enqueue_upsert", self.doctor.pk, self.persisted_text())])
+
+    def test_update_fields_without_text_sources_indexes_the_persisted_text(self):
+        doctor = _DoctorModel().objects.get(pk=self.doctor.pk)
+        doctor.about = "Treats shoulders."  # not saved below
+        doctor.phone = "12345"
+        self.assertEqual(self.save(doctor, update_fields=["phone"]), [("note_skipped",)])
+        self.assertIn("knees", self.persisted_text())
+
+        doctor.is_active = False
+        self.assertEqual(self.save(doctor, update_fields=["is_active"]), [("enqueue_remove", doctor.pk)])
+        doctor.is_active = True
+        self.assertEqual(
+            self.save(doctor, update_fields=["is_active"]), [("enqueue_upsert", doctor.pk, self.persisted_text())]
+        )
+        self.assertIn("knees", self.persisted_text())
+
+    def test_update_fields_with_a_text_source_writes_the_text_block(self):
+        doctor = _DoctorModel().objects.get(pk=self.doctor.pk)
+        doctor.about = "Treats shoulders."
+        self.assertEqual(self.save(doctor, update_fields=["about"]), [("enqueue_upsert", doctor.pk, self.persisted_text())])
+        self.assertIn("shoulders", self.persisted_text())
+
+    def test_deferred_text_block_counts_as_changed_when_written(self):
+        doctor = _DoctorModel().objects.defer("text_block").get(pk=self.doctor.pk)
+        doctor.phone = "12345"
+        self.assertEqual(self.save(doctor, update_fields=["phone"]), [("note_skipped",)])
+        doctor = _DoctorModel().objects.defer("text_block").get(pk=self.doctor.pk)
+        self.assertEqual(self.save(doctor), [("enqueue_upsert", doctor.pk, self.persisted_text())])
+
+
+class IndexSnapshotTests(TempIndexMixin, SimpleTestCase):
+    """Tombstone + delta versions over the base, compaction, and journal replay."""
+
+    def setUp(self):
+        super().setUp()
+        self.rng = np.random.default_rng(1)
+        self.X = unit_rows(self.rng, 60)
+        faiss_store.apply_vector_changes({pk: self.X[pk - 1] for pk in range(1, 61)})
+        faiss_store.compact_index()
+
+    def top(self, q, k=1):
+        return [pk for pk, _ in faiss_store.search_vectors(q[None, :], k)[0]]
+
+    def restart(self):
+        faiss_store._SNAPSHOT = None
+        return faiss_store.current_snapshot()
+
+    def test_filtered_search_over_tombstones_and_delta(self):
+        faiss_store.apply_vector_changes({5: unit_rows(self.rng, 1)[0], 6: None, 61: self.X[6]})
+        allowed = np.array([5, 6, 7, 8, 61])
+        bitmap = faiss_store._id_bitmap(allowed)
+        for q in self.X[:10]:
+            by_ids = faiss_store.search_vectors(q[None, :], 10, allowed_ids=allowed)[0]
+            self.assertEqual(faiss_store.search_vectors(q[None, :], 10, allowed_bitmap=bitmap)[0], by_ids)
+            self.assertEqual(sorted(pk for pk, _ in by_ids), [5, 7, 8, 61])
+
+    def test_upsert_and_delete_without_rewriting_the_base(self):
+        base = faiss_store.current_snapshot()
+        self.assertEqual((base.index.ntotal, base.n_dead), (60, 0))
+        new = unit_rows(self.rng, 1)[0]
+        faiss_store.apply_vector_changes({5: new, 7: None, 61: self.X[6]})
+
+        snap = faiss_store.current_snapshot()
+        self.assertIs(snap.index, base.index)
+        self.assertEqual((snap.n_dead, snap.delta.ntotal, snap.ntotal), (2, 2, 60))
+        self.assertEqual(self.top(new), [5])
+        sims = dict(faiss_store.search_vectors(self.X[4][None, :], 60)[0])
+        self.assertLess(sims[5], 0.99)  # the stale base vector is masked out
+        self.assertEqual(self.top(self.X[6]), [61])  # 7's twin; 7 itself is gone
+        self.assertNotIn(7, self.top(self.X[6], 60))
+        # Published versions are immutable: a search that started on `base` still sees 7
+        self.assertEqual(faiss_store._search_snapshot(base, self.X[6][None, :], 1)[1][0, 0], 7)
+
+    def test_compaction_folds_changes_into_the_base(self):
+        changes = {pk: (None if pk % 3 == 0 else unit_rows(self.rng, 1)[0]) for pk in range(1, 31)}
+        faiss_store.apply_vector_changes(changes)
+        Q = unit_rows(self.rng, 10)
+        before = faiss_store.search_vectors(Q, 10)
+
+        faiss_store.compact_index()
+        snap = faiss_store.current_snapshot()
+        self.assertEqual((snap.n_dead, snap.index.ntotal, snap.ntotal), (0, 50, 50))
+        self.assertEqual(faiss_store._WAL_PATH.stat().st_size, 0)
+        after = faiss_store.search_vectors(Q, 10)
+        self.assertEqual([[pk for pk, _ in r] for r in after], [[pk for pk, _ in r] for r in before])
+        self.assertEqual(self.restart().ntotal, 50)
+
+    def test_replay_stops_at_a_torn_record(self):
+        faiss_store.apply_vector_changes({3: None})
+        faiss_store.apply_vector_changes({4: None})
+        valid = faiss_store._WAL_PATH.stat().st_size
+        with open(faiss_store._WAL_PATH, "r+b") as fh:
+            fh.truncate(valid - 1)  # crash in the middle of the last append
+
+        snap = self.restart()
+        self.assertEqual(snap.ntotal, 59)
+        self.assertNotIn(3, self.top(self.X[2], 60))
+        self.assertEqual(self.top(self.X[3]), [4])
+        self.assertEqual(faiss_store._WAL_PATH.stat().st_size, snap.wal_pos)  # torn tail dropped
+
+        # Appends after the torn tail are replayed too
+        faiss_store.apply_vector_changes({5: None})
+        snap = self.restart()
+        self.assertEqual(snap.ntotal, 58)
+        self.assertNotIn(5, self.top(self.X[4], 60))
+
+    def test_append_after_a_torn_record_is_seen_everywhere(self):
+        faiss_store.apply_vector_changes({3: None})
+        behind = faiss_store.current_snapshot()  # another worker, last caught up here
+        with open(faiss_store._WAL_PATH, "ab") as fh:
+            fh.write(faiss_store._wal_record(b"U", 9, self.X[0])[:10])  # a writer crashed mid-append
+
+        faiss_store.apply_vector_changes({4: None})
+        self.assertEqual(faiss_store.current_snapshot().wal_pos, faiss_store._WAL_PATH.stat().st_size)
+
+        faiss_store._SNAPSHOT = behind
+        self.assertEqual(faiss_store.current_snapshot().ntotal, 58)
+        self.assertNotIn(4, self.top(self.X[3], 60))
+
+        faiss_store.compact_index()
+        self.assertEqual(faiss_store.current_snapshot().ntotal, 58)
+        snap = self.restart()
+        self.assertEqual(snap.ntotal, 58)
+        self.assertNotIn(4, self.top(self.X[3], 60))
+
+
+class BatchWindowTests(TempIndexMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(0)
+        self.store = DoctorAttributeStore()
+        for pk in range(1, 301):
+            self.store.upsert({
+                "pk": pk, "specialties": ["Cardiology"], "years_of_experience": int(rng.integers(0, 40)),
+                "city": "Pune" if pk % 3 else "Delhi", "languages": ["en"], "is_active": pk % 7 != 0,
+            })
+        faiss_store.apply_vector_changes(dict(zip(range(1, 301), unit_rows(rng, 300))))
+        self.Q = unit_rows(rng, 2)
+
+    def test_query_ranks_the_same_alone_and_in_a_batch(self):
+        small = _parse_query({"symptoms": "chest pain", "city": "Pune", "topk": 2})
+        large = _parse_query({"symptoms": "palpitations", "topk": 50})
+        alone = _retrieve(self.store, [small], Q=self.Q[:1])[0]
+        batched = _retrieve(self.store, [small, large], Q=self.Q)[0]
+        self.assertEqual(alone, batched)
+        self.assertEqual(_rank(self.store, small[0], alone, 2), _rank(self.store, small[0], batched, 2))
+
+
+class QueryLogWriterTests(TestCase):
+    def writer(self, **kwargs):
+        # The background flush never fires within a test; flush() writes on this thread
+        return QueryLogWriter(**{"capacity": 3, "batch_size": 2, "flush_s": 3600, "sample_rate": 1.0, **kwargs})
+
+    def test_full_buffer_drops_the_oldest(self):
+        writer = self.writer()
+        for i in range(5):
+            writer.record({"raw_text": f"q{i}"})
+        self.assertEqual(writer.stats()["dropped_overflow"], 2)
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(sorted(PatientQueryLog.objects.values_list("raw_text", flat=True)), ["q2", "q3", "q4"])
+        stats = writer.stats()
+        self.assertEqual((stats["recorded"], stats["written"], stats["flushes"], stats["buffered"]), (5, 3, 2, 0))
+
+    def test_failed_write_is_counted_and_dropped(self):
+        writer = self.writer()
+        for i in range(3):
+            writer.record({"raw_text": f"q{i}"})
+        with mock.patch.object(PatientQueryLog.objects, "bulk_create", side_effect=RuntimeError("db down")), \
+                self.assertLogs("search.query_log", "ERROR"):
+            self.assertTrue(writer.flush(timeout=5))
+        stats = writer.stats()
+        self.assertEqual((stats["write_errors"], stats["dropped_errors"], stats["written"]), (2, 3, 0))
+        self.assertFalse(PatientQueryLog.objects.exists())
+
+    def test_sampled_out_searches_are_counted(self):
+        writer = self.writer(sample_rate=0.0)
+        self.assertFalse(writer.record({"raw_text": "q"}))
+        self.assertEqual((writer.stats()["sampled_out"], writer.stats()["buffered"]), (1, 0))
+
+
+class RebuildResumeTests(TempIndexMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctors = [
+            _DoctorModel().objects.create(user=User.objects.create(username=f"d{i}"), license_number=f"d{i}",
+                                          about=f"Doctor number {i}.")
+            for i in range(8)
+        ]
+        self.encoded, self.fail_on = [], None
+        for target, value in (("encode_documents", self.fake_encode), ("_CHECKPOINT_EVERY", 2)):
+            patcher = mock.patch.object(faiss_store, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_encode(self, texts, batch_size=None):
+        if self.fail_on in texts:
+            raise RuntimeError("encoder crashed")
+        self.encoded += texts
+        return unit_rows(np.random.default_rng(len(texts[0])), len(texts))
+
+    def test_resume_continues_after_the_last_checkpoint(self):
+        texts = [d.text_block for d in self.doctors]
+        self.fail_on = texts[4]
+        with self.assertRaises(RuntimeError):
+            faiss_store.rebuild_index(batch_size=2, workers=1)
+        self.assertTrue(faiss_store._CKPT_META_PATH.exists())
+
+        self.fail_on, self.encoded = None, []
+        index = faiss_store.rebuild_index(batch_size=2, workers=1, resume=True)
+        self.assertEqual(self.encoded, texts[4:])
+        self.assertEqual(index.ntotal, len(self.doctors))
+        self.assertEqual(sorted(faiss_store._index_ids(index).tolist()), sorted(d.pk for d in self.doctors))
+        self.assertFalse(faiss_store._CKPT_META_PATH.exists())
+
+    def test_without_resume_the_checkpoint_is_discarded(self):
+        self.fail_on = self.doctors[4].text_block
+        with self.assertRaises(RuntimeError):
+            faiss_store.rebuild_index(batch_size=2, workers=1)
+        self.fail_on, self.encoded = None, []
+        faiss_store.rebuild_index(batch_size=2, workers=1)
+        self.assertEqual(len(self.encoded), len(self.doctors))
+
+
+class IndexingQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.calls = []
+        self.bad = set()
+
+        def apply(upserts, removes, batch_size=None):
+            if self.bad & (set(upserts) | set(removes)):
+                raise RuntimeError("bad record")
+            self.calls.append(sorted([*upserts, *removes]))
+
+        for p in (mock.patch("search.indexer.apply_doctor_changes", apply),
+                  mock.patch("search.indexer._RETRY_DELAY_S", 0)):
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_burst_within_the_debounce_window_is_one_batch(self):
+        queue = IndexingQueue(batch_size=64, debounce_s=0.3)
+        for pk in range(1, 6):
+            queue.upsert(pk, f"doc {pk}")
+            time.sleep(0.01)
+        deadline = time.monotonic() + 5
+        while queue.stats()["batches"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.calls, [[1, 2, 3, 4, 5]])
+
+    def test_a_bad_record_is_dropped_after_retries(self):
+        queue = IndexingQueue(batch_size=64, debounce_s=60)
+        self.bad = {2}
+        for pk in (1, 2, 3):
+            queue.upsert(pk, f"doc {pk}")
+        queue.remove(4)
+        with self.assertLogs("search.indexer", "ERROR") as logs:
+            self.assertTrue(queue.drain(timeout=None))
+        self.assertIn("dropping the change for doctor 2 after 5 attempts", logs.output[-1])
+        self.assertEqual(sorted(pk for call in self.calls for pk in call), [1, 3, 4])
+        stats = queue.stats()
+        self.assertEqual((stats["depth"], stats["dropped"]), (0, 1))